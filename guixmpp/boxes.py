@@ -2,7 +2,7 @@
 #-*- coding:utf-8 -*-
 
 
-__all__ = 'Gravity', 'Box', 'Whitespace', 'Word', 'EscapeSeq', 'Row', 'Column', 'inf'
+__all__ = 'Gravity', 'Box', 'Whitespace', 'Word', 'EscapeSeq', 'Row', 'Column', 'inf', 'distribute_space'
 
 
 from enum import Enum
@@ -11,6 +11,11 @@ from os import environ
 
 _use_pango = environ.get('GUIXMPP_USE_PANGO', '1')
 
+try:
+	import numpy
+except ImportError: # NumPy is optional, only used for rows and columns with many children
+	numpy = None
+
 
 import gi
 if _use_pango == '1':
@@ -32,7 +37,75 @@ inf = float('inf')
 Gravity = Enum('Gravity', 'TOP_LEFT TOP TOP_RIGHT LEFT CENTER RIGHT BOTTOM_LEFT BOTTOM BOTTOM_RIGHT')
 
 
+"Rows and columns with at least this many children distribute space using NumPy arrays (if NumPy is installed). Below it, converting to arrays costs more than it saves (see utils/bench_flex.py)."
+vectorize_threshold = 200
+
+
+def distribute_space_scalar(available, minimums, grows, maximums):
+	"Distribute space item by item. See `distribute_space`."
+	
+	allocated = list(minimums)
+	extra_space = available - sum(allocated)
+	weights = sum(_grow for (_n, _grow) in enumerate(grows) if allocated[_n] < maximums[_n])
+	while extra_space > 0 and weights > 0:
+		for n in range(len(allocated)):
+			if allocated[n] >= maximums[n]: continue
+			allocated[n] += extra_space * grows[n] / weights
+			if allocated[n] > maximums[n]:
+				allocated[n] = maximums[n]
+		
+		remaining_space = available - sum(allocated)
+		if remaining_space >= extra_space: # rounding errors only, nothing grows anymore
+			break
+		extra_space = remaining_space
+		weights = sum(_grow for (_n, _grow) in enumerate(grows) if allocated[_n] < maximums[_n])
+	
+	return allocated
+
+
+def distribute_space_numpy(available, minimums, grows, maximums):
+	"Distribute space over the whole row at once using NumPy arrays. Same algorithm as `distribute_space_scalar`."
+	
+	allocated = numpy.array(minimums, dtype=float)
+	grows = numpy.asarray(grows, dtype=float)
+	maximums = numpy.asarray(maximums, dtype=float)
+	
+	growing = allocated < maximums
+	extra_space = available - allocated.sum()
+	weights = grows[growing].sum()
+	while extra_space > 0 and weights > 0:
+		allocated[growing] += extra_space * grows[growing] / weights
+		numpy.minimum(allocated, maximums, out=allocated)
+		
+		remaining_space = available - allocated.sum()
+		if remaining_space >= extra_space: # rounding errors only, nothing grows anymore
+			break
+		extra_space = remaining_space
+		growing = allocated < maximums
+		weights = grows[growing].sum()
+	
+	return allocated.tolist()
+
+
+def distribute_space(available, minimums, grows, maximums):
+	"""
+	Distribute `available` space among items with the provided minimal sizes, grow weights and maximal sizes.
+	Free space is shared in proportion to the weights. Items that reach their maximum are frozen
+	and the space left is distributed again among the rest, until no space or no growing items remain.
+	Returns the list of allocated sizes.
+	"""
+	
+	if numpy is not None and len(minimums) >= vectorize_threshold:
+		return distribute_space_numpy(available, minimums, grows, maximums)
+	else:
+		return distribute_space_scalar(available, minimums, grows, maximums)
+
+
 class Box:
+	"Layout box with size constraints. Boxes are created per word, so attributes live in slots instead of a per-instance dict."
+	
+	__slots__ = 'node', 'pseudoelement', 'inline', 'gravity', 'min_width', 'grow_width', 'max_width', 'min_height', 'grow_height', 'max_height', 'x_shift', 'y_shift'
+	
 	def __init__(self, node, pseudoelement, inline, gravity, width=None, min_width=0, grow_width=1, max_width=inf, height=None, min_height=0, grow_height=1, max_height=inf, x_shift=0, y_shift=0):
 		if not (hasattr(node, 'tag') or node is None):
 			raise ValueError(f"`node` must be an XML node or None, got {type(node)}.")
@@ -80,6 +153,8 @@ class Box:
 
 if __debug__:
 	class ColorfulBox(Box):
+		__slots__ = 'label', 'children'
+		
 		def __init__(self, label, children, *args, **kwargs):
 			self.label = label
 			self.children = children
@@ -168,12 +243,16 @@ if __debug__:
 
 
 class Whitespace(Box):
+	__slots__ = ()
+	
 	def render(self, model, view, ctx, pango_layout, box, callback, pointer=None):
 		if pointer: return []
 		pass
 
 
 class Word(Box):
+	__slots__ = 'text', 'dx', 'dy'
+	
 	def __init__(self, text, dx, dy, *args, **kwargs):
 		self.text = text
 		self.dx = dx
@@ -255,6 +334,8 @@ class Word(Box):
 
 
 class EscapeSeq(Box):
+	__slots__ = 'escape',
+	
 	def __init__(self, escape, *args, **kwargs):
 		self.escape = escape
 		super().__init__(*args, **kwargs)
@@ -268,6 +349,8 @@ class EscapeSeq(Box):
 
 
 class Row(Box):
+	__slots__ = 'children', 'number'
+	
 	def __init__(self, children, number, *args, **kwargs):
 		self.children = children
 		self.number = number
@@ -296,17 +379,7 @@ class Row(Box):
 		#ctx.save()
 		
 		lw = max(self.min_width, min(w, self.max_width))
-		allocated_space = [_child.min_width for _child in self.children]
-		extra_space = lw - sum(allocated_space)
-		weights = sum(_child.grow_width for (_n, _child) in enumerate(self.children) if allocated_space[_n] < _child.max_width)
-		while extra_space > 0 and weights > 0:
-			for n, child in enumerate(self.children):
-				if allocated_space[n] >= child.max_width: continue
-				allocated_space[n] += extra_space * child.grow_width / weights
-				if allocated_space[n] > child.max_width:
-					allocated_space[n] = child.max_width
-			extra_space = lw - sum(allocated_space)
-			weights = sum(_child.grow_width for (_n, _child) in enumerate(self.children) if allocated_space[_n] < _child.max_width)
+		allocated_space = distribute_space(lw, [_child.min_width for _child in self.children], [_child.grow_width for _child in self.children], [_child.max_width for _child in self.children])
 		
 		assert all(_x >= 0 for _x in allocated_space)
 		
@@ -383,6 +456,8 @@ class Row(Box):
 
 
 class Column(Box):
+	__slots__ = 'children', 'number'
+	
 	def __init__(self, children, number, *args, **kwargs):
 		self.children = children
 		self.number = number
@@ -410,17 +485,7 @@ class Column(Box):
 		#ctx.save()
 		
 		lh = max(self.min_height, min(h, self.max_height))
-		allocated_space = [_child.min_height for _child in self.children]
-		extra_space = lh - sum(allocated_space)
-		weights = sum(_child.grow_height for (_n, _child) in enumerate(self.children) if allocated_space[_n] < _child.max_height)
-		while extra_space > 0 and weights > 0:
-			for n, child in enumerate(self.children):
-				if allocated_space[n] >= child.max_height: continue
-				allocated_space[n] += extra_space * child.grow_height / weights
-				if allocated_space[n] > child.max_height:
-					allocated_space[n] = child.max_height
-			extra_space = lh - sum(allocated_space)
-			weights = sum(_child.grow_height for (_n, _child) in enumerate(self.children) if allocated_space[_n] < _child.max_height)
+		allocated_space = distribute_space(lh, [_child.min_height for _child in self.children], [_child.grow_height for _child in self.children], [_child.max_height for _child in self.children])
 		
 		if pointer:
 			nodes_under_pointer = []
@@ -476,3 +541,28 @@ class Column(Box):
 		yield from super().print_tree(level)
 		for child in self.children:
 			yield from child.print_tree(level + 1)
+
+
+if __debug__ and __name__ == '__main__':
+	from random import Random
+	from math import isclose
+	
+	assert distribute_space_scalar(10, [1, 1], [1, 1], [inf, inf]) == [5, 5]
+	assert distribute_space_scalar(10, [1, 1], [1, 3], [2, inf]) == [2, 8]
+	
+	if numpy is not None:
+		random = Random(0)
+		for n in range(500):
+			count = random.choice([1, 2, 3, 10, vectorize_threshold])
+			minimums = [random.choice([0, 0, random.uniform(0, 50)]) for _m in range(count)]
+			if n % 4 == 0: # equal weights
+				grows = [random.choice([0, 1, 2.5])] * count
+			else: # zero and negative weights mixed with positive ones
+				grows = [random.choice([0, 1, random.uniform(-2, 5)]) for _m in range(count)]
+			maximums = [random.choice([inf, _minimum, _minimum + random.uniform(0, 100)]) for _minimum in minimums]
+			available = random.uniform(0, 2 * sum(maximums) if inf not in maximums else 10000)
+			
+			scalar = distribute_space_scalar(available, minimums, grows, maximums)
+			vector = distribute_space_numpy(available, minimums, grows, maximums)
+			assert len(scalar) == len(vector) == count
+			assert all(isclose(_a, _b, rel_tol=1e-6, abs_tol=1e-6) for (_a, _b) in zip(scalar, vector)), (available, minimums, grows, maximums, scalar, vector)
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 
 
-__all__ = 'cached',
+__all__ = 'cached', 'uncache'
 
 
 from inspect import isgeneratorfunction
@@ -68,3 +68,19 @@ def cached(old_method):
 	
 	return new_method
 
+
+def uncache(self, objects):
+	"Drop the results of `cached` methods of `self` for calls that got any of `objects` as an argument, compared by identity. Return the number of results dropped."
+	
+	try:
+		method_cache = self.method_cache
+	except AttributeError:
+		return 0
+	
+	ids = frozenset(id(_object) for _object in objects)
+	dropped = 0
+	for cache in method_cache.values():
+		for key in [_key for _key in cache if any(id(_arg) in ids for _arg in _key[0])]:
+			del cache[key]
+			dropped += 1
+	return dropped
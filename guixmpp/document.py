@@ -5,18 +5,26 @@
 __all__ = 'DocumentModel',
 
 
-from collections import defaultdict
-from asyncio import gather, Lock, Event, TaskGroup, CancelledError, to_thread
+from collections import defaultdict, OrderedDict
+from asyncio import gather, shield, Lock, Event, TaskGroup, CancelledError, to_thread, get_running_loop
 from inspect import isawaitable
 from urllib.parse import urljoin, urlparse
+from time import perf_counter
+from hashlib import sha256
 
 
 if __name__ == '__main__':
 	from guixmpp.domevents import UIEvent, CustomEvent
 	from guixmpp.gtkaiopath import Path
+	from guixmpp.timing import ResourceTiming
+	from guixmpp.scheduler import DownloadScheduler, download_priority, link_kind
+	from guixmpp.caching import uncache
 else:
 	from .domevents import UIEvent, CustomEvent
 	from .gtkaiopath import Path
+	from .timing import ResourceTiming
+	from .scheduler import DownloadScheduler, download_priority, link_kind
+	from .caching import uncache
 
 
 class DocumentNotFound(Exception):
@@ -34,6 +42,15 @@ def unique(gen):
 class Model:
 	"A structure holding a collection of documents, capable of loading and unloading."
 	
+	"Seconds the pointer must stay over a hyperlink before its target is prefetched."
+	prefetch_dwell_time = 0.2
+	
+	"Number of prefetched documents kept until used. The least recently prefetched are dropped first."
+	prefetch_cache_size = 32
+	
+	"Kinds of subresources prefetched with a document. Images are left for the real load, as most hovered links are never followed."
+	prefetch_kinds = frozenset({'document', 'stylesheet', 'font', 'script', 'other'})
+	
 	@staticmethod
 	def features(name, *classes):
 		return type(name, (Model,) + classes, {})
@@ -41,7 +58,23 @@ class Model:
 	def __init__(self, *args, **kwargs):
 		self.documents = {}
 		self.emitted_warnings = set()
+		self.__views = set()
+		self.__users = defaultdict(set) # url -> views using the document, it is destroyed when the last one closes
+		self.__sizes = {} # url -> size of downloaded data
+		self.__contents = {} # (size, mime type) -> digest -> url of a document without links, reused for other urls with the same content
+		self.shared_content_counter = 0
 		self.__downloading = {}
+		self.__streaming = {} # url -> view, for documents being downloaded
+		self.__preloaded = {} # url -> task downloading a link found by a preload scanner
+		self.preload_counter = 0
+		self.preload_used_counter = 0
+		self.__prefetched = OrderedDict() # url -> document downloaded and parsed ahead of navigation
+		self.__prefetching = {} # url -> task prefetching the document
+		self.prefetch_hit_counter = 0
+		self.prefetch_miss_counter = 0
+		self.prefetch_waste_counter = 0
+		self.reload_counter = 0
+		self.download_scheduler = DownloadScheduler(kwargs.get('max_downloads'), kwargs.get('max_downloads_per_host'))
 		self.__start_downloading = Lock()
 		self.__chain_impl('__init__', args, kwargs)
 	
@@ -55,13 +88,16 @@ class Model:
 		view.__document = None
 		view.__referenced = defaultdict(set)
 		view.__location = url
+		view.__timeline = {}
+		self.__views.add(view)
 		
 		event = CustomEvent('opening', detail=url)
 		result = view.emit('dom_event', event, view)
 		if isawaitable(result):
 			result = await result
 		if result == False:
-			del view.__document, view.__referenced, view.__location
+			self.__detach_view(view)
+			del view.__timeline
 			return None
 		
 		await self.begin_downloads()
@@ -72,6 +108,9 @@ class Model:
 			view.emit('dom_event', event, view)
 			raise
 		finally:
+			for task in self.__preloaded.values(): # links found by preload scanners but not used by the document
+				task.cancel()
+			self.__preloaded.clear()
 			await self.end_downloads()
 		
 		await self.on_open_document(view, view.__document)
@@ -81,7 +120,7 @@ class Model:
 		if isawaitable(result):
 			result = await result
 		if result == False:
-			del view.__document, view.__referenced, view.__location
+			self.__detach_view(view)
 			return None
 		
 		return view.__document
@@ -97,9 +136,9 @@ class Model:
 		if isawaitable(result):
 			result = await result
 		if result == False:
-			del view.__document, view.__referenced, view.__location
+			self.__detach_view(view)
 			return
-			
+		
 		await self.__unload_document(view, url, view)
 		
 		await self.on_close_document(view, view.__document)
@@ -109,11 +148,282 @@ class Model:
 		if isawaitable(result):
 			result = await result
 		if result == False:
-			del view.__document, view.__referenced, view.__location
+			self.__detach_view(view)
 			return
 		
+		for url in view.__referenced: # downloads still waiting are not needed anymore
+			if not (self.__users.get(url, set()) - {view}):
+				self.download_scheduler.cancel(url)
+		
+		self.__detach_view(view)
+	
+	def __detach_view(self, view):
+		"Release all documents still used by the view, destroying the ones no other view uses."
+		
+		for url in [_url for (_url, _users) in self.__users.items() if view in _users]:
+			self.__release(view, url)
+		self.__views.discard(view)
 		del view.__document, view.__referenced, view.__location
-		self.documents.clear() # TODO: support multiple views per model
+	
+	def __release(self, view, url):
+		"Stop counting the view as a user of the document at `url`. If it was the last user, remove the document and destroy it, unless another url shares it."
+		
+		users = self.__users[url]
+		users.discard(view)
+		if users:
+			return
+		del self.__users[url]
+		self.release_url(url)
+		
+		self.__sizes.pop(url, None)
+		self.__forget_content(url)
+		
+		try:
+			document = self.documents.pop(url)
+		except KeyError:
+			return
+		if document is not None and not any(_document is document for _document in self.documents.values()):
+			self.destroy_document(document)
+	
+	def memory_usage(self, view):
+		"""
+		Size in bytes of downloaded data of the documents used by the view: `total`, `exclusive` (not used by other views)
+		and `shared` (also used by other views), with the number of `documents`. Documents shared by content are counted once.
+		"""
+		
+		seen = set()
+		total = exclusive = 0
+		for url, users in self.__users.items():
+			if view not in users:
+				continue
+			document = self.documents.get(url)
+			if document is None or id(document) in seen:
+				continue
+			seen.add(id(document))
+			size = self.__sizes.get(url, 0)
+			total += size
+			if users == {view}:
+				exclusive += size
+		return {'documents': len(seen), 'total': total, 'exclusive': exclusive, 'shared': total - exclusive}
+	
+	def document_changed(self, url):
+		"Called by downloaders when a document served from cache turned out to be changed on the server. Emits `update` event on views that use it."
+		
+		for view in list(self.__views):
+			if not hasattr(view, '_Model__location'): # document closed
+				self.__views.discard(view)
+				continue
+			
+			if url == view.__location or view.__referenced.get(url):
+				view.emit('dom_event', CustomEvent('update', detail=url), view)
+	
+	async def reload_document(self, url):
+		"""
+		Download the document at `url` again and put the new version in place of the old one, for all views using it. Links added or removed
+		by the change are loaded or unloaded, other linked documents are kept. Only the documents using it, directly or through other documents,
+		compute their style and layout again (see `invalidate_document`), and views showing them are repainted. Emits `update` event like
+		`document_changed`. Return False if no view uses the document.
+		"""
+		
+		users = [_view for _view in self.__users.get(url, ()) if hasattr(_view, '_Model__location')]
+		old_document = self.documents.get(url)
+		if not users or old_document is None:
+			return False
+		
+		try:
+			data, mime_type = await self.download_document(url)
+			new_document = await to_thread(self.create_document, data, mime_type)
+		except (RuntimeError, NameError, KeyError, IndexError, AttributeError, ArithmeticError, CancelledError, KeyboardInterrupt, AssertionError, TypeError):
+			raise
+		except Exception as error: # for instance a file still being written, keep the old version until the next change
+			self.emit_warning(users[0], f"Error reloading document: {type(error).__name__}: {str(error)}", url)
+			return True
+		
+		if self.documents.get(url) is not old_document: # closed or replaced in the meantime
+			self.destroy_document(new_document)
+			return True
+		
+		self.documents[url] = new_document
+		self.__sizes[url] = len(data)
+		self.__forget_content(url)
+		self.reload_counter += 1
+		
+		links = frozenset(self.resolve_url(_link, self.__url_root(url)) for _link in self.scan_document_links(new_document) if not _link.startswith('data:'))
+		dependents = set()
+		for view in users:
+			await self.__unload_links(view, url, old_document, links)
+			await self.__load_links(view, url, new_document)
+			dependents.update(self.__dependents(view, url))
+		
+		stale = [old_document] + [_document for _document in (self.documents.get(_url) for _url in dependents) if _document is not None]
+		for document in stale:
+			self.invalidate_document(document)
+		uncache(self, stale)
+		
+		for view in users:
+			old_image = view.__document
+			if self.__url_root(view.__location) == url:
+				view.__document = self.get_document(view.__location)
+			self.update_image(view, old_image, view.__document)
+		
+		self.document_changed(url)
+		
+		if not any(_document is old_document for _document in self.documents.values()):
+			self.destroy_document(old_document)
+		return True
+	
+	def __dependents(self, view, url):
+		"Urls of documents in the view that link to the document at `url`, directly or through other documents."
+		
+		found = set()
+		pending = [url]
+		while pending:
+			for parent in view.__referenced.get(pending.pop(), ()):
+				if parent not in found:
+					found.add(parent)
+					pending.append(parent)
+		return found
+	
+	def record_timing(self, url, phase, start, end):
+		"Record a phase of loading the resource at `url`, times from `perf_counter`. Called by downloaders for network phases."
+		
+		try:
+			view = self.__streaming[url]
+		except KeyError:
+			return
+		self.__timing(view, url).record(phase, start, end)
+	
+	def __timing(self, view, url):
+		try:
+			return view.__timeline[url]
+		except KeyError:
+			timing = view.__timeline[url] = ResourceTiming(url)
+			return timing
+	
+	def resource_timeline(self, view):
+		"Timing of all resources loaded by the view for the current document, in order of loading start. See `timing.chrome_trace` for export."
+		return list(view.__timeline.values())
+	
+	def preload_links(self, url, links):
+		"Start downloading links found by downloaders scanning the document at `url` while it is still being downloaded."
+		
+		try:
+			view = self.__streaming[url]
+		except KeyError:
+			return
+		
+		for link in links:
+			absurl = self.resolve_url(link, self.__url_root(url))
+			if absurl.startswith('data:') or absurl in self.documents or absurl in self.__downloading or absurl in self.__preloaded:
+				continue
+			self.__preloaded[absurl] = get_running_loop().create_task(self.__preload(view, absurl))
+			self.preload_counter += 1
+	
+	async def __preload(self, view, url):
+		"""
+		Download a link ahead of its document. The `download` event is emitted first, so the application may still forbid the download.
+		Return the result of the event and the downloaded (data, mime type), None if not downloaded. `__load_document` does not emit the event again.
+		"""
+		
+		result = view.emit('dom_event', CustomEvent('download', detail=url), view)
+		if isawaitable(result):
+			result = await result
+		if result not in [None, True]: # forbidden or redirected, leave it to `__load_document`
+			return result, None
+		
+		self.__streaming[url] = view
+		try:
+			return result, await self.__scheduled_download(url, download_priority[link_kind(url)])
+		except Exception: # `__load_document` will try again and report the error
+			return result, None
+		finally:
+			del self.__streaming[url]
+	
+	async def __scheduled_download(self, url, priority):
+		"Download through the scheduler, so render-blocking resources start first and hosts are not flooded. Local urls are not scheduled."
+		
+		if not (url.startswith('http:') or url.startswith('https:')):
+			return await self.download_document(url)
+		
+		await self.download_scheduler.acquire(url, priority)
+		try:
+			return await self.download_document(url)
+		finally:
+			self.download_scheduler.release(url)
+	
+	def deprioritize_download(self, url):
+		"Move a waiting download to the end of the queue, for resources still referenced but not needed soon. Return False if the download is not waiting."
+		return self.download_scheduler.reprioritize(url, download_priority['idle'])
+	
+	def hover_link(self, view, url):
+		"Called by views when the pointer enters a hyperlink to `url`, or leaves it (`url` is None). The target is prefetched if the pointer stays for `prefetch_dwell_time`."
+		
+		try:
+			view.__hover_timer.cancel()
+		except AttributeError:
+			pass
+		
+		if url is None or url in self.documents or url in self.__prefetched or url in self.__prefetching:
+			return
+		view.__hover_timer = get_running_loop().call_later(self.prefetch_dwell_time, self.prefetch_document, view, url)
+	
+	def prefetch_document(self, view, url):
+		"Download and parse the document at `url` with its critical subresources at idle priority, so opening it later needs no network. Also a hint for links likely to be followed."
+		
+		if url.startswith('data:') or url in self.documents or url in self.__prefetched or url in self.__prefetching or url in self.__downloading:
+			return
+		task = self.__prefetching[url] = get_running_loop().create_task(self.__prefetch(view, url))
+		task.add_done_callback(lambda _task: self.__prefetching.pop(url, None))
+	
+	async def __prefetch(self, view, url):
+		result = view.emit('dom_event', CustomEvent('download', detail=url), view)
+		if isawaitable(result):
+			result = await result
+		if result not in [None, True]: # forbidden or redirected, leave it to the real load
+			return
+		
+		try:
+			data, mime_type = await self.__scheduled_download(url, download_priority['idle'])
+			document = await to_thread(self.create_document, data, mime_type)
+		except (CancelledError, KeyboardInterrupt):
+			raise
+		except Exception: # speculative, errors are reported when the document is really loaded
+			return
+		
+		self.__prefetched[url] = document
+		self.__sizes[url] = len(data)
+		while len(self.__prefetched) > self.prefetch_cache_size:
+			old_url, old_document = self.__prefetched.popitem(last=False)
+			self.prefetch_waste_counter += 1
+			self.destroy_document(old_document)
+			if not self.__users.get(old_url):
+				self.__sizes.pop(old_url, None)
+		
+		for absurl in unique(self.resolve_url(_link, self.__url_root(url)) for _link in self.scan_document_links(document)):
+			if link_kind(absurl) in self.prefetch_kinds:
+				self.prefetch_document(view, absurl)
+	
+	async def __take_prefetched(self, url, priority):
+		"Return the prefetched document for `url` and remove it from the prefetch cache, waiting for a prefetch in progress. None if not prefetched."
+		
+		try:
+			task = self.__prefetching[url]
+		except KeyError:
+			pass
+		else:
+			self.download_scheduler.reprioritize(url, priority) # needed now
+			try:
+				await shield(task)
+			except CancelledError:
+				if not task.cancelled():
+					raise
+		
+		try:
+			document = self.__prefetched.pop(url)
+		except KeyError:
+			return None
+		self.prefetch_hit_counter += 1
+		return document
 	
 	def current_location(self, view):
 		try:
@@ -244,9 +554,11 @@ class Model:
 	
 	async def __load_document(self, view, url, parent, redirected=False):
 		try:
-			return self.get_document(url)
+			document = self.get_document(url)
 		except DocumentNotFound:
 			pass
+		else:
+			return await self.__share_document(view, url, document)
 		
 		async with self.__start_downloading:
 			if url not in self.__downloading:
@@ -266,15 +578,24 @@ class Model:
 					await downloading_event.wait()
 				
 				try:
-					return self.get_document(url)
+					document = self.get_document(url)
 				except DocumentNotFound as error:
 					view.emit_warning(view, f"Download not attempted: {type(error).__name__} {str(error)}", url)
 					return
+				return await self.__share_document(view, url, document)
+			
+			self.__users[url].add(view)
+			
+			preload = self.__preloaded.pop(url, None)
+			preloaded = None
+			if preload is not None: # the `download` event was emitted when the preload started
+				result, preloaded = await preload
 			
 			if not redirected:
-				result = view.emit('dom_event', CustomEvent('download', detail=url), parent)
-				if isawaitable(result):
-					result = await result
+				if preload is None:
+					result = view.emit('dom_event', CustomEvent('download', detail=url), parent)
+					if isawaitable(result):
+						result = await result
 				if result == False:
 					self.documents[url] = None
 					return
@@ -288,69 +609,120 @@ class Model:
 							document = self.documents[url] = await self.__load_document(view, new_url, parent, True)
 							return document
 			
-			try:
-				if url != '':
-					#print("-- download document", url)
-					data, mime_type = await self.download_document(url)
-				elif view.prop_file:
-					#print("-- read file", url)
-					path = Path(view.prop_file) # load document set through 'set_file'
-					match path.suffix.lower():
-						case '.svg':
-							mime_type = 'image/svg'
-						case '.png':
-							mime_type = 'image/png'
-						case '.jpg' | '.jpeg':
-							mime_type = 'image/jpeg'
-						case _:
-							mime_type = 'application/octet-stream'
-					try:
-						data = await path.read_bytes()
-					except (OSError, IOError) as error:
-						self.emit_warning(view, f"Error opening file: {type(error).__name__}: {str(error)}", url)
+			priority = download_priority['document' if parent is view else link_kind(url)]
+			prefetched = await self.__take_prefetched(url, priority)
+			if prefetched is not None:
+				self.documents[url] = prefetched
+			else:
+				if parent is view:
+					self.prefetch_miss_counter += 1
+				
+				try:
+					if preloaded is not None:
+						data, mime_type = preloaded
+						self.preload_used_counter += 1
+					elif url != '':
+						#print("-- download document", url)
+						self.__streaming[url] = view
+						try:
+							data, mime_type = await self.__scheduled_download(url, priority)
+						finally:
+							del self.__streaming[url]
+					elif view.prop_file:
+						#print("-- read file", url)
+						path = Path(view.prop_file) # load document set through 'set_file'
+						match path.suffix.lower():
+							case '.svg':
+								mime_type = 'image/svg'
+							case '.png':
+								mime_type = 'image/png'
+							case '.jpg' | '.jpeg':
+								mime_type = 'image/jpeg'
+							case _:
+								mime_type = 'application/octet-stream'
+						try:
+							data = await path.read_bytes()
+						except (OSError, IOError) as error:
+							self.emit_warning(view, f"Error opening file: {type(error).__name__}: {str(error)}", url)
+							data, mime_type = None, 'application/x-null'
+					else:
 						data, mime_type = None, 'application/x-null'
-				else:
+				except (RuntimeError, NameError, KeyError, IndexError, AttributeError, ArithmeticError, CancelledError, KeyboardInterrupt, AssertionError, TypeError):
+					raise
+				except Exception as error: # Ignore all other errors, issue a warning.
+					self.emit_warning(view, f"Error downloading document: {type(error).__name__}: {str(error)}", url)
 					data, mime_type = None, 'application/x-null'
-			except (RuntimeError, NameError, KeyError, IndexError, AttributeError, ArithmeticError, CancelledError, KeyboardInterrupt, AssertionError, TypeError):
-				raise
-			except Exception as error: # Ignore all other errors, issue a warning.
-				self.emit_warning(view, f"Error downloading document: {type(error).__name__}: {str(error)}", url)
-				data, mime_type = None, 'application/x-null'
-			
-			if data is None:
-				result = view.emit('dom_event', CustomEvent('error', detail=url), parent)
-				if isawaitable(result):
-					result = await result
-				if result == False:
-					self.documents[url] = None
-					return
-				if result not in [None, True, False]:
-					if isinstance(result, type) and len(result) == 2 and isinstance(result[0], bytes) and isinstance(result[1], str):
-						data, mime_type = result
-					elif isinstance(result, bytes):
-						data = result
-						mime_type = 'application/octet-stream'
-					else:
-						self.emit_warning(view, "Expected (data:bytes, mime:str) tuple or data:bytes blob.", result)
-			
-			try:
-				self.documents[url] = await to_thread(self.create_document, data, mime_type)
-			except (RuntimeError, NameError, KeyError, IndexError, AttributeError, ArithmeticError, CancelledError, KeyboardInterrupt, AssertionError, TypeError) as error:
-				if isinstance(error, NotImplementedError):
+				
+				if data is None:
+					result = view.emit('dom_event', CustomEvent('error', detail=url), parent)
+					if isawaitable(result):
+						result = await result
+					if result == False:
+						self.documents[url] = None
+						return
+					if result not in [None, True, False]:
+						if isinstance(result, type) and len(result) == 2 and isinstance(result[0], bytes) and isinstance(result[1], str):
+							data, mime_type = result
+						elif isinstance(result, bytes):
+							data = result
+							mime_type = 'application/octet-stream'
+						else:
+							self.emit_warning(view, "Expected (data:bytes, mime:str) tuple or data:bytes blob.", result)
+				
+				parse_time = []
+				if data is not None:
+					self.__sizes[url] = len(data)
+				
+				def create_document():
+					"Return the document, whether it is shared, and the digest of the data if the document has no links, so other urls may share it."
+					
+					start = perf_counter()
+					try:
+						if data is None:
+							return self.create_document(data, mime_type), False, None
+						
+						digest = None
+						if (len(data), mime_type) in self.__contents: # only data of the same size may be the same, do not hash the others
+							digest = sha256(data).digest()
+							shared = self.__shared_content(len(data), mime_type, digest)
+							if shared is not None:
+								return shared, True, None
+						
+						document = self.create_document(data, mime_type)
+						if any(True for _link in self.scan_document_links(document)):
+							return document, False, None
+						return document, False, (digest or sha256(data).digest())
+					finally:
+						parse_time.append((start, perf_counter()))
+				
+				try:
+					create_start = perf_counter()
+					self.documents[url], shared, digest = await to_thread(create_document)
+					if shared:
+						self.shared_content_counter += 1
+					elif digest is not None:
+						self.__contents.setdefault((len(data), mime_type), {})[digest] = url
+					timing = self.__timing(view, url)
+					timing.record('create_document', create_start, perf_counter())
+					timing.record('parse', *parse_time[0])
+				except (RuntimeError, NameError, KeyError, IndexError, AttributeError, ArithmeticError, CancelledError, KeyboardInterrupt, AssertionError, TypeError) as error:
+					if isinstance(error, NotImplementedError):
+						self.emit_warning(view, f"Error creating document: {type(error).__name__}: {str(error)}", url)
+						self.documents[url] = self.create_document(None, 'application/x-null')
+						result = view.emit('dom_event', CustomEvent('error', detail=url), parent)
+						if isawaitable(result):
+							await result
+						return
+					raise
+				except Exception as error:
 					self.emit_warning(view, f"Error creating document: {type(error).__name__}: {str(error)}", url)
 					self.documents[url] = self.create_document(None, 'application/x-null')
 					result = view.emit('dom_event', CustomEvent('error', detail=url), parent)
 					if isawaitable(result):
 						await result
 					return
-				raise
-			except Exception as error:
-				self.emit_warning(view, f"Error creating document: {type(error).__name__}: {str(error)}", url)
-				self.documents[url] = self.create_document(None, 'application/x-null')
-				result = view.emit('dom_event', CustomEvent('error', detail=url), parent)
-				if isawaitable(result):
-					await result
-				return
+				
+				view.emit('dom_event', CustomEvent('resourcetiming', detail=timing), parent)
 			
 			document = self.get_document(url)
 			if document is None:
@@ -373,38 +745,76 @@ class Model:
 		if url.startswith('data:'):
 			return document
 		
+		await self.__load_links(view, url, document)
+		
+		result = view.emit('dom_event', UIEvent('load', view=view, detail=url), document)
+		if isawaitable(result):
+			result = await result
+		if result == False:
+			return
+		if result not in [None, True, False]:
+			self.documents[url] = document = result
+		
+		return document
+	
+	async def __load_links(self, view, url, document):
+		"Load documents linked from the document at `url`, counting the view as their user."
+		
+		links = [self.resolve_url(_link, self.__url_root(url)) for _link in unique(self.scan_document_links(document))]
+		self.prefetch_urls([_absurl for _absurl in links if _absurl not in self.documents])
+		
 		async with TaskGroup() as group:
 			tasks = []
 			visited = set()
-			for link in unique(self.scan_document_links(document)):
-				absurl = self.resolve_url(link, self.__url_root(url))
-				if absurl in self.documents or absurl in visited:
+			for absurl in sorted(links, key=lambda _absurl: download_priority[link_kind(_absurl)]): # render-blocking resources take the free slots first
+				if absurl in visited:
 					continue
+				visited.add(absurl)
 				
 				view.__referenced[absurl].add(url)
+				if view in self.__users.get(absurl, ()):
+					continue
 				
 				task = group.create_task(self.__load_document(view, absurl, document))
 				if absurl.startswith('data:'):
 					await task
 				tasks.append(task)
-				
-				visited.add(absurl)
+	
+	async def __share_document(self, view, url, document):
+		"Use a document already loaded, possibly by another view. A view using it for the first time also loads its links, so they are counted as used by the view too."
 		
-		result = view.emit('dom_event', UIEvent('load', view=view, detail=url), document)
-		if isawaitable(result):
-			result = await result
-		if result == False:
-			return
-		if result not in [None, True, False]:
-			self.documents[url] = document = result
+		users = self.__users[url]
+		if view in users:
+			return document
+		users.add(view)
 		
+		if document is not None and url in self.documents and not url.startswith('data:'):
+			await self.__load_links(view, url, document)
 		return document
 	
+	def __shared_content(self, size, mime_type, digest):
+		"Return a loaded document with the same content and type. Only documents without links are registered, as links resolve against the document url. Called from a thread."
+		
+		try:
+			return self.documents[self.__contents.get((size, mime_type), {})[digest]]
+		except KeyError:
+			return None
+	
+	def __forget_content(self, url):
+		for key, digests in list(self.__contents.items()):
+			for digest in [_digest for (_digest, _url) in digests.items() if _url == url]:
+				del digests[digest]
+			if not digests:
+				del self.__contents[key]
+	
 	async def __unload_document(self, view, url, parent):
 		try:
 			document = self.get_document(url)
 		except DocumentNotFound:
 			return
+		if document is None:
+			self.__release(view, url)
+			return
 		
 		result = view.emit('dom_event', UIEvent('beforeunload', view=view, detail=url), document)
 		if isawaitable(result):
@@ -412,22 +822,30 @@ class Model:
 		if result == False:
 			return
 		
+		await self.__unload_links(view, url, document)
+		
+		result = view.emit('dom_event', UIEvent('unload', view=view, detail=url), document)
+		if isawaitable(result):
+			await result
+		
+		self.__release(view, url) # destroyed if no other view uses it
+	
+	async def __unload_links(self, view, url, document, keep=frozenset()):
+		"Unload documents linked from the document at `url` that no other document of the view links to. Absolute urls in `keep` stay loaded."
+		
 		async with TaskGroup() as group:
-			tasks = []
 			for link in unique(self.scan_document_links(document)):
 				if link.startswith('data:'):
 					continue
-				absurl = self.resolve_url(link, url)
+				absurl = self.resolve_url(link, self.__url_root(url))
+				if absurl in keep:
+					continue
 				if url in view.__referenced[absurl]:
 					view.__referenced[absurl].remove(url)
 					if not view.__referenced[absurl]:
-						tasks.append(group.create_task(self.__unload_document(view, absurl, document)))
-		
-		result = view.emit('dom_event', UIEvent('unload', view=view, detail=url), document)
-		if isawaitable(result):
-			await result
-		
-		self.destroy_document(document)
+						if not (self.__users.get(absurl, set()) - {view}):
+							self.download_scheduler.cancel(absurl) # no longer referenced, drop it if still waiting
+						group.create_task(self.__unload_document(view, absurl, document))
 	
 	def get_document_url(self, document):
 		try:
@@ -497,16 +915,54 @@ class Model:
 	def set_location(self, widget, url):
 		self.__chain_impl('set_location', (widget, url))
 	
+	def update_image(self, widget, old_image, new_image):
+		"Show `new_image` instead of `old_image` if the widget shows it, or just repaint if they are the same document with changed dependencies."
+		self.__chain_impl('update_image', (widget, old_image, new_image))
+	
+	def prefetch_urls(self, urls):
+		"Hint that the urls will be downloaded soon, so the downloaders may prepare, for instance resolve host names."
+		self.__chain_impl('prefetch_urls', (urls,))
+	
+	async def close_connections(self):
+		"Close network connections kept open by the downloaders between documents, when the model is not going to be used anymore."
+		await self.__chain_impl_async('close_connections', ())
+	
+	def release_url(self, url):
+		"Hint that no view uses the document at `url` anymore, so the downloaders may drop what they keep for it, for instance file monitors."
+		self.__chain_impl('release_url', (url,))
+	
 	async def download_document(self, url) -> (bytes, str):
 		#print("download_document", url)
 		return await self.__find_impl_async('download_document', (url,))
 	
+	def accepts_buffer(self, mime_type:str):
+		"Whether some implementation of `create_document` takes data of this type as a buffer, listing the type in its `buffer_mime_types`."
+		return any(mime_type in getattr(_cls, 'buffer_mime_types', ()) for _cls in self.__class__.mro() if not issubclass(_cls, Model))
+	
 	def create_document(self, data:bytes, mime_type:str):
+		"""
+		Create document from data of the given type. The data may also be a read-only memoryview, like of a memory mapped file. Implementations listing the type
+		in `buffer_mime_types` get the memoryview and are tried first, the others get a copy as bytes.
+		"""
+		
+		if isinstance(data, memoryview):
+			for cls in self.__class__.mro():
+				if issubclass(cls, Model) or mime_type not in getattr(cls, 'buffer_mime_types', ()):
+					continue
+				result = cls.create_document(self, data, mime_type)
+				if result is not NotImplemented:
+					return result
+			data = bytes(data)
+		
 		return self.__find_impl('create_document', [data, mime_type])
 	
 	def destroy_document(self, document):
 		return self.__find_impl('destroy_document', [document])
 	
+	def invalidate_document(self, document):
+		"Drop style and layout computed for the document, after it or a document it uses was reloaded. Computed again when needed."
+		self.__chain_impl('invalidate_document', (document,))
+	
 	def save_document(self, document, fileobj=None):
 		return self.__find_impl('save_document', [document, fileobj])
 	
@@ -525,6 +981,10 @@ class Model:
 		"Return image optimal height as calculated for the provided width."
 		return self.__find_impl('image_height_for_width', [view, document, width, callback])
 	
+	def image_content_widths(self, view, document, callback):
+		"Return minimal and maximal width the image content may take, for table layout."
+		return self.__find_impl('image_content_widths', [view, document, callback])
+	
 	def draw_image(self, view, document, ctx, box, callback):
 		return self.__find_impl('draw_image', [view, document, ctx, box, callback])
 	
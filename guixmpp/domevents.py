@@ -252,6 +252,8 @@ class CustomEvent(Event):
 		'closing': { 'cancelable':True },
 		'warning': { 'cancelable':False },
 		'cancelled': { 'cancelable':False },
+		'update': { 'cancelable':False },
+		'resourcetiming': { 'cancelable':False },
 		'parseerror': { 'cancelable':False }
 	}
 	
@@ -116,6 +116,7 @@ except NameError:
 			'keyboard_input' : (GObject.TYPE_BOOLEAN, "Keyboard input", "Whether the widget accepts keyboard input.", False, GObject.ParamFlags.READWRITE),
 			'pointer_input' : (GObject.TYPE_BOOLEAN, "Pointer input", "Whether the widget accepts pointer input.", False, GObject.ParamFlags.READWRITE),
 			'file_download' : (GObject.TYPE_BOOLEAN, "File download", "Whether the widget supports `file:` scheme granting access to local filesystem.", False, GObject.ParamFlags.READWRITE),
+			'file_watch' : (GObject.TYPE_BOOLEAN, "File watch", "Whether local files are reloaded when they change on disk.", False, GObject.ParamFlags.READWRITE),
 			'http_download' : (GObject.TYPE_BOOLEAN, "HTTP download", "Whether the widget supports `http(s):` scheme granting access to network.", False, GObject.ParamFlags.READWRITE),
 			'cid_download' : (GObject.TYPE_BOOLEAN, "CID download", "Whether the widget supports `cid:` scheme granting access to XMPP network.", False, GObject.ParamFlags.READWRITE),
 			'auto_show' : (GObject.TYPE_BOOLEAN, "Auto show", "Whether the loaded image should be shown automatically.", True, GObject.ParamFlags.READWRITE),
@@ -123,7 +124,7 @@ except NameError:
 			'file' : (GObject.TYPE_STRING, "File", "File to load; works even if `file:` scheme is disabled.", None, GObject.ParamFlags.READWRITE)
 		}
 		
-		def __init__(self, file_=None, url=None, keyboard_input=False, pointer_input=False, file_download=False, http_download=False, cid_download=False, js_script=False, chrome=None, auto_show=True):
+		def __init__(self, file_=None, url=None, keyboard_input=False, pointer_input=False, file_download=False, file_watch=False, http_download=False, cid_download=False, js_script=False, chrome=None, auto_show=True):
 			super().__init__()
 			
 			self.set_can_focus(True)
@@ -137,6 +138,7 @@ except NameError:
 			self.keyboard_input = keyboard_input
 			self.pointer_input = pointer_input
 			self.file_download = file_download
+			self.file_watch = file_watch
 			self.http_download = http_download
 			self.cid_download = cid_download
 			self.js_script = js_script
@@ -191,7 +193,7 @@ except NameError:
 				cc.append('_X')
 			
 			DOMWidgetModel = Model.features('<local>.DOMWidgetModel' + ''.join(cc), DisplayView, SVGRender, PNGRender, WEBPRender, ImageRender if Gtk.get_major_version() >= 4 else PixbufRender, HTMLRender, FontFormat, *features, ResourceDownload, XMLFormat, CSSFormat, JSONFormat, TextFormat, PlainFormat, NullFormat, DataDownload)
-			self.model = DOMWidgetModel(chrome_dir=self.chrome)
+			self.model = DOMWidgetModel(chrome_dir=self.chrome, file_watch=self.file_watch)
 			
 			if Gtk.get_major_version() < 4:
 				self.controllers = []
@@ -333,6 +335,7 @@ except NameError:
 					self.main_url = None
 					if self.auto_show:
 						self.set_image(None)
+				await self.model.close_connections()
 		
 		def set_image(self, image):
 			"Directly set image to display (document returned by `model.create_document`). None to unset."
@@ -5,6 +5,11 @@
 __all__ = 'FileDownload',
 
 
+import gi
+if __name__ == '__main__':
+	gi.require_version('Gio', '2.0')
+from gi.repository import Gio
+
 if __name__ == '__main__':
 	from guixmpp.gtkaiopath import Path
 else:
@@ -13,15 +18,41 @@ else:
 from urllib.parse import unquote
 import magic
 import mimetypes
-from asyncio import to_thread
+import mmap
+from os import fstat
+from asyncio import to_thread, get_running_loop
+from logging import getLogger
+logger = getLogger(__name__)
 
 
 class FileDownload:
 	"""
 	Downloader that supports `file` uri scheme. Files are searched in the local filesystem.
-	MIME types are guessed by `mimetypes` library.
+	MIME types are guessed by `mimetypes` library. Large files of types the model takes as buffers
+	(see `Model.accepts_buffer`) are memory mapped instead of read, and returned as a read-only memoryview.
+	In watch mode (`file_watch`) downloaded files are monitored and reloaded when changed on disk, see `Model.reload_document`.
 	"""
 	
+	"Files at least this large are memory mapped, if the model takes their type as a buffer. None disables mapping."
+	file_mmap_threshold = 256 * 1024
+	
+	"Monitor downloaded files and reload them when they change. Files are not memory mapped in this mode, as they may be truncated while mapped."
+	file_watch = False
+	
+	"Seconds without further changes before a file is reloaded, so a burst of writes (like an editor saving in several steps) causes one reload."
+	file_watch_delay = 0.1
+	
+	"File monitor events that cause a reload. A file replaced by renaming another one over it is reported as `RENAMED` or `MOVED_IN`."
+	file_watch_events = frozenset({Gio.FileMonitorEvent.CHANGED, Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.RENAMED, Gio.FileMonitorEvent.MOVED_IN})
+	
+	def __init__(self, *args, **kwargs):
+		if kwargs.get('file_watch') is not None:
+			self.file_watch = kwargs['file_watch']
+		self.__monitors = {} # url -> file monitor
+		self.__reload_timers = {} # url -> timer handle of a pending reload
+		self.__reloading = {} # url -> reload task
+		self.file_change_counter = 0
+	
 	async def begin_downloads(self):
 		if not mimetypes.inited:
 			mimetypes.init()
@@ -54,12 +85,91 @@ class FileDownload:
 				raise ValueError("Only localhost files are supported.")
 		
 		path = Path(unquote(path_name))
+		if self.file_watch:
+			self.__watch(url, str(path)) # before reading, so a change during the download is not missed
+		
 		mime_type, encoding = await to_thread(mimetypes.guess_type, str(path))
 		#mime_type = await to_thread(magic.from_file, str(path), mime=True)
 		if not mime_type:
 			mime_type = 'application/octet-stream'
 		
+		if self.file_mmap_threshold is not None and not self.file_watch and hasattr(self, 'accepts_buffer') and self.accepts_buffer(mime_type):
+			data = await to_thread(self.__map_file, str(path))
+			if data is not None:
+				return data, mime_type
+		
 		return await path.read_bytes(), mime_type
+	
+	def release_url(self, url):
+		"Stop watching the file of a document that is not used anymore."
+		
+		try:
+			self.__monitors.pop(url).cancel()
+		except KeyError:
+			pass
+		try:
+			self.__reload_timers.pop(url).cancel()
+		except KeyError:
+			pass
+	
+	def __watch(self, url, path_name):
+		if url in self.__monitors:
+			return
+		
+		monitor = Gio.File.new_for_path(path_name).monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+		monitor.set_rate_limit(int(self.file_watch_delay * 1000)) # coalescing is done here, the default limit would delay changes after the first one
+		monitor.connect('changed', self.__file_changed, url, get_running_loop())
+		self.__monitors[url] = monitor
+	
+	def __file_changed(self, monitor, file_, other_file, event_type, url, loop):
+		"Schedule reload of the file, postponing a reload already scheduled."
+		
+		if event_type not in self.file_watch_events:
+			return
+		
+		self.file_change_counter += 1
+		try:
+			self.__reload_timers.pop(url).cancel()
+		except KeyError:
+			pass
+		self.__reload_timers[url] = loop.call_later(self.file_watch_delay, self.__reload, url, loop)
+	
+	def __reload(self, url, loop):
+		del self.__reload_timers[url]
+		
+		if url in self.__reloading: # the file changed again during the reload, take the change after it
+			self.__reload_timers[url] = loop.call_later(self.file_watch_delay, self.__reload, url, loop)
+			return
+		
+		task = self.__reloading[url] = loop.create_task(self.reload_document(url))
+		task.add_done_callback(lambda _task: self.__reloaded(url, _task))
+	
+	def __reloaded(self, url, task):
+		del self.__reloading[url]
+		if task.cancelled():
+			return
+		
+		error = task.exception()
+		if error is not None: # errors of the file itself are warned by `reload_document`, this one would repeat on every change
+			logger.error(f"Error reloading {url}: {type(error).__name__}: {error}", exc_info=error)
+			self.release_url(url)
+		elif task.result() == False: # not used anymore
+			self.release_url(url)
+	
+	def __map_file(self, path_name):
+		"Map the file to memory. Return a read-only memoryview of the mapping, or None if the file is small or can not be mapped (like pipes and special files)."
+		
+		try:
+			with open(path_name, 'rb') as file:
+				if fstat(file.fileno()).st_size < self.file_mmap_threshold:
+					return None
+				mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) # the mapping stays valid after the file is closed
+		except (OSError, ValueError):
+			return None
+		
+		if hasattr(mmap, 'MADV_SEQUENTIAL'):
+			mapping.madvise(mmap.MADV_SEQUENTIAL) # decoders read the file once, from start to end
+		return memoryview(mapping) # unmapped when the last view is released
 
 
 if __debug__ and __name__ == '__main__':
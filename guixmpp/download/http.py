@@ -10,136 +10,232 @@ if __name__ == '__main__':
 	del sys.path[0] # needs to be removed because this module is called "http"
 
 
-from os import environ, utime
+from os import environ
 _library = environ.get('GUIXMPP_HTTP', '2') # 1, 2, aiohttp, httpx
 
-from hashlib import sha3_256
-from mimetypes import inited as mimetypes_initialized, guess_type, guess_extension
-from asyncio import gather, get_running_loop, to_thread, Lock
+from asyncio import get_running_loop, Semaphore
 from time import strftime, gmtime, time as current_time
+from urllib.parse import urlparse
+
+if __name__ == '__main__':
+	from guixmpp.protocol.http.cache import HTTPCache
+	from guixmpp.preload import PreloadScanner
+	from guixmpp.scheduler import link_kind
+else:
+	from ..protocol.http.cache import HTTPCache
+	from ..preload import PreloadScanner
+	from ..scheduler import link_kind
 
 
 class HTTPDownloadCommon:
-	def __init__(self, http_cache_dir=None, http_cache_fresh_time=None, http_cache_max_time=None, http_semaphore=None, **kwargs):
+	def __init__(self, http_cache_dir=None, http_cache_fresh_time=None, http_cache_max_time=None, http_cache_max_size=None, http_semaphore=None, http_idle_timeout=None, http_max_connections_per_host=None, http_max_revalidations=4, **kwargs):
 		self.http_cache_dir = http_cache_dir
 		self.http_cache_fresh_time = http_cache_fresh_time
 		self.http_cache_max_time = http_cache_max_time
+		self.http_cache_max_size = http_cache_max_size
 		self.http_semaphore = http_semaphore
+		self.http_idle_timeout = http_idle_timeout
+		self.http_max_connections_per_host = http_max_connections_per_host
+		self.http_max_revalidations = http_max_revalidations
+		self.__revalidating = {} # url -> background revalidation task
+		self.http_revalidation_counter = 0
+		self.http_update_counter = 0
+		self.http_wire_byte_counter = 0
+		self.http_decoded_byte_counter = 0
 	
-	async def download_document(self, url):
-		if not (url.startswith('http:') or url.startswith('https:')):
-			return NotImplemented
+	@property
+	def http_cache(self):
+		"Disk cache index, opened on first use. Holds cache metrics."
 		
-		#print("download HTTP document", url)
-		if_modified_since = None
-		cached_file = None
+		try:
+			return self.__cache
+		except AttributeError:
+			self.__cache = HTTPCache(self.http_cache_dir, self.http_cache_max_size)
+			return self.__cache
+	
+	def document_changed(self, url):
+		"Called when background revalidation finds that the cached document at `url` changed on the server. `Model` overrides it to notify the views."
+	
+	def record_timing(self, url, phase, start, end):
+		"Called with network phases of downloading the resource at `url`, times from `perf_counter`. `Model` overrides it to keep the resource timeline."
+	
+	def preload_links(self, url, links):
+		"Called with links found by the preload scanner while the document at `url` is being downloaded. `Model` overrides it to start their downloads."
+	
+	def __cache_lifetime(self, response_headers):
+		"""
+		Return the times until a response is fresh, may be served while revalidating in background (`stale-while-revalidate`),
+		may be served when the server fails (`stale-if-error`) and may be kept for conditional requests. None if it must not be stored.
+		"""
 		
-		if self.http_cache_dir is not None:
-			code = sha3_256(url.encode('utf-8')).hexdigest()[2:16+2]
-			cached_files = await self.http_cache_dir.glob(code + '.*')
-			if len(cached_files) == 0:
-				pass
-			elif len(cached_files) == 1 and await cached_files[0].is_file():
-				cached_file = cached_files[0]
-				s = await cached_file.stat()
-				mtime = s.st_mtime
-				btime = s.st_birthtime
-				t = current_time()
-				
-				#print("btime:", strftime('%Y-%m-%d %H:%M:%S', gmtime(btime)), "mtime:", strftime('%Y-%m-%d %H:%M:%S', gmtime(mtime)), "fresh:", strftime('%Y-%m-%d %H:%M:%S', gmtime(t - self.http_cache_fresh_time)), "stale:", strftime('%Y-%m-%d %H:%M:%S', gmtime(t - self.http_cache_max_time)))
-				do_request = True
-				if mtime > t - self.http_cache_fresh_time:
-					do_request = False
-				elif mtime > t - self.http_cache_max_time:
-					if_modified_since = btime
-				else:
-					await cached_file.unlink()
-				
-				if not do_request:
-					#print("cache hit")
-					content_type = (await to_thread(guess_type, cached_file))[0]
-					return await cached_file.read_bytes(), content_type
+		try:
+			cache_control = frozenset(_s.strip().lower() for _s in response_headers['cache-control'].split(','))
+		except KeyError:
+			cache_control = frozenset()
+		
+		def seconds(directive):
+			try:
+				return int([_s for _s in cache_control if _s.startswith(directive + '=')][0].split('=')[1])
+			except (IndexError, ValueError):
+				return None
+		
+		max_age = seconds('max-age')
+		if max_age is not None:
+			max_age -= int(response_headers.get('age', 0))
+		
+		if 'no-store' in cache_control or (max_age is not None and max_age <= 0):
+			return None
+		
+		t = current_time()
+		if 'must-revalidate' in cache_control or 'no-cache' in cache_control:
+			fresh_until = t
+			revalidate_until = error_until = fresh_until # stale copy must not be served without asking the server
+		else:
+			if max_age is None:
+				fresh_until = t + self.http_cache_fresh_time
 			else:
-				await gather(*[_cached_file.unlink() for _cached_file in cached_files])
+				fresh_until = t + min(max_age, self.http_cache_fresh_time)
+			
+			revalidate_until = fresh_until + (seconds('stale-while-revalidate') or 0)
+			stale_if_error = seconds('stale-if-error')
+			error_until = (fresh_until + stale_if_error) if stale_if_error is not None else (t + self.http_cache_max_time) # without the directive, serve the stale copy when offline
 		
-		request_headers = {}
+		return fresh_until, revalidate_until, error_until, max(t + self.http_cache_max_time, revalidate_until, error_until)
+	
+	@staticmethod
+	def __conditional_headers(entry):
+		"Validators of the cached response, making the server answer 304 if it did not change."
 		
-		if if_modified_since is not None:
-			request_headers['if-modified-since'] = strftime("%a, %d %b %Y %H:%M:%S +0000", gmtime(if_modified_since))
+		headers = {}
+		if entry.etag:
+			headers['if-none-match'] = entry.etag
+		headers['if-modified-since'] = entry.last_modified or strftime("%a, %d %b %Y %H:%M:%S GMT", gmtime(entry.stored))
+		return headers
+	
+	async def __http_request(self, url, request_headers):
+		if self.http_semaphore:
+			async with self.http_semaphore:
+				return await self.http_download_url(url, request_headers)
+		else:
+			return await self.http_download_url(url, request_headers)
+	
+	def __queue_revalidation(self, url, entry):
+		"Revalidate the entry in background. At most `http_max_revalidations` revalidations run at once, others wait for their turn."
+		
+		if url in self.__revalidating:
+			return
 		
 		try:
-			if self.http_semaphore:
-				async with self.http_semaphore:
-					data, response_headers, status = await self.http_download_url(url, request_headers)
-			else:
-				data, response_headers, status = await self.http_download_url(url, request_headers)
-		except:
-			if cached_file is not None and await cached_file.exists():
-				data = await cached_file.read_bytes()
-				content_type = (await to_thread(guess_type, cached_file))[0]
-				return data, content_type
-			else:
-				raise
+			slots = self.__revalidation_slots
+		except AttributeError:
+			slots = self.__revalidation_slots = Semaphore(self.http_max_revalidations)
+		
+		task = self.__revalidating[url] = get_running_loop().create_task(self.__revalidate(url, entry, slots))
+		task.add_done_callback(lambda _task: self.__revalidating.pop(url, None))
+	
+	async def __revalidate(self, url, entry, slots):
+		async with slots:
+			request_headers = self.__conditional_headers(entry)
+			try:
+				data, response_headers, status = await self.__http_request(url, request_headers)
+			except Exception: # keep serving the stale copy, try again on next access
+				return
+			
+			self.http_revalidation_counter += 1
+			content_type = await self.__update_cache(url, entry, data, response_headers, status, request_headers)
+			if content_type is not None and self.http_cache.digest(data) != entry.digest:
+				self.http_update_counter += 1
+				self.document_changed(url)
+	
+	async def __update_cache(self, url, entry, data, response_headers, status, request_headers):
+		"Store the response of a (conditional) request. Return the content type, or None if the cached entry is still valid (304)."
 		
-		if cached_file is not None and await cached_file.exists():
-			if status == 304: # not modified
-				data = await cached_file.read_bytes()
-			await cached_file.unlink()
-		#print(len(data), response_headers)
+		cache = self.http_cache
+		lifetime = self.__cache_lifetime(response_headers)
+		
+		if status == 304 and entry is not None:
+			if lifetime is None:
+				await cache.remove(url)
+			else:
+				cache.refresh(entry, response_headers, *lifetime)
+			return None
 		
 		try:
 			content_type = response_headers['content-type'].split(';')[0].strip()
 		except KeyError:
 			content_type = 'application/octet-stream'
 		
+		if lifetime is None:
+			if entry is not None:
+				await cache.remove(url)
+		else:
+			await cache.store(url, data, content_type, response_headers, request_headers, *lifetime)
+		
+		return content_type
+	
+	async def download_document(self, url):
+		if not (url.startswith('http:') or url.startswith('https:')):
+			return NotImplemented
+		
+		#print("download HTTP document", url)
+		request_headers = {}
+		entry = None
+		
 		if self.http_cache_dir is not None:
-			if cached_file and (await cached_file.exists()) and ((await to_thread(guess_type, cached_file))[0] != content_type):
-				await cached_file.unlink()
-			
+			cache = self.http_cache
+			entry = cache.get(url, request_headers)
+			if entry is not None:
+				t = current_time()
+				if entry.fresh_until > t or entry.revalidate_until > t:
+					data = await cache.read(entry)
+					if data is not None:
+						#print("cache hit")
+						if entry.fresh_until <= t:
+							self.__queue_revalidation(url, entry)
+						return data, entry.content_type
+					entry = None
+				elif entry.stale_until > t:
+					request_headers.update(self.__conditional_headers(entry))
+				else:
+					await cache.remove(url)
+					entry = None
+		
+		try:
+			data, response_headers, status = await self.__http_request(url, request_headers)
+		except:
+			if entry is not None and entry.error_until > current_time():
+				data = await cache.read(entry)
+				if data is not None:
+					return data, entry.content_type
+			raise
+		
+		if self.http_cache_dir is None:
 			try:
-				cache_control = frozenset(_s.strip().lower() for _s in response_headers['cache-control'].split(','))
+				return data, response_headers['content-type'].split(';')[0].strip()
 			except KeyError:
-				cache_control = frozenset()
-			
-			try:
-				max_age = int([_s for _s in cache_control if _s.startswith('max-age=')][0].split('=')[1]) - int(response_headers.get('age', 0))
-			except IndexError:
-				max_age = None # maximum
-			
-			if 'no-store' in cache_control or (max_age is not None and max_age <= 0):
-				return data, content_type
-			
-			cached_file = self.http_cache_dir / (code + guess_extension(content_type))
-			await cached_file.write_bytes(data)
-			
-			t = current_time()
-			if 'must-revalidate' in cache_control or 'no-cache' in cache_control:
-				if max_age is None:
-					mtime = t - self.http_cache_fresh_time
-				else:
-					mtime = min(t - self.http_cache_max_time + max_age, t - self.http_cache_fresh_time)
-			else:
-				if max_age is None:
-					mtime = None
-				else:
-					mtime = min(t - self.http_cache_fresh_time + max_age, t)
-			
-			if mtime is not None:
-				#print("max time:", max_age, "updating timestamp to:", strftime('%Y-%m-%d %H:%M:%S', gmtime(mtime)))
-				await to_thread(utime, cached_file, times=(t, mtime))
+				return data, 'application/octet-stream'
+		
+		content_type = await self.__update_cache(url, entry, data, response_headers, status, request_headers)
+		if content_type is not None:
+			return data, content_type
 		
-		return data, content_type
+		data = await cache.read(entry) # not modified
+		if data is None: # body lost, entry removed by `read`
+			return await self.download_document(url)
+		return data, entry.content_type
 
 
 if _library in ['1', '2']:
 	if __name__ == '__main__':
-		from guixmpp.protocol.http.client import HTTPError, ResolveError
+		from guixmpp.protocol.http.client import HTTPError, ResolveError, ConnectionPool, resource_urgency
+		from guixmpp.protocol.dns import AsyncResolver
 		if _library == '1':
 			from guixmpp.protocol.http.client import Connection1 as Connection
 		elif _library == '2':
 			from guixmpp.protocol.http.client import Connection2 as Connection
 	else:
-		from ..protocol.http.client import HTTPError, ResolveError
+		from ..protocol.http.client import HTTPError, ResolveError, ConnectionPool, resource_urgency
+		from ..protocol.dns import AsyncResolver
 		if _library == '1':
 			from ..protocol.http.client import Connection1 as Connection
 		elif _library == '2':
@@ -152,15 +248,82 @@ if _library in ['1', '2']:
 		"""
 		
 		async def begin_downloads(self):
-			"Create client dict. Downloaded will use one connection per host, created on demand."
-			assert not hasattr(self, '_HTTPDownload__client')
-			self.__client = {}
-			self.__connection_create_lock = Lock()
+			"Create the connection pool and the DNS resolver on first use. The pool is kept between downloads, so connections to the same hosts are reused."
+			
+			try:
+				pool = self.__pool
+			except AttributeError:
+				pool = None
+			
+			if pool is None or pool.closed or (pool.loop is not None and pool.loop is not get_running_loop()):
+				if pool is not None:
+					await self.__close_pool(pool)
+				
+				resolver = AsyncResolver()
+				try:
+					await resolver.open(get_running_loop())
+				except OSError:
+					resolver = None # connections will use the system resolver
+				self.__pool = ConnectionPool(Connection, self.http_idle_timeout, self.http_max_connections_per_host, resolver)
 		
 		async def end_downloads(self):
-			"Close all connections to all hosts."
-			await gather(*[_connection.close() for _connection in self.__client.values()])
-			del self.__client, self.__connection_create_lock
+			"Connections stay open in the pool and are closed when idle for too long."
+		
+		async def close_connections(self):
+			"Close all connections in the pool, before the model is discarded. A new pool is created by the next `begin_downloads`."
+			
+			try:
+				pool = self.__pool
+			except AttributeError:
+				return
+			del self.__pool
+			await self.__close_pool(pool)
+		
+		@staticmethod
+		async def __close_pool(pool):
+			"Close the pool and its DNS resolver (UDP sockets and the cache pruning task). A pool bound to a closed loop may not be closed anymore."
+			
+			try:
+				if not pool.closed:
+					await pool.close()
+			except RuntimeError: # loop closed
+				pass
+			
+			if pool.resolver is not None:
+				resolver, pool.resolver = pool.resolver, None
+				try:
+					await resolver.close()
+				except RuntimeError: # loop closed
+					pass
+		
+		def prefetch_urls(self, urls):
+			"Start resolving host names of the urls, before the downloads are scheduled."
+			
+			try:
+				resolver = self.__pool.resolver
+			except AttributeError:
+				return
+			if resolver is None:
+				return
+			
+			hosts = set()
+			for url in urls:
+				if url.startswith('http:') or url.startswith('https:'):
+					host = urlparse(url).hostname
+					if host:
+						hosts.add(host)
+			resolver.prefetch(hosts)
+		
+		@property
+		def http_connection_pool(self):
+			"The connection pool, holding connection metrics."
+			return self.__pool
+		
+		@staticmethod
+		def __request_urgency(url):
+			"Guess the resource type from the url, so stylesheets and fonts are sent before images."
+			
+			return resource_urgency.get(link_kind(url))
 		
 		async def http_download_url(self, url, headers):
 			"Download document using HTTP client implementation provided in this library."
@@ -171,20 +334,30 @@ if _library in ['1', '2']:
 			_, _, host, *path = url.split('/')
 			path = '/'.join(path)
 			
-			if (host in self.__client) and (not self.__client[host].is_eof()):
-				async with self.__connection_create_lock:
-					connection = self.__client[host]
-			else:
-				async with self.__connection_create_lock:
-					if host in self.__client:
-						await self.__client[host].close()
-					connection = self.__client[host] = Connection(f'https://{host}')
-					await connection.open()
+			connection = await self.__pool.acquire(f'https://{host}')
+			if connection.open_timing: # the first request on a new connection reports connection phases
+				for phase, (start, end) in connection.open_timing.items():
+					self.record_timing(url, phase, start, end)
+				connection.open_timing = None
 			
-			async with connection.Url(path).get(headers=headers) as request:
-				status, headers = await request.response()
-				request.raise_for_status(status)
-				return (await request.read()), headers, status
+			reusable = False
+			try:
+				async with connection.Url(path).get(headers=headers, urgency=self.__request_urgency(url)) as request:
+					status, headers = await request.response()
+					request.raise_for_status(status)
+					if PreloadScanner.accepts(headers.get('content-type', '')):
+						scanner = PreloadScanner()
+						data = b''.join(await request.readchunks(lambda _chunk: self.preload_links(url, scanner.feed(_chunk))))
+					else:
+						data = await request.read()
+					self.http_wire_byte_counter += request.wire_bytes
+					self.http_decoded_byte_counter += request.decoded_bytes
+					self.record_timing(url, 'request', request.request_time, request.first_byte_time)
+					self.record_timing(url, 'response', request.first_byte_time, request.last_byte_time)
+				reusable = True
+				return data, headers, status
+			finally:
+				self.__pool.release(connection, reusable)
 
 
 elif _library == 'aiohttp':
@@ -274,6 +447,12 @@ if __debug__ and __name__ == '__main__':
 			assert False, "Should return 404 error."
 		
 		await model.end_downloads()
+		
+		if _library in ['1', '2']:
+			pool = model.http_connection_pool
+			print("connections created:", pool.created_connection_counter, "reused:", pool.reused_connection_counter)
+			assert pool.reused_connection_counter > 0
+			await model.close_connections()
 	
 	run(test_main())
 
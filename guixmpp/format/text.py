@@ -14,6 +14,9 @@ import unicodedata
 from collections import defaultdict, deque
 from itertools import chain
 from enum import Enum
+from bisect import bisect_left, bisect_right
+from time import perf_counter
+from asyncio import get_running_loop, sleep, CancelledError
 from pyphen import Pyphen
 from os import environ
 
@@ -115,12 +118,123 @@ class BreakLineParseTree(ParseTree):
 			raise NotImplementedError(self.production)
 
 
+class LineCountTree:
+	"Fenwick tree of paragraph line counts. Updating a count, summing lines before a paragraph and finding the paragraph containing a line are all O(log n)."
+	
+	def __init__(self, counts):
+		self.counts = list(counts)
+		self.total = sum(self.counts)
+		self.__tree = [0] + self.counts
+		for n in range(1, len(self.__tree)):
+			m = n + (n & -n)
+			if m < len(self.__tree):
+				self.__tree[m] += self.__tree[n]
+	
+	def __len__(self):
+		return len(self.counts)
+	
+	def update(self, index, count):
+		"Set line count of the paragraph at `index`."
+		delta = count - self.counts[index]
+		self.counts[index] = count
+		self.total += delta
+		n = index + 1
+		while n < len(self.__tree):
+			self.__tree[n] += delta
+			n += n & -n
+	
+	def prefix(self, index):
+		"Number of lines in all paragraphs before `index`."
+		result = 0
+		n = index
+		while n > 0:
+			result += self.__tree[n]
+			n -= n & -n
+		return result
+	
+	def find(self, line):
+		"Index of the paragraph containing the line with the given number. Lines past the end map to the last paragraph."
+		n = 0
+		step = 1 << len(self.counts).bit_length()
+		while step:
+			m = n + step
+			if m < len(self.__tree) and self.__tree[m] <= line:
+				n = m
+				line -= self.__tree[m]
+			step >>= 1
+		return min(n, len(self.counts) - 1)
+
+
+class TextIndex:
+	"""
+	Line index of a text document: paragraph number -> character offset -> laid out lines.
+	Paragraphs are laid out lazily for one width at a time. Paragraphs not laid out yet
+	have their line count estimated from their length, so the total height is known upfront
+	and refined as the layout progresses.
+	"""
+	
+	def __init__(self, paragraphs):
+		self.paragraphs = paragraphs # list of (character offset, text, escapes)
+		self.offsets = [_offset for (_offset, _text, _escapes) in paragraphs]
+		self.escaped = [_n for (_n, (_offset, _text, _escapes)) in enumerate(paragraphs) if _escapes]
+		self.width = None
+		self.line_height = None
+		self.rows = []
+		self.lines = LineCountTree([])
+		self.__pending = 0
+	
+	def __len__(self):
+		return len(self.paragraphs)
+	
+	def reset(self, width, line_height, advance):
+		"Drop the layout and start over for the new width. `advance` is the average character width, used for estimates."
+		self.width = width
+		self.line_height = line_height
+		self.rows = [None] * len(self.paragraphs)
+		chars_per_line = max(1, int(width / advance)) if advance > 0 and width != inf else None
+		self.lines = LineCountTree((0 if self.is_end(_n) else max(1, ceil(len(_text) / chars_per_line)) if chars_per_line else 1) for (_n, (_offset, _text, _escapes)) in enumerate(self.paragraphs))
+		self.__pending = 0
+	
+	def is_end(self, n):
+		"Whether the paragraph is the empty rest after the last line break (or of an empty document). It takes no lines."
+		return n == len(self.paragraphs) - 1 and not self.paragraphs[n][1]
+	
+	def set_rows(self, n, rows):
+		self.rows[n] = rows
+		self.lines.update(n, len(rows))
+	
+	def next_pending(self):
+		"Index of the first paragraph that is not laid out yet, or None."
+		while self.__pending < len(self.rows) and self.rows[self.__pending] is not None:
+			self.__pending += 1
+		return self.__pending if self.__pending < len(self.rows) else None
+	
+	def height(self):
+		return self.lines.total * self.line_height
+	
+	def top(self, n):
+		"Vertical position of the paragraph relative to the top of the document."
+		return self.lines.prefix(n) * self.line_height
+	
+	def paragraph_at(self, y):
+		"Index of the paragraph at the vertical position `y` relative to the top of the document."
+		return self.lines.find(max(0, int(y // self.line_height)))
+	
+	def paragraph_at_offset(self, offset):
+		"Index of the paragraph containing the character at `offset`."
+		return max(0, bisect_right(self.offsets, offset) - 1)
+
+
 class TextFormat:
 	def __init__(self, *args, **kwargs):
 		self.__cache = {}
+		self.__layout_tasks = {}
 	
 	use_pango = (_use_pango == '1')
 	
+	"How long (in seconds) layout may run synchronously when measuring the document, and in one slice of the background layout."
+	text_layout_budget = 0.02
+	
 	def create_document(self, data:bytes, mime_type):
 		if mime_type == 'text/plain':
 			return data.decode('utf-8')
@@ -158,13 +272,26 @@ class TextFormat:
 		if not self.is_text_document(document):
 			return NotImplemented
 		
-		pass
+		index = self.__text_index(document)
+		width = self.get_viewport_width(view) if hasattr(self, 'get_viewport_width') else 0
+		if width > 0 and index.width is None:
+			surface = cairo.RecordingSurface(cairo.Content.COLOR, None)
+			pango_layout, baseline, line_height, advance = self.__select_font(cairo.Context(surface), None)
+			index.reset(width, line_height, advance)
+		self.__schedule_layout(view, document, index)
 	
 	async def on_close_document(self, view, document):
 		if not self.is_text_document(document):
 			return NotImplemented
 		
-		self.__cache.clear()
+		task = self.__layout_tasks.pop(document, None)
+		if task is not None:
+			task.cancel()
+			try:
+				await task
+			except CancelledError:
+				pass
+		self.__cache.pop(document, None)
 	
 	"Unicode line breaking classes for various character ranges."
 	__unicode_line_breaking_class = {
@@ -567,18 +694,16 @@ class TextFormat:
 				del line[:break_pos]
 				del widths[:break_pos]
 		
+		for esc in sorted(escapes.keys() - done): # escapes after the last token end the last line
+			line.extend(escapes[esc])
+			widths.extend([0] * len(escapes[esc]))
+		
 		if line:
 			yield from zip(map(self.__hyphen, line), widths)
 			yield "\n", 0
 			line.clear()
 			widths.clear()
 		
-		for esc in sorted(escapes.keys() - done):
-			line.extend(escapes[esc])
-			widths.append(0 * len(escapes[sec]))
-		if line:
-			yield from zip(map(self.__hyphen, line), widths)
-		
 		if callback: callback(Escape.end_line, line_n)
 	
 	def draw_image(self, view, document, ctx, box, callback):
@@ -612,9 +737,55 @@ class TextFormat:
 		if 0 <= nor < len(text):
 			yield (nor, len(text))
 	
-	def __render_text(self, view, document, ctx, box, callback, pointer=None):
-		width = box[2]
-		height = box[3]
+	def __text_index(self, document):
+		"Split the document into paragraphs, separating escape sequences from the text. The result is cached."
+		
+		try:
+			return self.__cache[document]
+		except KeyError:
+			pass
+		
+		text = []
+		escapes = defaultdict(list)
+		l = 0
+		for m, n in self.__escape_sequences(document):
+			if m == n:
+				pass
+			elif document[m] != "\x1b":
+				d = document[m:n]
+				l += n - m
+				text.append(d)
+			else:
+				escapes[l].append(document[m:n])
+		
+		assert all("\x1b" not in _slice for _slice in text)
+		text = "".join(text)
+		
+		paragraphs = []
+		positions = sorted(escapes.keys())
+		k = 0
+		start = 0
+		while True:
+			end = text.find("\n", start)
+			if end < 0:
+				end = len(text)
+			
+			paragraph_escapes = {}
+			while k < len(positions) and positions[k] <= end:
+				paragraph_escapes[positions[k] - start] = escapes[positions[k]]
+				k += 1
+			
+			paragraphs.append((start, text[start:end], paragraph_escapes))
+			
+			if end == len(text):
+				break
+			start = end + 1
+		
+		index = self.__cache[document] = TextIndex(paragraphs)
+		return index
+	
+	def __select_font(self, ctx, callback):
+		"Set the default font on the context. Return Pango layout (or None), baseline, line height and average character advance."
 		
 		if self.use_pango:
 			pango_layout = PangoCairo.create_layout(ctx)
@@ -638,87 +809,151 @@ class TextFormat:
 			extents = pango_context.get_metrics()
 			line_height = (extents.get_ascent() + extents.get_descent()) / Pango.SCALE
 			baseline = extents.get_ascent() / Pango.SCALE
+			advance = extents.get_approximate_char_width() / Pango.SCALE
 			if callback: callback(Escape.end_measure, (None, ctx, pango_layout))
 		else:
 			if callback: callback(Escape.begin_measure, (None, ctx, pango_layout))
-			baseline, _, line_height, *_ = extents = ctx.font_extents()
+			baseline, _, line_height, advance, *_ = extents = ctx.font_extents()
 			if callback: callback(Escape.end_measure, (None, ctx, pango_layout))
 		
+		return pango_layout, baseline, line_height, advance
+	
+	def __layout_paragraph(self, index, n, ctx, pango_layout, baseline, callback):
+		"Lay out one paragraph for the current width of the index. Return list of rows."
+		
+		offset, text, escapes = index.paragraphs[n]
+		width = index.width
+		line_height = index.line_height
+		
+		if index.is_end(n): # nothing after the last line break, its escapes are replayed by `__render_text`
+			return []
+		
+		align = 'left'
+		line_n = 0
+		lines = []
+		line = []
+		
+		for string, advance in self.__measure_text(self.__line_breaks(text), escapes, ctx, pango_layout, width, callback):
+			if string[0] == "\x1b":
+				line.append(EscapeSeq(string, node=None, pseudoelement=None, inline=True, gravity=Gravity.CENTER, width=0, height=0))
+			elif string == "\n":
+				line_n += 1
+				
+				todel = set()
+				for k, el in enumerate(line):
+					if isinstance(el, EscapeSeq):
+						pass
+					elif isinstance(el, Whitespace):
+						todel.add(k)
+					else:
+						break
+				for k in sorted(todel, reverse=True):
+					del line[k]
+				
+				todel = set()
+				for k, el in reversed(list(enumerate(line))):
+					if isinstance(el, EscapeSeq):
+						pass
+					elif isinstance(el, Whitespace):
+						todel.add(k)
+					else:
+						break
+				for k in sorted(todel, reverse=True):
+					del line[k]
+				
+				if align in {'right', 'center'}:
+					line.insert(0, Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height))
+				if align in {'left', 'center'}:
+					line.append(Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height))
+				
+				row = Row(line, line_n, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height, max_width=inf)
+				lines.append(row)
+				line = []
+			elif string in {" ", "\u2009"}:
+				space = Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, min_width=advance, max_width=(advance if align != 'justify' else inf), height=line_height)
+				line.append(space)
+			else:
+				word = Word(string, 0, baseline, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, width=advance, height=line_height)
+				line.append(word)
+		
+		if not lines: # keep at least one line, so the line count stays positive
+			lines.append(Row([Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height)], 1, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height, max_width=inf))
+		
+		return lines
+	
+	def __prepare_index(self, document, ctx, width, callback):
+		"Get the index of the document, reset for the provided width if needed."
+		
+		pango_layout, baseline, line_height, advance = self.__select_font(ctx, callback)
+		index = self.__text_index(document)
+		if index.width != width or index.line_height != line_height:
+			index.reset(width, line_height, advance)
+		return index, pango_layout, baseline
+	
+	def __schedule_layout(self, view, document, index):
+		"Start laying out the remaining paragraphs in the background. Return False if there is no event loop to run the task."
+		
+		if index.width is None or index.next_pending() is None:
+			return True
+		
 		try:
-			tree, last_box = self.__cache[document]
+			task = self.__layout_tasks[document]
 		except KeyError:
-			tree = last_box = None
+			pass
+		else:
+			if not task.done():
+				return True
 		
-		if tree is None or last_box != box:
-			align = 'left'
-			line_n = 0
-			lines = []
-			line = []
-			
-			text = []
-			escapes = defaultdict(list)
-			l = 0
-			for m, n in self.__escape_sequences(document):
-				if m == n:
-					pass
-				elif document[m] != "\x1b":
-					d = document[m:n]
-					l += n - m
-					text.append(d)
-				else:
-					escapes[l].append(document[m:n])
-			
-			#print(escapes)
-			assert all("\x1b" not in _slice for _slice in text)
-			
-			for string, advance in self.__measure_text(self.__line_breaks("".join(text)), escapes, ctx, pango_layout, width, callback):
-				if string[0] == "\x1b":
-					#print("escape seq", repr(string))
-					line.append(EscapeSeq(string, node=None, pseudoelement=None, inline=True, gravity=Gravity.CENTER, width=0, height=0))
-				elif string == "\n":
-					line_n += 1
-					
-					todel = set()
-					for k, el in enumerate(line):
-						if isinstance(el, EscapeSeq):
-							pass
-						elif isinstance(el, Whitespace):
-							todel.add(k)
-						else:
-							break
-					for k in sorted(todel, reverse=True):
-						del line[k]
-					
-					todel = set()
-					for k, el in reversed(list(enumerate(line))):
-						if isinstance(el, EscapeSeq):
-							pass
-						elif isinstance(el, Whitespace):
-							todel.add(k)
-						else:
-							break
-					for k in sorted(todel, reverse=True):
-						del line[k]
-					
-					if align in {'right', 'center'}:
-						line.insert(0, Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height))
-					if align in {'left', 'center'}:
-						line.append(Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height))
-					
-					row = Row(line, line_n, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=line_height, max_width=inf)
-					lines.append(row)
-					line = []
-				elif string in {" ", "\u2009"}:
-					space = Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, min_width=advance, max_width=(advance if align != 'justify' else inf), height=line_height)
-					line.append(space)
-				else:
-					word = Word(string, 0, baseline, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, width=advance, height=line_height)
-					line.append(word)					
-			
-			tree = Column(lines, 0, node=None, pseudoelement=None, inline=False, gravity=Gravity.TOP_LEFT)
-			#for l, v in tree.print_tree():
-			#	print(" " * l, str(v))
-			self.__cache[document] = tree, box
+		try:
+			loop = get_running_loop()
+		except RuntimeError:
+			return False
+		
+		self.__layout_tasks[document] = loop.create_task(self.__layout_in_background(view, index))
+		return True
+	
+	async def __layout_in_background(self, view, index):
+		"Lay out paragraphs in slices of `text_layout_budget` seconds, yielding to the main loop in between. Resize and redraw the view when done, as the height reported so far was partly estimated."
+		
+		surface = cairo.RecordingSurface(cairo.Content.COLOR, None)
+		ctx = cairo.Context(surface)
+		pango_layout, baseline, line_height, advance = self.__select_font(ctx, None)
+		
+		while index.next_pending() is not None:
+			deadline = perf_counter() + self.text_layout_budget
+			while (n := index.next_pending()) is not None and perf_counter() < deadline:
+				index.set_rows(n, self.__layout_paragraph(index, n, ctx, pango_layout, baseline, None))
+			await sleep(0)
+		
+		surface.finish()
+		if hasattr(view, 'queue_resize'):
+			view.queue_resize()
+		view.queue_draw()
+	
+	def __replay_escapes(self, index, paragraphs, ctx, pango_layout, callback):
+		"Emit callbacks for escape sequences in the paragraphs that are not rendered, so the callback sees all of them in the document order."
+		
+		if not callback:
+			return
+		for n in paragraphs:
+			for position, escapes in sorted(index.paragraphs[n][2].items()):
+				for escape in escapes:
+					callback(Escape.begin_escape, (escape, ctx, pango_layout))
+					callback(Escape.end_escape, (escape, ctx, pango_layout))
+	
+	def __render_text(self, view, document, ctx, box, callback, pointer=None):
+		"Render only the paragraphs intersecting the clip area (or the pointer position). Paragraphs are laid out on demand."
+		
+		x, y, width, height = box
+		
+		index, pango_layout, baseline = self.__prepare_index(document, ctx, width, callback)
+		
+		if pointer:
+			top = bottom = pointer[1] - y
+		else:
+			x1, y1, x2, y2 = ctx.clip_extents()
+			top = max(y1, y) - y
+			bottom = min(y2, y + height) - y
 		
 		if self.use_pango:
 			pango_font = Pango.FontDescription()
@@ -731,7 +966,27 @@ class TextFormat:
 			ctx.set_font_size(14)
 			ctx.select_font_face('sans-serif', cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
 		
-		nodes = tree.render(self, view, ctx, pango_layout, box, callback, pointer)
+		first = index.paragraph_at(top)
+		self.__replay_escapes(index, index.escaped[:bisect_left(index.escaped, first)], ctx, pango_layout, callback)
+		
+		nodes = []
+		n = first
+		while n < len(index) and (n == first or index.top(n) < bottom):
+			if index.rows[n] is None:
+				index.set_rows(n, self.__layout_paragraph(index, n, ctx, pango_layout, baseline, callback))
+			if index.rows[n]:
+				paragraph = Column(index.rows[n], n, node=None, pseudoelement=None, inline=False, gravity=Gravity.TOP_LEFT)
+				result = paragraph.render(self, view, ctx, pango_layout, (x, y + index.top(n), width, paragraph.min_height), callback, pointer)
+				if pointer:
+					nodes.extend(result)
+			else:
+				self.__replay_escapes(index, [n], ctx, pango_layout, callback)
+			n += 1
+		
+		self.__replay_escapes(index, index.escaped[bisect_left(index.escaped, n):], ctx, pango_layout, callback)
+		
+		self.__schedule_layout(view, document, index)
+		
 		if pointer:
 			return nodes
 	
@@ -746,27 +1001,59 @@ class TextFormat:
 			return NotImplemented
 	
 	def image_height_for_width(self, view, document, width, callback):
+		"Return text height for the provided width. Paragraphs are laid out within the time budget, the rest is estimated and laid out in the background."
+		
 		if not self.is_text_document(document):
 			return NotImplemented
 		
-		#print(repr(document))
-		
 		if callback: callback(Escape.begin_poke, document)
 		
 		surface = cairo.RecordingSurface(cairo.Content.COLOR, None)
-		ctx = cairo.Context(surface)		
-		self.__render_text(view, document, ctx, (0, 0, width, inf), callback)
-		tree, _ = self.__cache[document]
+		ctx = cairo.Context(surface)
+		index, pango_layout, baseline = self.__prepare_index(document, ctx, width, callback)
+		
+		background = self.__schedule_layout(view, document, index)
+		deadline = perf_counter() + self.text_layout_budget
+		while (n := index.next_pending()) is not None and (not background or perf_counter() < deadline):
+			index.set_rows(n, self.__layout_paragraph(index, n, ctx, pango_layout, baseline, callback))
+		surface.finish()
 		
 		if callback: callback(Escape.end_poke, document)
 		
-		return tree.min_height
+		return index.height()
 	
 	def image_width_for_height(self, view, document, height, callback):
 		if self.is_text_document(document):
 			raise NotImplementedError
 		else:
 			return NotImplemented
+	
+	def image_content_widths(self, view, document, callback):
+		"Return minimal and maximal content width of the text: the widest word and the widest paragraph."
+		
+		if not self.is_text_document(document):
+			return NotImplemented
+		
+		surface = cairo.RecordingSurface(cairo.Content.COLOR, None)
+		ctx = cairo.Context(surface)
+		pango_layout, baseline, line_height, advance = self.__select_font(ctx, callback)
+		
+		def text_width(text):
+			if self.use_pango:
+				pango_layout.set_text(text)
+				ink_rect, logical_rect = pango_layout.get_pixel_extents()
+				return logical_rect.x + logical_rect.width
+			else:
+				return ctx.text_extents(text).x_advance
+		
+		min_width = max_width = 0
+		for offset, text, escapes in self.__text_index(document).paragraphs:
+			max_width = max(max_width, text_width(text))
+			for word in set(text.split()):
+				min_width = max(min_width, text_width(word))
+		surface.finish()
+		
+		return min_width, max_width
 
 
 if __debug__ and __name__ == '__main__':
@@ -792,6 +1079,24 @@ if __debug__ and __name__ == '__main__' and test_type == 0:
 	
 	a = model.create_document(b'hello,void', 'text/plain')
 	assert model.save_document(a).getvalue() == b'hello,void'
+	
+	tree = LineCountTree([3, 1, 4, 1, 5])
+	assert tree.total == 14
+	assert [tree.prefix(_n) for _n in range(6)] == [0, 3, 4, 8, 9, 14]
+	assert [tree.find(_l) for _l in range(15)] == [0, 0, 0, 1, 2, 2, 2, 2, 3, 4, 4, 4, 4, 4, 4]
+	tree.update(1, 6)
+	assert tree.total == 19 and tree.prefix(2) == 9 and tree.find(8) == 1 and tree.find(9) == 2
+	
+	index = TextIndex([(0, "first", {}), (6, "", {0: ["\x1bX<br/>\x1b\\"]}), (7, "third paragraph", {})])
+	index.reset(100, 10, 10)
+	assert [index.top(_n) for _n in range(3)] == [0, 10, 20]
+	assert index.height() == 40
+	assert index.paragraph_at(25) == 2 and index.paragraph_at_offset(8) == 2 and index.escaped == [1]
+	assert index.next_pending() == 0
+	
+	index = TextIndex([(0, "last line", {}), (10, "", {0: ["\x1bX<br/>\x1b\\"]})]) # text ending with a line break
+	index.reset(100, 10, 10)
+	assert index.is_end(1) and not index.is_end(0) and index.height() == 10
 
 
 if __debug__ and __name__ == '__main__' and test_type != 0:
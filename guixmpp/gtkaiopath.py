@@ -15,7 +15,7 @@ if __name__ == '__main__':
 	gi.require_version('Gio', '2.0')
 from gi.repository import Gio, GLib
 
-from asyncio import Future, gather, to_thread, get_running_loop
+from asyncio import Future, gather, to_thread, get_running_loop, sleep
 
 from collections import deque
 import pathlib
@@ -30,6 +30,29 @@ else:
 	from .async_helper import AsyncGLibCallHelper as _AsyncIOCall
 
 
+"Codes of `Gio.IOErrorEnum` errors worth trying again, as the operation may succeed on the next attempt."
+transient_errors = frozenset(int(_code) for _code in (Gio.IOErrorEnum.FAILED, Gio.IOErrorEnum.WOULD_BLOCK, Gio.IOErrorEnum.BROKEN_PIPE, Gio.IOErrorEnum.NOT_CONNECTED))
+
+"Attempts of an operation failing with a transient error, and seconds before the first retry. Each retry waits twice as long as the previous one."
+retry_attempts = 4
+retry_delay = 0.01
+
+
+async def _retry(call, *args):
+	"Run the GLib async call, trying again on transient errors with exponential backoff, at most `retry_attempts` times in total. The last error is raised."
+	
+	delay = retry_delay
+	for attempt in range(retry_attempts - 1):
+		try:
+			return await call(*args)
+		except GLib.Error as error:
+			if error.code not in transient_errors:
+				raise
+		await sleep(delay)
+		delay *= 2
+	return await call(*args)
+
+
 class StatResult:
 	def __init__(self):
 		self.st_uid = 0
@@ -66,6 +89,9 @@ class StatResult:
 class File:
 	"Object returned by Path.open() method. Supports interface similar to file-like object, but async."
 	
+	"Size of chunks read by `chunks` if not given."
+	chunk_size = 64 * 1024
+	
 	def __init__(self, path, mode, buffering, encoding, errors, newline):
 		self.gfile = Gio.File.new_for_path(str(path))
 		self.mode = mode
@@ -92,6 +118,8 @@ class File:
 	__write = _AsyncIOCall((lambda stream, bytes_, cancellable, on_result: stream.write_async(bytes_, GLib.PRIORITY_DEFAULT, cancellable, on_result)), (lambda stream, task: stream.write_finish(task)))
 	__write_all = _AsyncIOCall((lambda stream, bytes_, cancellable, on_result: stream.write_all_async(bytes_, GLib.PRIORITY_DEFAULT, cancellable, on_result)), (lambda stream, task: stream.write_all_finish(task)))
 	
+	__splice = _AsyncIOCall((lambda stream, source, flags, cancellable, on_result: stream.splice_async(source, flags, GLib.PRIORITY_DEFAULT, cancellable, on_result)), (lambda stream, task: stream.splice_finish(task)))
+	
 	__close = _AsyncIOCall((lambda stream, cancellable, on_result: stream.close_async(GLib.PRIORITY_DEFAULT, cancellable, on_result)), (lambda stream, task: stream.close_finish(task)))
 	
 	async def open(self):
@@ -202,6 +230,67 @@ class File:
 		else:
 			return result
 	
+	async def chunks(self, chunk_size=None):
+		"Iterate over the rest of the file in chunks of at most `chunk_size` bytes. Chunks are bytes, also in text mode, as a chunk may end inside of a character."
+		
+		if not self.read_stream:
+			raise IOError("Stream is not readable.")
+		
+		if chunk_size is None:
+			chunk_size = self.chunk_size
+		
+		if self.__read_buffer:
+			chunk = bytes(self.__read_buffer)
+			self.__read_buffer.clear()
+			yield chunk
+		
+		while not self.__eof:
+			chunk = (await _retry(self.__read, self.read_stream, chunk_size)).get_data()
+			if not chunk:
+				self.__eof = True
+				break
+			yield chunk
+	
+	async def readinto(self, buffer):
+		"Read into a writable buffer (bytearray, memoryview, mmap), at most its length. Return the number of bytes read, 0 at the end of file."
+		
+		if not self.read_stream:
+			raise IOError("Stream is not readable.")
+		
+		view = memoryview(buffer).cast('B')
+		if self.__read_buffer:
+			n = min(len(self.__read_buffer), len(view))
+			view[:n] = self.__read_buffer[:n]
+			del self.__read_buffer[:n]
+			return n
+		
+		if self.__eof or not len(view):
+			return 0
+		
+		chunk = (await _retry(self.__read, self.read_stream, len(view))).get_data()
+		if not chunk:
+			self.__eof = True
+		view[:len(chunk)] = chunk
+		return len(chunk)
+	
+	async def splice(self, source):
+		"Write the rest of the `source` file to this file, without passing the data through Python. Return the number of bytes written."
+		
+		if not self.write_stream:
+			raise IOError("Stream is not writable.")
+		if not source.read_stream:
+			raise IOError("Source stream is not readable.")
+		
+		written = 0
+		if source.__read_buffer:
+			await self.__write_all(self.write_stream, bytes(source.__read_buffer))
+			written += len(source.__read_buffer)
+			source.__read_buffer.clear()
+		
+		written += await self.__splice(self.write_stream, source.read_stream, Gio.OutputStreamSpliceFlags.NONE)
+		source.__eof = True
+		return written
+	
 	async def write(self, data):
 		if not self.write_stream:
 			raise IOError("Stream is not writable.")
@@ -425,39 +514,23 @@ class Path(pathlib.Path, pathlib.PurePosixPath):
 	__load_contents = _AsyncIOCall((lambda gfile, *args, cancellable, on_result: gfile.load_contents_async(*args, cancellable, on_result)), (lambda stream, task: stream.load_contents_finish(task)))
 	
 	async def read_bytes(self):
-		while True:
-			try:
-				return (await self.__load_contents(Gio.File.new_for_path(str(self)))).contents
-			except GLib.Error as error:
-				if error.code == 0:
-					print("ebadf while reading") # FIXME
-					continue
-				elif error.code == 27:
-					print("resource temporarily unavailable") # FIXME
-					continue
-				elif error.code == 45:
-					print("endpoint protocol not connected") # FIXME
-					continue
-				raise
+		return (await _retry(self.__load_contents, Gio.File.new_for_path(str(self)))).contents
+	
+	async def read_chunks(self, chunk_size=None):
+		"Iterate over the file in chunks of at most `chunk_size` bytes, without holding the whole file in memory."
+		
+		async with self.open('rb') as file:
+			async for chunk in file.chunks(chunk_size):
+				yield chunk
 	
 	__replace_contents = _AsyncIOCall((lambda gfile, data, etag, backup, flags, cancellable, on_result: gfile.replace_contents_async(data, etag, backup, flags, cancellable, on_result)), (lambda stream, task: stream.replace_contents_finish(task)))
 	
 	async def write_bytes(self, data):
-		while True:
-			try:
-				success = await self.__replace_contents(Gio.File.new_for_path(str(self)), data, None, False, 0)
-				if success:
-					return len(data)
-				else:
-					return 0
-			except GLib.Error as error:
-				if error.code == 0:
-					print("ebadf while writing") # FIXME
-					continue
-				elif error.code == 44:
-					print("broken pipe") # FIXME
-					continue
-				raise
+		success = await _retry(self.__replace_contents, Gio.File.new_for_path(str(self)), data, None, False, 0)
+		if success:
+			return len(data)
+		else:
+			return 0
 	
 	async def read_text(self, encoding='utf-8', errors=None):
 		return (await self.read_bytes()).decode(encoding)
@@ -490,6 +563,12 @@ class Path(pathlib.Path, pathlib.PurePosixPath):
 		await self.__copy(this_gfile, that_gfile)
 		return self.__class__(target)
 	
+	async def copy_to(self, target):
+		"Copy the file contents to `target`, replacing it, streamed by GLib in chunks. Return the number of bytes copied."
+		
+		async with self.open('rb') as source, self.__class__(target).open('wb') as destination:
+			return await destination.splice(source)
+	
 	__delete = _AsyncIOCall((lambda gfile, cancellable, on_result: gfile.delete_async(GLib.PRIORITY_DEFAULT, cancellable, on_result)), (lambda gfile, task: gfile.delete_finish(task)))
 	
 	async def rmdir(self):
@@ -613,8 +692,20 @@ if __debug__ and __name__ == '__main__':
 				async with f.open() as fd:
 					async for l in fd:
 						print(l)
+				print(" read chunks")
+				async for chunk in f.read_chunks(4):
+					print(chunk)
+		
+		async with (cwd / 'ttt1.txt').open('rb') as fd:
+			buffer = bytearray(4)
+			assert await fd.readinto(buffer) == 4 and buffer == b"teee"
+			assert b''.join([_chunk async for _chunk in fd.chunks(2)]) == b"st me"
+			assert await fd.readinto(buffer) == 0
+		
+		assert await (cwd / 'ttt1.txt').copy_to(cwd / 'ttt3.txt') == 9
+		assert await (cwd / 'ttt3.txt').read_bytes() == b"teeest me"
 		
-		await gather((cwd / 'ttt1.txt').unlink(), (cwd / 'ttt2.txt').unlink())
+		await gather((cwd / 'ttt1.txt').unlink(), (cwd / 'ttt2.txt').unlink(), (cwd / 'ttt3.txt').unlink())
 	
 	run(test())
 
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+#-*- coding:utf-8 -*-
+
+
+__all__ = 'PreloadScanner',
+
+
+import re
+
+
+class PreloadScanner:
+	"""
+	Incremental scanner finding subresource links in a document while it is still being downloaded,
+	so downloads of stylesheets, images and fonts may start before the document is complete and parsed.
+	Finds `<link href>`, `<img src>`, `xlink:href`, `@import` and `url()` references. The results are hints:
+	the real links are found later by `scan_document_links`.
+	"""
+	
+	"Media types worth scanning."
+	scanned_types = frozenset({'text/html', 'application/xhtml+xml', 'application/xml', 'text/xml', 'image/svg+xml', 'image/svg', 'text/css'})
+	
+	"Longest reference recognized, also the length of the unscanned tail kept between chunks."
+	max_reference = 2048
+	
+	patterns = [re.compile(_pattern, re.IGNORECASE) for _pattern in [
+		rb'<(?:link|img|image|use|script)\b[^>]{0,%d}?\s(?:href|src|xlink:href)\s*=\s*["\']([^"\'<>]{1,%d})["\']' % (max_reference, max_reference),
+		rb'\sxlink:href\s*=\s*["\']([^"\'<>]{1,%d})["\']' % max_reference,
+		rb'@import\s+(?:url\(\s*["\']?|["\'])([^"\')\s;]{1,%d})["\')\s;]' % max_reference,
+		rb'url\(\s*["\']?([^"\')\s]{1,%d})["\']?\s*\)' % max_reference
+	]]
+	
+	def __init__(self):
+		self.__tail = b''
+		self.__seen = set()
+	
+	@classmethod
+	def accepts(cls, content_type):
+		return content_type.split(';')[0].strip().lower() in cls.scanned_types
+	
+	def feed(self, chunk):
+		"Scan next chunk of the document. Return the list of new references found."
+		
+		buffer = self.__tail + chunk
+		found = []
+		last_end = 0
+		for pattern in self.patterns:
+			for match in pattern.finditer(buffer):
+				last_end = max(last_end, match.end())
+				try:
+					link = match.group(1).decode('utf-8').strip()
+				except UnicodeDecodeError:
+					continue
+				if link.startswith('#') or link.startswith('data:') or link in self.__seen:
+					continue
+				self.__seen.add(link)
+				found.append(link)
+		
+		self.__tail = buffer[max(last_end, len(buffer) - self.max_reference):] # a reference may continue in the next chunk
+		return found
+
+
+if __debug__ and __name__ == '__main__':
+	document = b'''<html><head><link rel="stylesheet" href="style.css"/><style>@import "print.css"; p { background: url(bg.png) }</style></head>
+	<body><img alt="" src='images/photo.jpg'><svg><image xlink:href="icon.svg"/><use xlink:href="#shape"/></svg></body></html>'''
+	expected = ['style.css', 'print.css', 'bg.png', 'images/photo.jpg', 'icon.svg']
+	
+	for chunk_size in [1, 3, 16, 4096]:
+		scanner = PreloadScanner()
+		links = []
+		for n in range(0, len(document), chunk_size):
+			links.extend(scanner.feed(document[n:n + chunk_size]))
+		assert sorted(links) == sorted(expected), (chunk_size, links)
+	
+	assert PreloadScanner.accepts('text/css; charset=utf-8')
+	assert not PreloadScanner.accepts('image/png')
@@ -7,5 +7,5 @@ __license__ = '?'
 if __name__ != '__main__':
 	from .query import create_dns_query
 	from .reply import parse_dns_reply, get_serial
-	from .client import SyncResolver, AsyncResolver
+	from .client import SyncResolver, AsyncResolver, srv_order
 
@@ -1,18 +1,19 @@
 #!/usr/bin/python3
 
 """
-This is a simple dnsclient that supports A, AAAA, MX, SOA, NS and CNAME
-queries written in python.
+This is a simple dnsclient that supports A, AAAA, MX, SOA, NS, CNAME, TXT and SRV
+queries written in python. Truncated replies are repeated over TCP.
 """
 
-# TODO: support SRV records
-
 
 import asyncio
 import asyncio.protocols
 import socket
 from random import randrange
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from struct import pack, unpack
+from ipaddress import ip_address
+from time import monotonic
 
 try:
 	from .query import create_dns_query
@@ -22,6 +23,23 @@ except ImportError: # allow testing
 	from reply import parse_dns_reply, get_serial
 
 
+def srv_order(records):
+	"Order SRV records `(priority, weight, port, target, ...)` as they should be tried: lowest priority first, by weighted random choice within a priority (RFC 2782). Fields after the target are kept."
+	
+	ordered = []
+	for priority in sorted({_record[0] for _record in records}):
+		group = sorted((_record for _record in records if _record[0] == priority), key=(lambda _record: _record[1])) # zero weights first
+		while group:
+			choice = randrange(sum(_record[1] for _record in group) + 1)
+			running = 0
+			for n, record in enumerate(group):
+				running += record[1]
+				if running >= choice:
+					break
+			ordered.append(group.pop(n))
+	return ordered
+
+
 class SyncResolver:
 	def __init__(self):
 		self.server = [('127.0.0.53', 53)]
@@ -52,120 +70,420 @@ class SyncResolver:
 		del self.sock
 
 
-class AsyncResolver(asyncio.protocols.DatagramProtocol):
-	def __init__(self):
-		self.retry = 3
-		self.timeout = 3
-		self.server = [('127.0.0.53', 53)]
-		self.waiting = {}
-		self.cache = defaultdict(set)
+class TruncatedReply(Exception):
+	"The UDP reply had the TC bit set, the query must be repeated over TCP."
+
+
+class Upstream(asyncio.protocols.DatagramProtocol):
+	"UDP endpoint of one upstream server, with the smoothed round trip time used to choose the fastest server."
+	
+	"Weight of the newest round trip time in the smoothed value."
+	srtt_weight = 0.3
+	
+	def __init__(self, resolver, address):
+		self.resolver = resolver
+		self.address = address
+		self.transport = None
+		self.srtt = 0 # 0 until the first reply, so servers not tried yet are chosen first
+		self.query_counter = 0
+		self.failure_counter = 0
 	
 	def connection_made(self, transport):
 		self.transport = transport
 	
 	def datagram_received(self, reply, addr):
-		while reply:
-			serial = get_serial(reply)
-			
-			if (serial not in self.waiting) or self.waiting[serial].done():
-				return # warning
-			
-			try:
-				result, l = parse_dns_reply(reply)
-			except Exception as error:
-				self.waiting[serial].set_exception(error)
-				break
-			else:
-				self.waiting[serial].set_result(result)
-				reply = reply[l:]
+		self.resolver.reply_received(self, reply)
 	
 	def error_received(self, exc):
-		if exc:
-			raise exc # TODO: raise proper exception
+		self.resolver.upstream_failed(self, exc)
 	
 	def connection_lost(self, exc):
-		del self.transport
-		if isinstance(exc, BaseException):
-			raise exc # TODO: raise proper exception
+		self.transport = None
+		if exc is not None:
+			self.resolver.upstream_failed(self, exc)
+	
+	def measured(self, rtt):
+		self.srtt = rtt if not self.srtt else (1 - self.srtt_weight) * self.srtt + self.srtt_weight * rtt
+	
+	def penalize(self, timeout):
+		"The server did not answer in time or is unreachable. Make it the last choice until its time decays."
+		self.failure_counter += 1
+		self.srtt = max(self.srtt * 2, timeout)
+	
+	def query_timeout(self, min_timeout, max_timeout):
+		"Time to wait for a reply before the query is sent again, a few round trip times."
+		return min(max(4 * self.srtt, min_timeout), max_timeout) if self.srtt else max_timeout
+	
+	def __repr__(self):
+		return f'<{self.__class__.__name__} {self.address} srtt={self.srtt * 1000:.1f}ms>'
+
+
+class AsyncResolver:
+	"""
+	Resolver keeping answers in a cache shared by all instances in the process, until their TTL expires. The cache holds at most
+	`cache_size` record sets, least recently used are evicted first, and expired records are pruned in background. Negative answers
+	(NXDOMAIN and no data) are cached for the time given by the SOA record of the zone (RFC 2308). Identical queries in flight are sent once.
+	Truncated UDP replies are repeated over TCP. Of many upstream servers the one answering fastest is used, the others when it fails.
+	"""
+	
+	cache = OrderedDict() # (name, type) -> {rdata: expiry time}
+	negative_cache = OrderedDict() # (name, type) -> expiry time, type None for names that do not exist
+	
+	"Maximum number of record sets in the cache, and of negative answers in the negative cache."
+	cache_size = 4096
+	
+	"Negative answers are cached for at most this many seconds, the maximum recommended by RFC 2308."
+	max_negative_ttl = 3 * 3600
+	
+	"Seconds between removals of expired records."
+	prune_interval = 60
+	
+	"Smoothed round trip times of servers not chosen are multiplied by this at every query, so slow or failed servers are tried again eventually."
+	srtt_decay = 0.995
+	
+	def __init__(self, server=None):
+		self.retry = 3
+		self.timeout = 3
+		self.min_timeout = 0.5
+		self.max_queries = 64 # queries sent and not answered yet, more would overflow socket buffers and get lost
+		self.server = list(server) if server else [('127.0.0.53', 53)]
+		self.upstreams = []
+		self.waiting = {} # serial -> (future, upstream)
+		self.resolving = {} # (name, type) -> task resolving the name, joined by identical queries
+		self.__pruning = None
+		self.__query_slots = None
+		self.cache_hit_counter = 0
+		self.cache_miss_counter = 0
+		self.negative_hit_counter = 0
+		self.coalesced_counter = 0
+		self.prefetch_counter = 0
+		self.tcp_fallback_counter = 0
+		self.retry_counter = 0
+		self.evicted_counter = 0
+	
+	def reply_received(self, upstream, reply):
+		"A datagram holds one message, parsed in place."
+		
+		if len(reply) < 12:
+			return # warning
+		serial = get_serial(reply)
+		
+		try:
+			future, sent_to = self.waiting[serial]
+		except KeyError:
+			return # warning
+		if sent_to is not upstream or future.done():
+			return # warning
+		
+		if reply[2] & 0x02: # TC bit
+			future.set_exception(TruncatedReply())
+			return
+		
+		try:
+			result, l = parse_dns_reply(reply)
+		except Exception as error:
+			future.set_exception(error)
 		else:
-			print("warning", exc) # TODO: raise proper exception
+			future.set_result(result)
+	
+	def upstream_failed(self, upstream, exc):
+		"Server unreachable. Fail the queries sent to it, so they are sent to another server without waiting for the timeout."
+		
+		upstream.penalize(self.timeout)
+		for future, sent_to in self.waiting.values():
+			if sent_to is upstream and not future.done():
+				future.set_exception(exc)
+	
+	def choose_upstream(self, tried=()):
+		"The server with the shortest smoothed round trip time, preferably one not tried yet for this query."
+		
+		upstreams = [_upstream for _upstream in self.upstreams if _upstream.transport is not None]
+		if not upstreams:
+			raise ConnectionError("No DNS server reachable.")
+		upstream = min((_upstream for _upstream in upstreams if _upstream not in tried), key=(lambda _upstream: _upstream.srtt), default=None)
+		if upstream is None:
+			upstream = min(upstreams, key=(lambda _upstream: _upstream.srtt))
+		for other in upstreams:
+			if other is not upstream:
+				other.srtt *= self.srtt_decay
+		return upstream
 	
 	def prune_cache(self):
-		t = self.loop.time()
-		for addr, ttl in frozenset(self.cache[name, type_]):
-			if ttl <= t:
-				self.cache[name, type_].remove((addr, ttl))
-				if not self.cache[name, type_]:
-					del self.cache[name, type_]
+		"Remove expired records and negative answers."
+		
+		t = monotonic()
+		for key, records in list(self.cache.items()):
+			for rdata, expiry in list(records.items()):
+				if expiry <= t:
+					del records[rdata]
+			if not records:
+				del self.cache[key]
+		
+		for key, expiry in list(self.negative_cache.items()):
+			if expiry <= t:
+				del self.negative_cache[key]
 	
-	async def resolve(self, name, type_):
-		t = self.loop.time()
-		result = []
-		for addr, ttl in frozenset(self.cache[name, type_]):
-			if ttl > t:
-				result.append(addr)
-			else:
-				self.cache[name, type_].remove((addr, ttl))
+	async def __prune_periodically(self):
+		while True:
+			await asyncio.sleep(self.prune_interval)
+			self.prune_cache()
+	
+	def cached(self, name, type_):
+		"Return unexpired cached records, or an empty list."
 		
+		try:
+			records = self.cache[name, type_]
+		except KeyError:
+			return []
+		
+		t = monotonic()
+		result = [_rdata for (_rdata, _expiry) in records.items() if _expiry > t]
 		if result:
-			return result
+			self.cache.move_to_end((name, type_))
+		else:
+			del self.cache[name, type_]
+		return result
+	
+	def cached_negative(self, name, type_):
+		"Return True if the name is known not to exist, or not to have records of this type."
 		
-		for n in range(self.retry):
+		t = monotonic()
+		for key in [(name, None), (name, type_)]:
 			try:
-				return await self.raw_resolve(name, type_)
-			except TimeoutError:
-				pass
-		else:
+				expiry = self.negative_cache[key]
+			except KeyError:
+				continue
+			if expiry > t:
+				return True
+			del self.negative_cache[key]
+		return False
+	
+	def __store(self, cache, key, value):
+		cache[key] = value
+		cache.move_to_end(key)
+		while len(cache) > self.cache_size:
+			cache.popitem(last=False)
+			self.evicted_counter += 1
+	
+	async def resolve(self, name, type_):
+		result = self.cached(name, type_)
+		if result:
+			self.cache_hit_counter += 1
+			return result
+		
+		if self.cached_negative(name, type_):
+			self.negative_hit_counter += 1
 			return []
+		
+		try:
+			resolving = self.resolving[name, type_]
+		except KeyError:
+			self.cache_miss_counter += 1
+			resolving = self.__start(name, type_)
+		else:
+			self.coalesced_counter += 1 # the same query was sent by another caller or by `prefetch`
+		return await asyncio.shield(resolving)
 	
-	async def raw_resolve(self, name, type_):
-		serial = randrange(2**16)
-		while serial in self.waiting:
+	def __start(self, name, type_):
+		self.resolving[name, type_] = self.loop.create_task(self.__resolve(name, type_))
+		return self.resolving[name, type_]
+	
+	async def __resolve(self, name, type_):
+		"Send the query, again after a timeout or error, to the fastest server not tried yet. Raise the last error if all servers are unreachable."
+		
+		try:
+			tried = set()
+			error = None
+			for n in range(self.retry):
+				if n:
+					self.retry_counter += 1
+				upstream = self.choose_upstream(tried)
+				tried.add(upstream)
+				try:
+					return await self.raw_resolve(name, type_, upstream)
+				except TimeoutError:
+					error = None
+				except OSError as os_error:
+					error = os_error
+			else:
+				if error is not None:
+					raise error
+				return []
+		finally:
+			del self.resolving[name, type_]
+	
+	async def raw_resolve(self, name, type_, upstream=None):
+		if upstream is None:
+			upstream = self.choose_upstream()
+		
+		async with self.__query_slots:
 			serial = randrange(2**16)
+			while serial in self.waiting:
+				serial = randrange(2**16)
+			
+			query = create_dns_query(name, type_, serial)
+			future = self.loop.create_future()
+			self.waiting[serial] = future, upstream
+			upstream.query_counter += 1
+			start = monotonic()
+			upstream.transport.sendto(query)
+			
+			try:
+				result = await asyncio.wait_for(future, timeout=upstream.query_timeout(self.min_timeout, self.timeout))
+			except TruncatedReply:
+				result = None
+			except TimeoutError:
+				upstream.penalize(self.timeout)
+				raise
+			finally:
+				del self.waiting[serial]
+			upstream.measured(monotonic() - start)
 		
-		query = create_dns_query(name, type_, serial)
-		self.waiting[serial] = self.loop.create_future()
-		self.transport.sendto(query)
+		if result is None:
+			self.tcp_fallback_counter += 1
+			result = await asyncio.wait_for(self.tcp_query(upstream.address, query), timeout=self.timeout)
 		
+		return self.store_reply(name, type_, result)
+	
+	async def tcp_query(self, address, query):
+		"Send the query over TCP, as done when the UDP reply was truncated. Messages are prefixed with their length (RFC 1035 section 4.2.2)."
+		
+		reader, writer = await asyncio.open_connection(address[0], address[1])
 		try:
-			result = await asyncio.wait_for(self.waiting[serial], timeout=self.timeout)
+			writer.write(pack('>H', len(query)) + query)
+			length, = unpack('>H', await reader.readexactly(2))
+			reply = await reader.readexactly(length)
+		except asyncio.IncompleteReadError as error:
+			raise ConnectionError("DNS server closed the connection.") from error
 		finally:
-			del self.waiting[serial]
+			writer.close()
+		
+		if get_serial(reply) != get_serial(query):
+			raise ValueError("Reply to another query.")
+		result, l = parse_dns_reply(reply)
+		return result
+	
+	def store_reply(self, name, type_, result):
+		"Cache the records of the reply and return the records of the type asked for, following CNAMEs. Cache negative answers."
 		
-		t = self.loop.time()
+		t = monotonic()
 		addrs = []
 		cnames = []
+		rrsets = defaultdict(dict)
 		for answer in result.answer:
 			if answer.name == name and answer.x_type == 'CNAME':
 				cnames.append(answer.rdata)
 			if answer.name == name and answer.x_type == type_:
 				addrs.append(answer.rdata)
-			self.cache[answer.name, answer.x_type].add((answer.rdata, t + answer.ttl))
+			rrsets[answer.name, answer.x_type][answer.rdata] = t + answer.ttl
 		
 		for cname in cnames:
 			for answer in result.answer:
 				if answer.name == cname and answer.x_type == type_:
 					addrs.append(answer.rdata)
-					self.cache[cname, answer.x_type].add((answer.rdata, t + answer.ttl))
+		
+		for key, records in rrsets.items():
+			self.__store(self.cache, key, records)
+		
+		if not addrs and result.header.rcode in [0, 3]: # no data or NXDOMAIN
+			negative_ttl = min((min(_answer.ttl, _answer.rdata[6]) for _answer in result.answer if _answer.x_type == 'SOA'), default=None)
+			if negative_ttl is not None: # without SOA the answer is not cached (RFC 2308 section 5)
+				key = (name, None) if (result.header.rcode == 3 and not cnames) else (name, type_)
+				self.__store(self.negative_cache, key, t + min(negative_ttl, self.max_negative_ttl))
+		
 		return addrs
 	
+	async def getaddrinfo(self, host, port, *, family=0, type=0, proto=0):
+		"Resolve `host` to a list of tuples like `loop.getaddrinfo`, IPv6 addresses first. Numeric addresses are returned without a query."
+		
+		try:
+			address = ip_address(host)
+		except ValueError:
+			pass
+		else:
+			if address.version == 6 and family in [0, socket.AF_UNSPEC, socket.AF_INET6]:
+				return [(socket.AF_INET6, type, proto, '', (host, port, 0, 0))]
+			elif address.version == 4 and family in [0, socket.AF_UNSPEC, socket.AF_INET]:
+				return [(socket.AF_INET, type, proto, '', (host, port))]
+			else:
+				return []
+		
+		addrs4 = addrs6 = []
+		if family in [0, socket.AF_UNSPEC]:
+			addrs4, addrs6 = await asyncio.gather(self.resolve(host, 'A'), self.resolve(host, 'AAAA'))
+		elif family == socket.AF_INET:
+			addrs4 = await self.resolve(host, 'A')
+		elif family == socket.AF_INET6:
+			addrs6 = await self.resolve(host, 'AAAA')
+		else:
+			raise ValueError("Invalid address family.")
+		
+		return [(socket.AF_INET6, type, proto, '', (_addr6, port, 0, 0)) for _addr6 in addrs6] + [(socket.AF_INET, type, proto, '', (_addr4, port)) for _addr4 in addrs4]
+	
+	def prefetch(self, names):
+		"Start resolving host names in background, so the addresses are already known when connections are opened."
+		
+		for name in names:
+			try:
+				ip_address(name)
+			except ValueError:
+				pass
+			else:
+				continue
+			
+			for type_ in ['A', 'AAAA']:
+				if (name, type_) in self.resolving or self.cached(name, type_) or self.cached_negative(name, type_):
+					continue
+				self.__start(name, type_).add_done_callback(self.__prefetched)
+				self.prefetch_counter += 1
+	
+	@staticmethod
+	def __prefetched(task):
+		"Errors of prefetching are not reported, the name is resolved again when needed."
+		if not task.cancelled():
+			task.exception()
+	
 	async def __aenter__(self):
 		loop = asyncio.get_running_loop()
 		await self.open(loop)
 		return self
 	
 	async def open(self, loop):
+		"Open a UDP endpoint for every server. Raise `OSError` if none could be opened."
+		
 		self.loop = loop
-		await self.loop.create_datagram_endpoint((lambda: self), remote_addr=self.server[0], flags=socket.AI_NUMERICHOST)
+		self.__query_slots = asyncio.Semaphore(self.max_queries)
+		error = None
+		for address in self.server:
+			upstream = Upstream(self, address)
+			try:
+				await self.loop.create_datagram_endpoint((lambda: upstream), remote_addr=address, flags=socket.AI_NUMERICHOST)
+			except OSError as os_error:
+				error = os_error
+			else:
+				self.upstreams.append(upstream)
+		
+		if not self.upstreams:
+			raise error if error is not None else ConnectionError("No DNS server configured.")
+		self.__pruning = self.loop.create_task(self.__prune_periodically())
 	
 	async def __aexit__(self, *args):
 		await self.close()
 	
 	async def close(self):
-		self.transport.abort()
+		for task in list(self.resolving.values()):
+			task.cancel()
+		if self.__pruning is not None:
+			self.__pruning.cancel()
+			self.__pruning = None
+		for upstream in self.upstreams:
+			if upstream.transport is not None:
+				upstream.transport.abort()
+		self.upstreams.clear()
 		del self.loop
-		for future in self.waiting.values():
-			future.set_exception(RuntimeError("Closing."))
+		for future, upstream in self.waiting.values():
+			if not future.done():
+				future.set_exception(RuntimeError("Closing."))
 		self.waiting.clear()
 
 
@@ -88,7 +88,9 @@ def create_dns_query(domain_name, query_type, x_id):
     elif query_type == "TXT":
         # text strings
         code = 16
-        raise NotImplementedError
+    elif query_type == "SRV":
+        # service location
+        code = 33
     elif query_type == "PTR":
         # domain name pointer
         code = 12
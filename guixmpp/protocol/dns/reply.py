@@ -1,47 +1,84 @@
 #!/usr/bin/python3
 
 
-"Module used for interpreting answers to queries."
+"""
+Module used for interpreting answers to queries.
+
+The message is read in place through a `memoryview` and offsets, without slicing
+copies. Names are decoded once per message: every decoded name is remembered by the
+offset of each of its labels, so compression pointers to a name already seen
+(the question name, usually) are resolved with a single dict lookup.
+"""
 
 from struct import unpack_from
-from collections import namedtuple
-
-### Tuples for message parts
-Header = namedtuple("Header", [
-    'x_id',
-    'qr',
-    'opcode',
-    'aa',
-    'tc',
-    'rd',
-    'ra',
-    'rcode',
-    'qdcount',
-    'ancount',
-    'nscount',
-    'arcount',
-    ])
-
-Question = namedtuple("Question", [
-    'qname',
-    'qtype',
-    'qclass',
-    ])
-
-Answer = namedtuple("Answer", [
-    'name',
-    'x_type',
-    'x_class',
-    'ttl',
-    'rdlength',
-    'rdata',
-    ])
-
-Reply = namedtuple("Reply", [
-    'header',
-    'question',
-    'answer',
-    ])
+
+
+### Records for message parts
+
+class Record:
+    "Base of message part records. Fields are listed in `__slots__`; records compare and unpack like tuples."
+
+    __slots__ = ()
+
+    def __iter__(self):
+        return (getattr(self, _field) for _field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + ', '.join(f'{_field}={getattr(self, _field)!r}' for _field in self.__slots__) + ')'
+
+
+class Header(Record):
+    __slots__ = 'x_id', 'qr', 'opcode', 'aa', 'tc', 'rd', 'ra', 'rcode', 'qdcount', 'ancount', 'nscount', 'arcount'
+
+    def __init__(self, x_id, qr, opcode, aa, tc, rd, ra, rcode, qdcount, ancount, nscount, arcount):
+        self.x_id = x_id
+        self.qr = qr
+        self.opcode = opcode
+        self.aa = aa
+        self.tc = tc
+        self.rd = rd
+        self.ra = ra
+        self.rcode = rcode
+        self.qdcount = qdcount
+        self.ancount = ancount
+        self.nscount = nscount
+        self.arcount = arcount
+
+
+class Question(Record):
+    __slots__ = 'qname', 'qtype', 'qclass'
+
+    def __init__(self, qname, qtype, qclass):
+        self.qname = qname
+        self.qtype = qtype
+        self.qclass = qclass
+
+
+class Answer(Record):
+    __slots__ = 'name', 'x_type', 'x_class', 'ttl', 'rdlength', 'rdata'
+
+    def __init__(self, name, x_type, x_class, ttl, rdlength, rdata):
+        self.name = name
+        self.x_type = x_type
+        self.x_class = x_class
+        self.ttl = ttl
+        self.rdlength = rdlength
+        self.rdata = rdata
+
+
+class Reply(Record):
+    __slots__ = 'header', 'question', 'answer'
+
+    def __init__(self, header, question, answer):
+        self.header = header
+        self.question = question
+        self.answer = answer
 
 
 def get_serial(msg):
@@ -50,35 +87,29 @@ def get_serial(msg):
 
 def parse_dns_reply(msg):
     """ Function used to parse the DNS reply message.
-        
+
     Args:
-        msg: The message recieved from the DNS server
+        msg: The message recieved from the DNS server, `bytes` or any
+            object supporting the buffer protocol
 
     Returns:
-        The DNS reply message as a Reply namedtuple in the following
-        form: (Header, Question, [Answer]).
+        The DNS reply message as a Reply record in the following
+        form: (Header, Question, [Answer]), and the length of the message.
 
     """
 
+    msg = memoryview(msg)
+    names = {}
+
     offset = 0
     header, l = extract_header(msg, offset)
     offset += l
-    question, l = extract_question(msg, offset)
+    question, l = extract_question(msg, offset, names)
     offset += l
 
     answer = []
-    for _ in range(header.ancount):
-        a, l = extract_answer(msg, offset)
-        answer.append(a)
-        offset += l
-
-    for _ in range(header.nscount):
-        a, l = extract_answer(msg, offset)
-        answer.append(a)
-        offset += l
-
-    for _ in range(header.arcount):
-        a, l = extract_answer(msg, offset)
+    for _ in range(header.ancount + header.nscount + header.arcount):
+        a, l = extract_answer(msg, offset, names)
         answer.append(a)
         offset += l
 
@@ -87,21 +118,18 @@ def parse_dns_reply(msg):
 
 def extract_header(msg, offset):
     """ Function used to extract the header from the DNS reply message.
-        
+
     Args:
         msg: The message recieved from the DNS server
 
     Returns:
-        The header of the reply as a Header namedtuple in the following
-        form: Header(x_id, qr, opcode, aa, tc, rd, ra, rcode, qdcount, 
+        The header of the reply as a Header record in the following
+        form: Header(x_id, qr, opcode, aa, tc, rd, ra, rcode, qdcount,
         ancount, nscount, arcount)
 
     """
 
-    raw_header = unpack_from(">HHHHHH", msg, offset)
-
-    x_id = raw_header[0]
-    flags = raw_header[1]
+    x_id, flags, qdcount, ancount, nscount, arcount = unpack_from(">HHHHHH", msg, offset)
 
     qr = flags >> 15
     opcode = (flags & 0x7800) >> 11
@@ -111,106 +139,74 @@ def extract_header(msg, offset):
     ra = (flags & 0x0080) >> 7
     rcode = (flags & 0x000f)
 
-    qdcount = raw_header[2]
-    ancount = raw_header[3]
-    nscount = raw_header[4]
-    arcount = raw_header[5]
-
     return Header(x_id, qr, opcode, aa, tc, rd, ra, rcode, qdcount, ancount, nscount, arcount), 12
 
 
-def extract_question(msg, offset):
+def extract_question(msg, offset, names=None):
     """ Function used to extract the question section from a DNS reply.
-        
+
     Args:
         msg: The message recieved from the DNS server
-        qname_len: The length of the name beign querried
+        offset: The number of bytes from the start of the message until
+            the question section
+        names: The name cache of the message, see `extract_name`
 
     Returns:
-        The question section of the reply as a Question namedtuple in the 
-        following form: Question(qname, qtype, qclass)
+        The question section of the reply as a Question record in the
+        following form: Question(qname, qtype, qclass), and its length
 
     """
 
-    # qname
-    raw_qname = []
-    byte = None
-    while byte != 0:
-        byte = unpack_from(">B", msg, offset)[0]
-        raw_qname.append(byte)
-        offset += 1
+    qname, bytes_read = extract_name(msg, offset, names)
+    qtype, qclass = unpack_from(">HH", msg, offset + bytes_read)
 
-    qname = dns_decode(bytes(raw_qname))
-    qtype = unpack_from(">H", msg, offset)[0]
-    qclass = unpack_from(">H", msg, offset + 2)[0]
+    return Question(qname, qtype, qclass), bytes_read + 2 + 2
 
-    return Question(qname, qtype, qclass), len(raw_qname) + 2 + 2
 
-
-def extract_answer(msg, offset):
+def extract_answer(msg, offset, names=None):
     """ Function used to extract a RR from a DNS reply.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
             of the question section (or until the end of the last RR)
+        names: The name cache of the message, see `extract_name`
 
     Returns:
         The resource record section of the reply that begins at the given offset
         and the offset from the start of the message to where the returned RR
-        ends in the following form: (Answer(name, x_type, x_class, ttl, rdlength, 
+        ends in the following form: (Answer(name, x_type, x_class, ttl, rdlength,
         rdata), offset)
 
-    If the DNS Response is not implemented or recognized, an error message is
-    shown and the program will exit.
+    Records of types not recognized (like OPT or RRSIG) are skipped over by
+    their RDLENGTH: their type is left as the numeric code and their RDATA
+    as raw bytes, so the other records of the reply are still read.
 
     """
 
-    name, bytes_read = extract_name(msg, offset)
+    if names is None:
+        names = {}
+
+    name, bytes_read = extract_name(msg, offset, names)
     offset += bytes_read
 
-    aux = unpack_from(">HHIH", msg, offset)
+    x_type, x_class, ttl, rdlength = unpack_from(">HHIH", msg, offset)
     offset += 10
 
-    x_type = aux[0]
-    x_class = aux[1]
-    ttl = aux[2]
-    rdlength = aux[3]
-
-    rdata = ''
-    if x_type == 1:
-        # A type
-        a_type = 'A'
-        rdata = extract_a_rdata(msg, offset, rdlength)
-    elif x_type == 2:
-        # NS type
-        a_type = 'NS'
-        rdata = extract_ns_rdata(msg, offset, rdlength)
-    elif x_type == 5:
-        # CNAME type
-        a_type = 'CNAME'
-        rdata = extract_cname_rdata(msg, offset, rdlength)
-    elif x_type == 6:
-        # SOA type
-        a_type = 'SOA'
-        rdata = extract_soa_rdata(msg, offset, rdlength)
-    elif x_type == 15:
-        # MX type
-        a_type = 'MX'
-        rdata = extract_mx_rdata(msg, offset, rdlength)
-    elif x_type == 28:
-        # AAAA type
-        a_type = 'AAAA'
-        rdata = extract_aaaa_rdata(msg, offset, rdlength)
-    else:
-        raise ValueError(f"DNS Response not recognized (x_type={x_type}).")
+    try:
+        a_type, extract_rdata = rdata_extractors[x_type]
+    except KeyError:
+        if offset + rdlength > len(msg):
+            raise ValueError(f"DNS record of type {x_type} extends past the end of the message.")
+        return Answer(name, x_type, x_class, ttl, rdlength, bytes(msg[offset : offset + rdlength])), bytes_read + 10 + rdlength
+    rdata = extract_rdata(msg, offset, rdlength, names)
 
     return Answer(name, a_type, x_class, ttl, rdlength, rdata), bytes_read + 10 + rdlength
 
 
-def extract_a_rdata(msg, offset, rdlength):
+def extract_a_rdata(msg, offset, rdlength, names=None):
     """ Function used to extract the RDATA from an A type message.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
@@ -222,14 +218,12 @@ def extract_a_rdata(msg, offset, rdlength):
 
     """
 
-    fmt_str = ">" + "B" * rdlength
-    rdata = unpack_from(fmt_str, msg, offset)
-    return '.'.join(str(_x) for _x in rdata)
+    return '%d.%d.%d.%d' % unpack_from(">BBBB", msg, offset)
 
 
-def extract_aaaa_rdata(msg, offset, rdlength):
+def extract_aaaa_rdata(msg, offset, rdlength, names=None):
     """ Function used to extract the RDATA from an AAAA type message.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
@@ -241,19 +235,12 @@ def extract_aaaa_rdata(msg, offset, rdlength):
 
     """
 
-    fmt_str = ">" + "H" * (rdlength // 2)
-    rdata = unpack_from(fmt_str, msg, offset)
+    return '%x:%x:%x:%x:%x:%x:%x:%x' % unpack_from(">HHHHHHHH", msg, offset)
 
-    c = []
-    for b in rdata:
-        c.append(hex(b)[2:])
 
-    return ':'.join(c)
-
-
-def extract_ns_rdata(msg, offset, rdlength):
+def extract_ns_rdata(msg, offset, rdlength, names=None):
     """ Function used to extract the RDATA from a NS type message.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
@@ -261,19 +248,17 @@ def extract_ns_rdata(msg, offset, rdlength):
         rdlength: The length of the RDATA section
 
     Returns:
-        The RDATA field of the answer section as a string and the offset from
-        the start of the message until the end of the rdata field as a tuple:
-        (rdata, field)
+        The RDATA field of the answer section as a string.
 
     """
 
-    name, bytes_read = extract_name(msg, offset)
+    name, bytes_read = extract_name(msg, offset, names)
     return name
 
 
-def extract_cname_rdata(msg, offset, rdlength):
+def extract_cname_rdata(msg, offset, rdlength, names=None):
     """ Function used to extract the RDATA from a CNAME type message.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
@@ -281,19 +266,17 @@ def extract_cname_rdata(msg, offset, rdlength):
         rdlength: The length of the RDATA section
 
     Returns:
-        The RDATA field of the answer section as a string and the offset from
-        the start of the message until the end of the rdata field as a tuple:
-        (rdata, field)
+        The RDATA field of the answer section as a string.
 
     """
 
-    name, bytes_read = extract_name(msg, offset)
+    name, bytes_read = extract_name(msg, offset, names)
     return name
 
 
-def extract_soa_rdata(msg, offset, rdlength):
+def extract_soa_rdata(msg, offset, rdlength, names=None):
     """ Function used to extract the RDATA from a SOA type message.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
@@ -302,31 +285,25 @@ def extract_soa_rdata(msg, offset, rdlength):
 
     Returns:
         The RDATA field of the answer section as a tuple of the following form:
-        (pns, amb, serial, refesh, retry, expiration, ttl)    
+        (pns, amb, serial, refesh, retry, expiration, ttl)
 
     """
 
     # extract primary NS
-    (pns, bytes_read) = extract_name(msg, offset)
+    (pns, bytes_read) = extract_name(msg, offset, names)
     offset += bytes_read
     # extract admin MB
-    (amb, bytes_read) = extract_name(msg, offset)
+    (amb, bytes_read) = extract_name(msg, offset, names)
     offset += bytes_read
 
-    aux = unpack_from(">IIIII", msg, offset)
-
-    serial = aux[0]
-    refesh = aux[1]
-    retry = aux[2]
-    expiration = aux[3]
-    ttl = aux[4]
+    serial, refesh, retry, expiration, ttl = unpack_from(">IIIII", msg, offset)
 
-    return (pns, amb, serial, refesh, retry, expiration, ttl)    
+    return (pns, amb, serial, refesh, retry, expiration, ttl)
 
 
-def extract_mx_rdata(msg, offset, rdlength):
+def extract_mx_rdata(msg, offset, rdlength, names=None):
     """ Function used to extract the RDATA from a MX type message.
-        
+
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
@@ -340,56 +317,152 @@ def extract_mx_rdata(msg, offset, rdlength):
     """
 
     preference = unpack_from(">H", msg, offset)[0]
-    offset += 2
-    
-    mail_ex, l = extract_name(msg, offset)
+    mail_ex, l = extract_name(msg, offset + 2, names)
     return preference, mail_ex
 
 
-def extract_name(msg, offset):
+def extract_txt_rdata(msg, offset, rdlength, names=None):
+    """ Function used to extract the RDATA from a TXT type message.
+
+    Args:
+        msg: The message recieved from the DNS server
+        offset: The number of bytes from the start of the message until the end
+            of the question section (or until the end of the last RR)
+        rdlength: The length of the RDATA section
+
+    Returns:
+        The RDATA field of the answer section as a tuple of the character
+        strings it holds, as bytes (TXT records need not be text).
+
+    """
+
+    strings = []
+    end = offset + rdlength
+    while offset < end:
+        length = msg[offset]
+        strings.append(bytes(msg[offset + 1 : offset + 1 + length]))
+        offset += 1 + length
+    return tuple(strings)
+
+
+def extract_srv_rdata(msg, offset, rdlength, names=None):
+    """ Function used to extract the RDATA from a SRV type message (RFC 2782).
+
+    Args:
+        msg: The message recieved from the DNS server
+        offset: The number of bytes from the start of the message until the end
+            of the question section (or until the end of the last RR)
+        rdlength: The length of the RDATA section
+
+    Returns:
+        The RDATA field of the answer section as a tuple of the following form:
+        (priority, weight, port, target). The target is an empty string if
+        the service is not available at the domain.
+
+    """
+
+    priority, weight, port = unpack_from(">HHH", msg, offset)
+    target, l = extract_name(msg, offset + 6, names)
+    return priority, weight, port, target
+
+
+### Record type code -> (type name, RDATA extractor)
+rdata_extractors = {
+    1: ('A', extract_a_rdata),
+    2: ('NS', extract_ns_rdata),
+    5: ('CNAME', extract_cname_rdata),
+    6: ('SOA', extract_soa_rdata),
+    15: ('MX', extract_mx_rdata),
+    16: ('TXT', extract_txt_rdata),
+    28: ('AAAA', extract_aaaa_rdata),
+    33: ('SRV', extract_srv_rdata),
+    }
+
+
+def extract_name(msg, offset, names=None):
     """ Function used to extract the name field from the answer section.
 
     Args:
         msg: The message recieved from the DNS server
         offset: The number of bytes from the start of the message until the end
             of the question section (or until the end of the last RR)
-        
-    Returns: 
+        names: Dict of the names already decoded from this message, by offset
+            of each label. Filled with the labels of this name, so following
+            compression pointers to them are resolved without decoding.
+
+    Returns:
         Tuple containing the name and number of bytes read.
 
+    Raises ValueError on compression pointers that do not point before the
+    labels read so far, which could loop forever.
+
     """
 
-    raw_name = []
-    bytes_read = 1
-    jump = False
+    if names is None:
+        names = {}
+
+    labels = []
+    starts = []
+    bytes_read = None
+    position = segment = offset
 
     while True:
-        byte = unpack_from(">B", msg, offset)[0]
-        if byte == 0:
-            offset += 1
+        if position in names:
+            suffix = names[position]
+            break
+
+        length = msg[position]
+        if length == 0:
+            suffix = ''
+            position += 1
             break
 
         # If the field has the first two bits equal to 1, it's a pointer
-        if byte >= 192:
-            next_byte = unpack_from(">B", msg, offset + 1)[0]
-            # Compute the pointer
-            offset = ((byte << 8) + next_byte - 0xc000) - 1
-            jump = True
+        if length >= 0xc0:
+            pointer = ((length & 0x3f) << 8) | msg[position + 1]
+            if bytes_read is None:
+                bytes_read = position + 2 - offset
+            if pointer >= segment:
+                raise ValueError("DNS name compression pointer does not point backwards.")
+            position = segment = pointer
         else:
-            raw_name.append(byte)
+            starts.append(position)
+            labels.append(str(msg[position + 1 : position + 1 + length], 'ascii'))
+            position += 1 + length
 
-        offset += 1
+    if bytes_read is None:
+        bytes_read = position - offset if suffix == '' else position + names_length(msg, position) - offset
 
-        if jump == False:
-            bytes_read += 1
+    # remember the name from every label on, the last labels first
+    name = suffix
+    for start, label in zip(reversed(starts), reversed(labels)):
+        name = label + '.' + name if name else label
+        names[start] = name
 
-    raw_name.append(0)
-    if jump == True:
-        bytes_read += 1
+    return name, bytes_read
 
-    name = dns_decode(bytes(raw_name))
 
-    return name, bytes_read
+def names_length(msg, offset):
+    """ Function used to measure a name in the message without decoding it.
+
+    Args:
+        msg: The message recieved from the DNS server
+        offset: Offset of the name
+
+    Returns:
+        Number of bytes taken by the name at the offset, up to and including
+        the terminating zero or the first compression pointer.
+
+    """
+
+    position = offset
+    while True:
+        length = msg[position]
+        if length == 0:
+            return position + 1 - offset
+        elif length >= 0xc0:
+            return position + 2 - offset
+        position += 1 + length
 
 
 def dns_decode(raw_name):
@@ -401,25 +474,22 @@ def dns_decode(raw_name):
     Returns:
         The normal form of the url
 
-    Example: 
+    Example:
         3www7example3com0 to www.example.com
 
     """
 
-    name = []
-    pos = 0
-    while pos < len(raw_name):
-        l = raw_name[pos]
-        if l == 0: break
-        name.append(raw_name[pos + 1 : pos + 1 + l].decode('ascii'))
-        pos += l + 1
-
-    return ".".join(name)
+    name, bytes_read = extract_name(memoryview(raw_name), 0)
+    return name
 
 
 if __debug__ and __name__ == '__main__':
     response = b'`V\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00\x03www\x07example\x03com\x00\x00\x01\x00\x01\xc0\x0c\x00\x01\x00\x01\x00\x00R\x9b\x00\x04]\xb8\xd8"'
-    print(parse_dns_reply(response))
+    reply, length = parse_dns_reply(response)
+    assert length == len(response)
+    assert reply.question == Question('www.example.com', 1, 1)
+    assert reply.answer == [Answer('www.example.com', 'A', 1, 21147, 4, '93.184.216.34')]
+    print(reply)
 
     response = bytes.fromhex('''
 00 00 81 80 00 01 00 01  00 00 00 00 03 77 77 77
@@ -427,7 +497,9 @@ if __debug__ and __name__ == '__main__':
 01 03 77 77 77 07 65 78  61 6d 70 6c 65 03 63 6f
 6d 00 00 01 00 01 00 00  00 80 00 04 C0 00 02 01
     ''')
-    print(parse_dns_reply(response))
+    reply, length = parse_dns_reply(response)
+    assert reply.answer[0].name == 'www.example.com' and reply.answer[0].rdata == '192.0.2.1'
+    print(reply)
 
     response = bytes.fromhex('''
 0000 8580 0001 0001 0001 0002 0377 7777
@@ -437,9 +509,11 @@ if __debug__ and __name__ == '__main__':
 6361 6c68 6f73 7400 c03d 0001 0001 0009
 3a80 0004 7f00 0001 c03d 001c 0001 0009
 3a80 0010 0000 0000 0000 0000 0000 0000
-0000 0001                
+0000 0001
     ''')
-    print(parse_dns_reply(response))
+    reply, length = parse_dns_reply(response)
+    assert [(_answer.name, _answer.x_type, _answer.rdata) for _answer in reply.answer] == [('www.example.com', 'A', '1.2.3.4'), ('example.com', 'NS', 'localhost'), ('localhost', 'A', '127.0.0.1'), ('localhost', 'AAAA', '0:0:0:0:0:0:0:1')]
+    print(reply)
 
     response = bytes.fromhex('''
 24 1a 81 80 00 01
@@ -448,7 +522,53 @@ if __debug__ and __name__ == '__main__':
 00 05 28 39 00 12 03 77  77 77 01 6c 06 67 6f 6f
 67 6c 65 03 63 6f 6d 00  c0 2c 00 01 00 01 00 00
 00 e3 00 04 42 f9 59 63  c0 2c 00 01 00 01 00 00
-00 e3 00 04 42 f9 59 68                         
+00 e3 00 04 42 f9 59 68
     ''')
-    print(parse_dns_reply(response))
+    reply, length = parse_dns_reply(response)
+    assert [(_answer.name, _answer.x_type, _answer.rdata) for _answer in reply.answer] == [('www.google.com', 'CNAME', 'www.l.google.com'), ('www.l.google.com', 'A', '66.249.89.99'), ('www.l.google.com', 'A', '66.249.89.104')]
+    header, question, answer = reply
+    assert header.x_id == 0x241a and header.ancount == 3
+    print(reply)
 
+    response = bytes.fromhex('''
+5a5a 8180 0001 0002 0000 0000 0c5f 786d
+7070 2d63 6c69 656e 7404 5f74 6370 0765
+7861 6d70 6c65 0363 6f6d 0000 2100 01c0
+0c00 2100 0100 0001 2c00 0d00 0500 1414
+6604 786d 7070 c01e c00c 0010 0001 0000
+012c 0009 0376 3d31 0474 6573 74
+    ''')
+    reply, length = parse_dns_reply(response)
+    assert length == len(response)
+    assert reply.answer[0].x_type == 'SRV' and reply.answer[0].rdata == (5, 20, 5222, 'xmpp.example.com'), reply.answer[0]
+    assert reply.answer[1].x_type == 'TXT' and reply.answer[1].rdata == (b'v=1', b'test'), reply.answer[1]
+
+    # unknown types: RRSIG (46) in the answer, OPT (41, EDNS) in the additional section
+    response = bytes.fromhex('''
+5a5a 8180 0001 0002 0000 0001 0c5f 786d
+7070 2d63 6c69 656e 7404 5f74 6370 0765
+7861 6d70 6c65 0363 6f6d 0000 2100 01c0
+0c00 2e00 0100 0001 2c00 0301 0203 c00c
+0021 0001 0000 012c 000d 0005 0014 1466
+0478 6d70 70c0 1e00 0029 1000 0000 0000
+0004 0102 0304
+    ''')
+    reply, length = parse_dns_reply(response)
+    assert length == len(response)
+    assert [(_answer.x_type, _answer.rdata) for _answer in reply.answer] == [(46, b'\x01\x02\x03'), ('SRV', (5, 20, 5222, 'xmpp.example.com')), (41, b'\x01\x02\x03\x04')], reply.answer
+
+    assert dns_decode(b'\x03www\x07example\x03com\x00') == 'www.example.com'
+
+    try:
+        parse_dns_reply(bytes.fromhex('0000 8180 0001 0000 0000 0000 c00c 0001 0001'))
+    except ValueError:
+        pass
+    else:
+        assert False, "compression loop not detected"
+
+    try:
+        parse_dns_reply(bytes.fromhex('0000 8180 0001 0000 0000 0000 0377 7777 c00c 0001 0001'))
+    except ValueError:
+        pass
+    else:
+        assert False, "compression loop not detected"
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+#-*- coding:utf-8 -*-
+
+
+"""
+Disk cache of HTTP responses. Response bodies are stored in files, metadata in a single SQLite index,
+so a lookup is one indexed query instead of a directory scan. Least recently used entries are evicted
+when the total size exceeds the byte budget.
+"""
+
+
+__all__ = 'HTTPCache', 'CacheEntry'
+
+
+import sqlite3
+import json
+from hashlib import sha3_256
+from secrets import token_hex
+from time import time as current_time
+
+
+class CacheEntry:
+	"Metadata of a cached response."
+	
+	__slots__ = 'url', 'filename', 'content_type', 'etag', 'last_modified', 'vary', 'size', 'digest', 'stored', 'fresh_until', 'revalidate_until', 'error_until', 'stale_until'
+	
+	def __init__(self, url, filename, content_type, etag, last_modified, vary, size, digest, stored, fresh_until, revalidate_until, error_until, stale_until):
+		self.url = url
+		self.filename = filename
+		self.content_type = content_type
+		self.etag = etag
+		self.last_modified = last_modified
+		self.vary = vary
+		self.size = size
+		self.digest = digest
+		self.stored = stored
+		self.fresh_until = fresh_until # served without requests until this time
+		self.revalidate_until = revalidate_until # served stale while revalidating in background until this time
+		self.error_until = error_until # served stale when the server can not be reached until this time
+		self.stale_until = stale_until # kept for conditional requests until this time
+	
+	def __repr__(self):
+		return f'<{self.__class__.__name__} {self.url} {self.content_type} {self.size}>'
+
+
+class HTTPCache:
+	"""
+	Cache of HTTP responses in `directory` (an async `Path`). Bodies are written to a temporary file and renamed,
+	so a crash never leaves a truncated body under a valid index entry. The index is queried synchronously:
+	all queries use the primary key or the access time index and take microseconds.
+	"""
+	
+	index_name = 'index.sqlite'
+	schema_version = 2
+	max_size = 256 * 1024**2
+	
+	def __init__(self, directory, max_size=None):
+		self.directory = directory
+		if max_size is not None:
+			self.max_size = max_size
+		
+		self.__db = None
+		self.__size = 0
+		
+		self.hit_counter = 0
+		self.miss_counter = 0
+		self.bytes_saved_counter = 0
+		self.evicted_counter = 0
+	
+	def __open(self):
+		if self.__db is not None:
+			return self.__db
+		
+		db = sqlite3.connect(str(self.directory / self.index_name), isolation_level=None)
+		db.execute('PRAGMA journal_mode=WAL')
+		db.execute('PRAGMA synchronous=NORMAL')
+		if db.execute('PRAGMA user_version').fetchone()[0] != self.schema_version: # cache contents are disposable, start over
+			db.execute('DROP TABLE IF EXISTS entries')
+			db.execute(f'PRAGMA user_version = {self.schema_version}')
+		db.execute('''CREATE TABLE IF NOT EXISTS entries (
+			url TEXT PRIMARY KEY,
+			filename TEXT NOT NULL,
+			content_type TEXT NOT NULL,
+			etag TEXT,
+			last_modified TEXT,
+			vary TEXT,
+			size INTEGER NOT NULL,
+			digest TEXT NOT NULL,
+			stored REAL NOT NULL,
+			fresh_until REAL NOT NULL,
+			revalidate_until REAL NOT NULL,
+			error_until REAL NOT NULL,
+			stale_until REAL NOT NULL,
+			accessed REAL NOT NULL
+		)''')
+		db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+		self.__size = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+		self.__db = db
+		return db
+	
+	@property
+	def size(self):
+		"Total size of cached bodies in bytes."
+		self.__open()
+		return self.__size
+	
+	@staticmethod
+	def vary_key(vary, request_headers):
+		"Values of the request headers named in the `Vary` response header, as stored in the index. None if the response may not be reused (`Vary: *`)."
+		
+		if not vary:
+			return ''
+		names = sorted(_name.strip().lower() for _name in vary.split(',') if _name.strip())
+		if '*' in names:
+			return None
+		headers = {_key.lower(): _value for (_key, _value) in request_headers.items()}
+		return json.dumps([[_name, headers.get(_name)] for _name in names])
+	
+	def get(self, url, request_headers={}):
+		"Return the entry for `url` if one exists and matches the request headers, else None."
+		
+		row = self.__open().execute('SELECT url, filename, content_type, etag, last_modified, vary, size, digest, stored, fresh_until, revalidate_until, error_until, stale_until FROM entries WHERE url = ?', (url,)).fetchone()
+		if row is None:
+			self.miss_counter += 1
+			return None
+		
+		entry = CacheEntry(*row)
+		if entry.vary:
+			vary_names = ','.join(_name for (_name, _value) in json.loads(entry.vary))
+			if self.vary_key(vary_names, request_headers) != entry.vary:
+				self.miss_counter += 1
+				return None
+		return entry
+	
+	async def read(self, entry):
+		"Read the body of a cache entry and count a hit. If the body file is missing, remove the entry and return None."
+		
+		try:
+			data = await (self.directory / entry.filename).read_bytes()
+		except (OSError, IOError):
+			self.__delete(entry.url)
+			self.miss_counter += 1
+			return None
+		
+		self.__open().execute('UPDATE entries SET accessed = ? WHERE url = ?', (current_time(), entry.url))
+		self.hit_counter += 1
+		self.bytes_saved_counter += len(data)
+		return data
+	
+	@staticmethod
+	def digest(data):
+		"Hash of response body, to tell if the content changed."
+		return sha3_256(data).hexdigest()
+	
+	async def store(self, url, data, content_type, response_headers, request_headers, fresh_until, revalidate_until, error_until, stale_until):
+		"Write the response to the cache, replacing the previous entry for `url`. Return the new entry, or None if the response may not be stored."
+		
+		vary = self.vary_key(response_headers.get('vary'), request_headers)
+		if vary is None:
+			return None
+		
+		filename = sha3_256(url.encode('utf-8')).hexdigest()[:32]
+		temporary = self.directory / f'{filename}.{token_hex(4)}.tmp'
+		try:
+			await temporary.write_bytes(data)
+			await temporary.replace(self.directory / filename)
+		except:
+			await temporary.unlink(missing_ok=True)
+			raise
+		
+		t = current_time()
+		entry = CacheEntry(url, filename, content_type, response_headers.get('etag'), response_headers.get('last-modified'), vary, len(data), self.digest(data), t, fresh_until, revalidate_until, error_until, stale_until)
+		db = self.__open()
+		old = db.execute('SELECT size FROM entries WHERE url = ?', (url,)).fetchone()
+		db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (entry.url, entry.filename, entry.content_type, entry.etag, entry.last_modified, entry.vary, entry.size, entry.digest, entry.stored, entry.fresh_until, entry.revalidate_until, entry.error_until, entry.stale_until, t))
+		self.__size += entry.size - (old[0] if old else 0)
+		
+		await self.evict()
+		return entry
+	
+	def refresh(self, entry, response_headers, fresh_until, revalidate_until, error_until, stale_until):
+		"Update entry lifetime after the server confirmed it is still valid (304 response)."
+		
+		entry.fresh_until = fresh_until
+		entry.revalidate_until = revalidate_until
+		entry.error_until = error_until
+		entry.stale_until = stale_until
+		entry.etag = response_headers.get('etag', entry.etag)
+		entry.last_modified = response_headers.get('last-modified', entry.last_modified)
+		self.__open().execute('UPDATE entries SET fresh_until = ?, revalidate_until = ?, error_until = ?, stale_until = ?, etag = ?, last_modified = ?, accessed = ? WHERE url = ?', (fresh_until, revalidate_until, error_until, stale_until, entry.etag, entry.last_modified, current_time(), entry.url))
+	
+	async def remove(self, url):
+		"Remove the entry for `url` with its body."
+		
+		filename = self.__delete(url)
+		if filename is not None:
+			await (self.directory / filename).unlink(missing_ok=True)
+	
+	def __delete(self, url):
+		db = self.__open()
+		row = db.execute('SELECT filename, size FROM entries WHERE url = ?', (url,)).fetchone()
+		if row is None:
+			return None
+		db.execute('DELETE FROM entries WHERE url = ?', (url,))
+		self.__size -= row[1]
+		return row[0]
+	
+	async def evict(self):
+		"Remove least recently used entries until the cache fits in `max_size`."
+		
+		db = self.__open()
+		while self.__size > self.max_size:
+			rows = db.execute('SELECT url FROM entries ORDER BY accessed LIMIT 16').fetchall()
+			if not rows:
+				break
+			for (url,) in rows:
+				if self.__size <= self.max_size:
+					break
+				await self.remove(url)
+				self.evicted_counter += 1
+	
+	def close(self):
+		if self.__db is not None:
+			self.__db.close()
+			self.__db = None
+
+
+if __debug__ and __name__ == '__main__':
+	from asyncio import run
+	from tempfile import TemporaryDirectory
+	from aiopath import Path
+	
+	async def test_main():
+		with TemporaryDirectory() as directory:
+			cache = HTTPCache(Path(directory), max_size=250)
+			t = current_time()
+			
+			assert cache.get('http://example.com/a') is None
+			await cache.store('http://example.com/a', b'a' * 100, 'text/plain', {'etag': '"a"'}, {}, t + 60, t + 60, t + 60, t + 3600)
+			await cache.store('http://example.com/b', b'b' * 100, 'text/plain', {}, {}, t + 60, t + 60, t + 60, t + 3600)
+			entry = cache.get('http://example.com/a')
+			assert entry.etag == '"a"' and entry.size == 100
+			assert await cache.read(entry) == b'a' * 100
+			assert cache.hit_counter == 1 and cache.miss_counter == 1 and cache.bytes_saved_counter == 100
+			
+			await cache.store('http://example.com/c', b'c' * 100, 'text/plain', {}, {}, t + 60, t + 60, t + 60, t + 3600) # evicts `b`, the least recently used
+			assert cache.get('http://example.com/b') is None
+			assert cache.get('http://example.com/a') is not None
+			assert cache.size == 200 and cache.evicted_counter == 1
+			
+			await cache.store('http://example.com/v', b'v', 'text/plain', {'vary': 'Accept-Language'}, {'accept-language': 'pl'}, t + 60, t + 60, t + 60, t + 3600)
+			assert cache.get('http://example.com/v', {'accept-language': 'pl'}) is not None
+			assert cache.get('http://example.com/v', {'accept-language': 'en'}) is None
+			assert await cache.store('http://example.com/s', b's', 'text/plain', {'vary': '*'}, {}, t + 60, t + 60, t + 60, t + 3600) is None
+			
+			cache.close()
+			cache = HTTPCache(Path(directory), max_size=250)
+			assert cache.size == 201
+			cache.close()
+	
+	run(test_main())
@@ -1,21 +1,33 @@
 #!/usr/bin/python3
 
 
-from asyncio import get_running_loop, Event, Lock, wait_for
+from asyncio import get_running_loop, Event, Lock, Semaphore, CancelledError, wait_for, wait, shield, gather, FIRST_COMPLETED, AbstractEventLoop
 from asyncio.exceptions import TimeoutError
-from collections import deque
+from collections import deque, defaultdict
 from http import HTTPStatus
+from time import perf_counter
+import socket
+import zlib
 
 
 import h11
 import h2.connection
 import ssl
 
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
 
 class ResolveError(Exception):
 	pass
 
 
+class ContentEncodingError(Exception):
+	pass
+
+
 class HTTPError(Exception):
 	def __init__(self, status, method, baseurl, path):
 		self.status = status
@@ -28,14 +40,242 @@ class HTTPError(Exception):
 			super().__init__(f"Nonstandard HTTP status {status}", status, method, baseurl, path)
 
 
+"Urgency of requests by resource type (RFC 9218), lower is more urgent. Resources blocking the first render go first."
+resource_urgency = {
+	'document': 0,
+	'stylesheet': 1,
+	'font': 2,
+	'script': 3,
+	'image': 5
+}
+
+
+class ZlibDecoder:
+	"Streaming decoder of `gzip` and `deflate` content encodings."
+	
+	def __init__(self, encoding):
+		self.encoding = encoding
+		self.__decompressor = zlib.decompressobj((16 + zlib.MAX_WBITS) if encoding == 'gzip' else zlib.MAX_WBITS)
+		self.__started = False
+	
+	def decode(self, data, max_length):
+		"Yield decoded pieces of at most `max_length` bytes."
+		
+		if not self.__started and self.encoding == 'deflate':
+			self.__started = True
+			try:
+				zlib.decompressobj(zlib.MAX_WBITS).decompress(data[:2])
+			except zlib.error: # some servers send raw deflate stream without zlib header
+				self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+		
+		try:
+			while data:
+				piece = self.__decompressor.decompress(data, max_length)
+				data = self.__decompressor.unconsumed_tail
+				if piece:
+					yield piece
+		except zlib.error as error:
+			raise ContentEncodingError(f"Invalid {self.encoding} data: {error}") from error
+	
+	def flush(self):
+		yield self.__decompressor.flush()
+
+
+class BrotliDecoder:
+	"Streaming decoder of `br` content encoding. Input is fed in small slices, so a single piece of output stays small."
+	
+	encoding = 'br'
+	input_slice = 1024
+	
+	def __init__(self, encoding):
+		self.__decompressor = brotli.Decompressor()
+	
+	def decode(self, data, max_length):
+		try:
+			for n in range(0, len(data), self.input_slice):
+				piece = self.__decompressor.process(data[n:n + self.input_slice])
+				for m in range(0, len(piece), max_length):
+					yield piece[m:m + max_length]
+		except brotli.error as error:
+			raise ContentEncodingError(f"Invalid br data: {error}") from error
+	
+	def flush(self):
+		return ()
+
+
+"Decoders of supported content encodings. `br` is available if the `brotli` module is installed."
+content_decoders = {'gzip': ZlibDecoder, 'x-gzip': ZlibDecoder, 'deflate': ZlibDecoder}
+if brotli is not None:
+	content_decoders['br'] = BrotliDecoder
+
+
+class ContentDecoder:
+	"""
+	Decoder of response body compressed with one or more content encodings, applied in order listed in the `content-encoding` header.
+	Output comes in pieces of bounded size. Stops with `ContentEncodingError` when the decoded body is larger than `max_size`
+	or when it expands more than `max_ratio` times (decompression bomb).
+	"""
+	
+	max_size = 256 * 1024**2
+	max_ratio = 1000
+	ratio_threshold = 1024**2 # small bodies may have any ratio
+	
+	def __init__(self, content_encoding, piece_size=4096):
+		self.piece_size = piece_size
+		self.__decoders = []
+		for encoding in reversed([_encoding.strip().lower() for _encoding in content_encoding.split(',') if _encoding.strip()]):
+			if encoding == 'identity':
+				continue
+			try:
+				self.__decoders.append(content_decoders[encoding](encoding))
+			except KeyError:
+				raise ContentEncodingError(f"Unsupported content encoding: {encoding}")
+		
+		self.wire_bytes = 0
+		self.decoded_bytes = 0
+	
+	def decode(self, data):
+		"Yield decoded pieces of the provided body chunk."
+		self.wire_bytes += len(data)
+		yield from self.__feed(0, data)
+	
+	def flush(self):
+		"Yield the rest of decoded data at the end of the body."
+		for level, decoder in enumerate(self.__decoders):
+			for data in decoder.flush():
+				if data:
+					yield from self.__feed(level + 1, data)
+	
+	def __feed(self, level, data):
+		if level == len(self.__decoders):
+			self.decoded_bytes += len(data)
+			if self.decoded_bytes > self.max_size:
+				raise ContentEncodingError(f"Decoded body larger than {self.max_size} bytes.")
+			if self.decoded_bytes > self.ratio_threshold and self.decoded_bytes > self.wire_bytes * self.max_ratio:
+				raise ContentEncodingError(f"Body expands more than {self.max_ratio} times.")
+			yield data
+		else:
+			for piece in self.__decoders[level].decode(data, self.piece_size):
+				yield from self.__feed(level + 1, piece)
+
+
+class SessionCachingContext(ssl.SSLContext):
+	"""
+	Client TLS context remembering the last session of each host, so new connections resume it instead of doing a full handshake.
+	The session is passed when the context wraps a socket or a memory BIO, which is how both asyncio and GTK loops start TLS.
+	"""
+	
+	max_sessions = 256
+	
+	def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+		self.sessions = {} # server hostname -> ssl.SSLSession, least recently used first
+		self.full_handshake_counter = 0
+		self.resumed_handshake_counter = 0
+	
+	def cached_session(self, server_hostname):
+		try:
+			session = self.sessions.pop(server_hostname)
+		except KeyError:
+			return None
+		self.sessions[server_hostname] = session
+		return session
+	
+	def save_session(self, server_hostname, session):
+		if session is None:
+			return
+		self.sessions.pop(server_hostname, None)
+		self.sessions[server_hostname] = session
+		while len(self.sessions) > self.max_sessions:
+			del self.sessions[next(iter(self.sessions))]
+	
+	def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True, server_hostname=None, session=None):
+		if session is None and not server_side and server_hostname:
+			session = self.cached_session(server_hostname)
+		return super().wrap_socket(sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect, suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session)
+	
+	def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+		if session is None and not server_side and server_hostname:
+			session = self.cached_session(server_hostname)
+		return super().wrap_bio(incoming, outgoing, server_side=server_side, server_hostname=server_hostname, session=session)
+
+
+ssl_contexts = {}
+
+def shared_ssl_context(alpn_protocols):
+	"Return the TLS client context for connections offering the given ALPN protocols, created once per process, so the CA store is loaded once and sessions are shared."
+	
+	try:
+		return ssl_contexts[alpn_protocols]
+	except KeyError:
+		pass
+	
+	context = SessionCachingContext(ssl.PROTOCOL_TLS_CLIENT) # verifies certificates and host names, like `ssl.create_default_context`
+	context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+	context.set_alpn_protocols(list(alpn_protocols))
+	ssl_contexts[alpn_protocols] = context
+	return context
+
+
+class ConnectionAttempt:
+	"Protocol of one of the connection attempts running in parallel. The first attempt to connect hands its transport to the connection, the others close theirs."
+	
+	def __init__(self, connection, family):
+		self.connection = connection
+		self.family = family
+		self.won = False
+	
+	def connection_made(self, transport):
+		if self.connection.is_connected():
+			transport.close()
+		else:
+			self.won = True
+			self.connection.connection_made(transport)
+	
+	def connection_lost(self, exc):
+		if self.won:
+			self.connection.connection_lost(exc)
+	
+	def data_received(self, data):
+		if self.won:
+			self.connection.data_received(data)
+	
+	def eof_received(self):
+		if self.won:
+			return self.connection.eof_received()
+	
+	def pause_writing(self):
+		if self.won:
+			self.connection.pause_writing()
+	
+	def resume_writing(self):
+		if self.won:
+			self.connection.resume_writing()
+
+
 class Connection:
 	"Abstract HTTP connection class."
 	
 	data_arrival_timeout = 4
 	socket_open_timeout = 1.5
 	
-	def __init__(self, baseurl):
+	"Delay before racing the next address, if the previous attempt did not finish (RFC 8305)."
+	connection_attempt_delay = 0.25
+	
+	"Address family that connected first, per host. Shared by all connections."
+	preferred_family = {}
+	
+	"Connection time metrics per host: number of connects, failed attempts, last and total connection time, winning family."
+	connect_statistics = defaultdict(lambda: {'connects': 0, 'failed_attempts': 0, 'last_time': None, 'total_time': 0, 'family': None})
+	
+	"Whether many requests may run on the connection at the same time."
+	multiplexed = False
+	
+	"Whether the TLS session was saved after the first response, with the session ticket."
+	tls_session_saved = False
+	
+	def __init__(self, baseurl, resolver=None):
 		self.baseurl = baseurl
+		self.resolver = resolver
 		
 		self.protocol, _, self.host, *path = baseurl.split('/') # TODO: use urllib.parse
 		self.path = '/' + '/'.join(path)
@@ -60,6 +300,11 @@ class Connection:
 		self.headers['user-agent'] = 'guixmpp' # TODO: config
 		self.headers['connection'] = 'keep-alive'
 		self.headers['accept'] = 'application/xhtml+xml,text/html,application/xml,image/png,image/jpeg,*/*'
+		self.headers['accept-encoding'] = ', '.join(_encoding for _encoding in content_decoders if _encoding != 'x-gzip')
+		
+		self.wire_byte_counter = 0
+		self.decoded_byte_counter = 0
+		self.open_timing = None # phases of opening the connection: name -> (start, end) from `perf_counter`
 	
 	def create_ssl_context(self):
 		raise NotImplementedError
@@ -67,6 +312,20 @@ class Connection:
 	def connection_made(self, transport):
 		self.__transport = transport
 	
+	def is_connected(self):
+		return hasattr(self, '_Connection__transport')
+	
+	def save_tls_session(self):
+		"Remember TLS session for resumption by later connections to the host. TLS 1.3 servers send session tickets after the handshake, so it is saved again after responses."
+		
+		try:
+			ssl_object = self.__transport.get_extra_info('ssl_object')
+			save_session = self.ssl_context.save_session
+		except AttributeError:
+			return
+		if ssl_object is not None:
+			save_session(self.host, ssl_object.session)
+	
 	def connection_lost(self, exc):
 		del self.__transport
 		if exc:
@@ -111,6 +370,13 @@ class Connection:
 	def is_body_eof(self):
 		return self.__body_eof
 	
+	def is_healthy(self):
+		"Check if the connection is open and may carry another request."
+		try:
+			return not (self.__eof or self.__transport.is_closing())
+		except AttributeError: # not opened or already lost
+			return False
+	
 	def pause_writing(self):
 		self.__writing.clear()
 	
@@ -127,22 +393,117 @@ class Connection:
 		self.__eof = False
 		self.__body_eof = True
 		
+		# TLS handshake runs separately after TCP connect if the loop supports it, so it can be timed on its own
+		self.__separate_tls = self.ssl_context is not None and type(self.loop).start_tls is not AbstractEventLoop.start_tls
+		
+		dns_start = perf_counter()
+		addresses = self.__order_addresses(await self.__resolve())
+		if not addresses:
+			raise ResolveError(f"Could not resolve host name {self.host} (port {self.port}).")
+		
+		statistics = self.connect_statistics[self.host]
+		start = perf_counter()
 		errors = []
-		for family, type_, proto, cname, addr_port in await self.loop.getaddrinfo(self.host, self.port):
-			host = addr_port[0]
-			port = addr_port[1]
+		attempts = set()
+		winner = None
+		
+		def finished(done):
+			"Collect results of finished attempts. Return the winning attempt or None."
+			result = None
+			for attempt in done:
+				attempts.discard(attempt)
+				if attempt.exception() is not None:
+					errors.append(attempt.exception())
+				elif attempt.result() is not None:
+					result = attempt.result()
+			return result
+		
+		try:
+			for address in addresses: # start next attempt when the previous one failed or is taking too long
+				attempts.add(self.loop.create_task(self.__attempt(*address)))
+				done, _ = await wait(attempts, timeout=self.connection_attempt_delay, return_when=FIRST_COMPLETED)
+				winner = finished(done)
+				if winner is not None:
+					break
+			
+			while winner is None and attempts:
+				done, _ = await wait(attempts, return_when=FIRST_COMPLETED)
+				winner = finished(done)
+		finally:
+			for attempt in attempts:
+				attempt.cancel()
+		
+		statistics['failed_attempts'] += len(errors)
+		if winner is None:
+			raise ExceptionGroup("Could not connect to server.", errors)
+		
+		connected = perf_counter()
+		self.open_timing = {'dns': (dns_start, start), 'connect': (start, connected)}
+		
+		if self.__separate_tls:
 			try:
-				await wait_for(self.loop.create_connection((lambda: self), host, port, family=family, proto=proto, server_hostname=self.host if self.ssl_context else None, ssl=self.ssl_context), self.socket_open_timeout)
-				self.__writing.set()
-			except Exception as error:
-				errors.append(error)
-			else:
-				return
-		else:
-			if len(errors) == 0:
-				raise ResolveError(f"Could not resolve host name {self.host} (port {self.port}).")
-			else:
-				raise ExceptionGroup("Could not connect to server.", errors)
+				self.__transport = await wait_for(self.loop.start_tls(self.__transport, winner, self.ssl_context, server_hostname=self.host), self.socket_open_timeout)
+			except:
+				self.__transport.close()
+				raise
+			self.open_timing['tls'] = (connected, perf_counter())
+		
+		if self.ssl_context is not None:
+			ssl_object = self.__transport.get_extra_info('ssl_object')
+			if ssl_object is not None and hasattr(self.ssl_context, 'save_session'):
+				if ssl_object.session_reused:
+					self.ssl_context.resumed_handshake_counter += 1
+				else:
+					self.ssl_context.full_handshake_counter += 1
+				self.save_tls_session()
+		
+		self.__writing.set()
+		family = winner.family
+		self.preferred_family[self.host] = family
+		elapsed = perf_counter() - start
+		statistics['connects'] += 1
+		statistics['last_time'] = elapsed
+		statistics['total_time'] += elapsed
+		statistics['family'] = family
+	
+	async def __resolve(self):
+		"Resolve the host with the DNS resolver, if provided. Fall back to the system resolver for names unknown to DNS (like `localhost`), when the DNS server is unreachable or its reply can not be parsed."
+		
+		if self.resolver is not None:
+			try:
+				addresses = await self.resolver.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+			except CancelledError:
+				raise
+			except Exception: # network error or a reply the resolver does not understand
+				addresses = []
+			if addresses:
+				return addresses
+		
+		return await self.loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+	
+	def __order_addresses(self, addresses):
+		"Interleave address families (RFC 8305 section 4), starting with the family that connected first last time."
+		
+		if not addresses:
+			return []
+		
+		preferred = self.preferred_family.get(self.host, addresses[0][0])
+		first = [_address for _address in addresses if _address[0] == preferred]
+		second = [_address for _address in addresses if _address[0] != preferred]
+		
+		ordered = []
+		for n in range(max(len(first), len(second))):
+			ordered.extend(first[n:n + 1])
+			ordered.extend(second[n:n + 1])
+		return ordered
+	
+	async def __attempt(self, family, type_, proto, cname, addr_port):
+		"Try to connect to one address. Return the attempt if it won the race, None if another one did."
+		
+		attempt = ConnectionAttempt(self, family)
+		ssl_context = None if self.__separate_tls else self.ssl_context
+		await wait_for(self.loop.create_connection((lambda: attempt), addr_port[0], addr_port[1], family=family, proto=proto, server_hostname=self.host if ssl_context else None, ssl=ssl_context), self.socket_open_timeout)
+		return attempt if attempt.won else None
 	
 	async def close(self):
 		if not hasattr(self, 'loop'):
@@ -161,7 +522,7 @@ class Connection:
 	def end_stream(self, stream):
 		raise NotImplementedError
 	
-	async def send_request(self, stream, method, path, headers):
+	async def send_request(self, stream, method, path, headers, urgency=None):
 		raise NotImplementedError
 	
 	async def write(self, stream, data):
@@ -199,13 +560,13 @@ class Connection1(Connection):
 		self.__lock.release()
 	
 	def create_ssl_context(self):
-		return ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH) # client connection should have purpose=ssl.Purpose.SERVER_AUTH
+		return shared_ssl_context(('http/1.1',))
 	
 	def data_received(self, data):
 		self.__http.receive_data(data)
 		super().data_received(data)
 	
-	async def send_request(self, stream, method, path, headers):
+	async def send_request(self, stream, method, path, headers, urgency=None):
 		self.__read_buffer = deque()
 		self.__http = h11.Connection(our_role=h11.CLIENT)
 		data = self.__http.send(h11.Request(method=method, target=path, headers=list(headers.items())))
@@ -282,61 +643,116 @@ class Connection1(Connection):
 
 
 class Connection2(Connection):
-	"HTTP/2 connection"
+	"""
+	HTTP/2 connection. Received events are queued per stream, so each stream reads only its own events.
+	Requests carry their urgency to the server, and requests of low urgency are held back
+	while responses blocking the first render are still awaited.
+	"""
+	
+	multiplexed = True
+	
+	"Requests at least this urgent block sending of delayable requests until their response headers arrive."
+	blocking_urgency = resource_urgency['font']
+	
+	"Requests at most this urgent wait for blocking requests."
+	delayable_urgency = resource_urgency['image']
 	
 	def __init__(self, *args):
 		super().__init__(*args)
 		self.__locks = {}
 		self.__received_length = {}
 		self.__streams = 1
-		self.__events = deque()
-		#self.__end_streams = 1
+		self.__stream_ids = {} # stream -> HTTP/2 stream id, assigned when the request is sent, as ids must be sent in increasing order
+		self.__stream_keys = {} # HTTP/2 stream id -> stream
+		self.__slot_waiters = deque() # requests waiting until the server allows another stream
+		self.__stream_events = {}
+		self.__stream_arrived = {} # stream -> event set when something arrives for the stream, so only its reader is woken
+		self.__last_arrival = None
+		self.__read_buffers = {}
 		self.__end_received = {}
+		self.__settings_acked = False
+		self.__blocking_streams = set()
+		self.__unblocked = Event()
+		self.__unblocked.set()
 	
 	async def begin_stream(self):
 		stream = self.__streams
 		self.__streams += 2
 		lock = self.__locks[stream] = Lock()
 		self.__received_length[stream] = 0
+		self.__stream_events[stream] = deque()
+		self.__stream_arrived[stream] = Event()
+		self.__read_buffers[stream] = deque()
 		await lock.acquire()
 		return stream
 	
 	async def end_stream(self, stream):
+		self.__unblock(stream)
+		stream_id = self.__stream_ids.pop(stream, None)
+		if stream_id is not None:
+			del self.__stream_keys[stream_id]
+			if not self.__end_received.get(stream, False):
+				try:
+					self.__http.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL) # response not read to the end, free the stream slot
+				except h2.exceptions.StreamClosedError:
+					pass
+				else:
+					self.__wake_slot_waiter()
+					await self.send_data(self.__http.data_to_send())
 		self.__locks[stream].release()
-		del self.__locks[stream], self.__received_length[stream]
+		del self.__locks[stream], self.__received_length[stream], self.__stream_events[stream], self.__stream_arrived[stream], self.__read_buffers[stream]
+		self.__end_received.pop(stream, None)
+	
+	def __unblock(self, stream):
+		try:
+			self.__blocking_streams.remove(stream)
+		except KeyError:
+			return
+		if not self.__blocking_streams:
+			self.__unblocked.set()
 	
 	def create_ssl_context(self):
-		ctx = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH) # client connection should have purpose=ssl.Purpose.SERVER_AUTH
-		ctx.set_alpn_protocols(['h2'])
-		return ctx
+		return shared_ssl_context(('h2',))
 	
 	def data_received(self, data):
-		events = self.__http.receive_data(data)
-		self.__events.extend(events)
+		self.__last_arrival = perf_counter()
+		for event in self.__http.receive_data(data):
+			stream_id = getattr(event, 'stream_id', None)
+			if stream_id:
+				if isinstance(event, (h2.events.StreamEnded, h2.events.StreamReset)):
+					self.__wake_slot_waiter()
+				try:
+					stream = self.__stream_keys[stream_id]
+				except KeyError:
+					continue # stream already ended
+				self.__stream_events[stream].append(event)
+				self.__stream_arrived[stream].set()
+			elif isinstance(event, h2.events.SettingsAcknowledged):
+				self.__settings_acked = True
 		super().data_received(data)
 	
 	async def open(self):
-		await super().open()
-		
-		self.__read_buffer = deque()
-		conn = self.__http = h2.connection.H2Connection()
+		conn = self.__http = h2.connection.H2Connection() # before connecting, as the server may send its settings first
 		conn.initiate_connection()
+		
+		await super().open()
 		await self.send_data(conn.data_to_send())
 		
-		acked = False
-		while not acked:
-			for event in list(self.__events):
-				if hasattr(event, 'stream_id'):
-					continue
-				self.__events.remove(event)
-				if not isinstance(event, h2.events.SettingsAcknowledged):
-					continue
-				acked = True
-				break
-			else:
-				await self.wait_for_data()
+		while not self.__settings_acked:
+			await self.wait_for_data()
 	
-	async def send_request(self, stream, method, path, headers):
+	async def send_request(self, stream, method, path, headers, urgency=None):
+		if urgency is not None and urgency >= self.delayable_urgency:
+			await self.__unblocked.wait()
+		
+		if urgency is not None and urgency <= self.blocking_urgency:
+			self.__blocking_streams.add(stream)
+			self.__unblocked.clear()
+		
+		await self.__stream_slot()
+		stream_id = self.__stream_ids[stream] = self.__http.get_next_available_stream_id()
+		self.__stream_keys[stream_id] = stream
+		
 		rheaders = [
 			(':method', method),
 			(':path', path),
@@ -348,50 +764,94 @@ class Connection2(Connection):
 			if key in ['host', 'connection']: continue
 			rheaders.append((key.lower(), value))
 		
-		self.__http.send_headers(stream, rheaders, end_stream=True)
+		if urgency is not None: # RFC 7540 priority for servers not supporting the `priority` header
+			self.__http.send_headers(stream_id, rheaders, end_stream=True, priority_weight=256 >> min(urgency, 7))
+		else:
+			self.__http.send_headers(stream_id, rheaders, end_stream=True)
 		await self.send_data(self.__http.data_to_send())
 	
+	async def __stream_slot(self):
+		"Wait until the server allows another concurrent stream. Waiters are woken one at a time, in order, as streams close."
+		
+		while self.__http.open_outbound_streams >= self.__http.remote_settings.max_concurrent_streams:
+			waiter = self.loop.create_future()
+			self.__slot_waiters.append(waiter)
+			try:
+				await waiter
+			except CancelledError:
+				if waiter.done() and not waiter.cancelled(): # woken, pass the free slot on
+					self.__wake_slot_waiter()
+				raise
+	
+	def __wake_slot_waiter(self):
+		while self.__slot_waiters:
+			waiter = self.__slot_waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(None)
+				break
+	
+	async def __wait_for_stream(self, stream):
+		"Wait until something arrives for the stream. Times out only if nothing arrived on the whole connection, as other streams may be served first."
+		
+		arrived = self.__stream_arrived[stream]
+		while True:
+			try:
+				await wait_for(arrived.wait(), self.data_arrival_timeout)
+			except TimeoutError as error:
+				if self.__last_arrival is not None and perf_counter() - self.__last_arrival < self.data_arrival_timeout:
+					continue
+				raise TimeoutError(f"Timeout waiting for data from {self.baseurl}") from error
+			else:
+				break
+		arrived.clear()
+	
 	async def write(self, stream, data):
 		data = self.__http.send(h2.Data(data=data))
 		await self.send_data(data)
 	
 	async def response(self, stream):
 		self.__end_received[stream] = False
-		headers = None
-		while headers is None:
-			for event in list(self.__events):
-				if hasattr(event, 'stream_id') and event.stream_id != stream:
-					continue
-				self.__events.remove(event)
-				if not isinstance(event, h2.events.ResponseReceived):
-					continue
-				headers = event.headers
-				break
+		events = self.__stream_events[stream]
+		
+		event = None
+		while event is None:
+			while events:
+				received = events.popleft()
+				if isinstance(received, h2.events.ResponseReceived):
+					event = received
+					break
 			else:
-				await self.wait_for_data()
+				await self.__wait_for_stream(stream)
 		
+		self.__unblock(stream)
 		self.start_body_reception()
 		
 		pseudo_header = dict((_key.decode('ascii'), _value.decode('ascii')) for (_key, _value) in event.headers if _key.startswith(b':'))
 		headers = dict((_key.decode('ascii'), _value.decode('ascii')) for (_key, _value) in event.headers if not _key.startswith(b':'))
 		status_code = int(pseudo_header[':status'])
 		
-		#self.__remaining[stream] = int(headers['content-length'])
-		
 		return status_code, headers
 	
+	async def __acknowledge(self, stream):
+		"Return flow control window for the data consumed from the stream."
+		if self.__received_length[stream]:
+			self.__http.acknowledge_received_data(self.__received_length[stream], self.__stream_ids[stream])
+			self.__received_length[stream] = 0
+			await self.send_data(self.__http.data_to_send())
+	
 	async def read(self, stream, bufsize):
 		if bufsize is not None and bufsize < 0:
 			raise ValueError
 		
-		if self.__end_received[stream] and not self.__read_buffer:
+		read_buffer = self.__read_buffers[stream]
+		if self.__end_received[stream] and not read_buffer:
 			return bytes()
 		
 		result = []
 		
 		while (bufsize is None) or sum(len(_chunk) for _chunk in result) < bufsize:
 			try:
-				chunk = self.__read_buffer.popleft()
+				chunk = read_buffer.popleft()
 			except IndexError:
 				break
 			else:
@@ -403,52 +863,225 @@ class Connection2(Connection):
 						result.append(chunk)
 					else:
 						result.append(chunk[:needed])
-						self.__read_buffer.insert(0, chunk[needed:])
+						read_buffer.appendleft(chunk[needed:])
 		
-		#end_received = False
+		events = self.__stream_events[stream]
 		while (not self.__end_received[stream]) and ((bufsize is None) or sum(len(_chunk) for _chunk in result) < bufsize):
-			for event in list(self.__events):
-				if hasattr(event, 'stream_id') and event.stream_id != stream:
-					continue
-				self.__events.remove(event)
-				if isinstance(event, h2.events.StreamEnded):
-					#self.__end_streams += 2
-					self.__end_received[stream] = True
-					#if self.__streams == self.__end_streams:
-					#	self.eof_received()
-					break
-				if not isinstance(event, h2.events.DataReceived):
-					continue
-				chunk = event.data
-				if not len(chunk):
-					continue
-				
-				if bufsize is None:
-					result.append(chunk)
-				else:
-					needed = bufsize - sum(len(_chunk) for _chunk in result)
-					if len(chunk) <= needed:
-						result.append(chunk)
-					else:
-						result.append(chunk[:needed])
-						self.__read_buffer.insert(0, chunk[needed:])
-				
-				self.__received_length[stream] += len(chunk)
-				
-				#if event.stream_ended is not None:
-				#	self.eof_received()
-				#elif self.__remaining[stream] <= 0:
-				#	self.eof_received()
-				
+			if not events:
+				await self.__acknowledge(stream)
+				await self.__wait_for_stream(stream)
+				continue
+			
+			event = events.popleft()
+			if isinstance(event, h2.events.StreamEnded):
+				self.__end_received[stream] = True
+				await self.__acknowledge(stream) # the connection window needs to be returned even after the stream ended
 				break
+			if not isinstance(event, h2.events.DataReceived):
+				continue
+			
+			self.__received_length[stream] += event.flow_controlled_length
+			chunk = event.data
+			if not len(chunk):
+				continue
+			
+			if bufsize is None:
+				result.append(chunk)
 			else:
-				self.__http.acknowledge_received_data(self.__received_length[stream], stream)
-				await self.send_data(self.__http.data_to_send())
-				await self.wait_for_data()
+				needed = bufsize - sum(len(_chunk) for _chunk in result)
+				if len(chunk) <= needed:
+					result.append(chunk)
+				else:
+					result.append(chunk[:needed])
+					read_buffer.append(chunk[needed:])
 		
 		return bytes().join(result)
 
 
+class ConnectionPool:
+	"""
+	Connections to many origins, kept open between requests. HTTP/1.1 connections carry one request at a time,
+	so up to `max_connections_per_host` of them are opened to an origin. Multiplexed (HTTP/2) connections are shared,
+	one per origin. Connections are checked before reuse and closed after `idle_timeout` seconds without requests.
+	"""
+	
+	idle_timeout = 30
+	max_connections_per_host = 6
+	
+	def __init__(self, connection_class, idle_timeout=None, max_connections_per_host=None, resolver=None):
+		self.connection_class = connection_class
+		self.resolver = resolver
+		if idle_timeout is not None:
+			self.idle_timeout = idle_timeout
+		if max_connections_per_host is not None:
+			self.max_connections_per_host = max_connections_per_host
+		
+		self.loop = None
+		self.closed = False
+		self.__idle = defaultdict(list) # origin -> idle HTTP/1.1 connections, most recently used last
+		self.__limits = {} # origin -> semaphore limiting HTTP/1.1 connections
+		self.__shared = {} # origin -> multiplexed connection
+		self.__opening = {} # origin -> task opening the multiplexed connection
+		self.__users = {} # connection -> number of requests running on it
+		self.__expiry = {} # connection -> timer closing it when idle
+		self.__closing = set()
+		
+		self.created_connection_counter = 0
+		self.reused_connection_counter = 0
+		self.expired_connection_counter = 0
+		self.unhealthy_connection_counter = 0
+	
+	async def acquire(self, baseurl):
+		"Return an open connection to the origin of `baseurl`. Every acquired connection must be given back with `release`."
+		
+		if self.loop is None:
+			self.loop = get_running_loop()
+		
+		if self.connection_class.multiplexed:
+			connection = await self.__acquire_shared(baseurl)
+		else:
+			connection = await self.__acquire_exclusive(baseurl)
+		
+		self.__users[connection] = self.__users.get(connection, 0) + 1
+		try:
+			self.__expiry.pop(connection).cancel()
+		except KeyError:
+			pass
+		return connection
+	
+	async def __acquire_exclusive(self, baseurl):
+		try:
+			limit = self.__limits[baseurl]
+		except KeyError:
+			limit = self.__limits[baseurl] = Semaphore(self.max_connections_per_host)
+		
+		await limit.acquire()
+		try:
+			idle = self.__idle[baseurl]
+			while idle:
+				connection = idle.pop()
+				if connection.is_healthy():
+					self.reused_connection_counter += 1
+					return connection
+				self.unhealthy_connection_counter += 1
+				self.__close(connection)
+			
+			return await self.__open(baseurl)
+		except:
+			limit.release()
+			raise
+	
+	async def __acquire_shared(self, baseurl):
+		try:
+			connection = self.__shared[baseurl]
+		except KeyError:
+			pass
+		else:
+			if connection.is_healthy():
+				self.reused_connection_counter += 1
+				return connection
+			self.unhealthy_connection_counter += 1
+			del self.__shared[baseurl]
+			if not self.__users.get(connection, 0):
+				self.__close(connection)
+		
+		try:
+			opening = self.__opening[baseurl]
+		except KeyError:
+			opening = self.__opening[baseurl] = self.loop.create_task(self.__open_shared(baseurl))
+		else:
+			self.reused_connection_counter += 1 # requests waiting for the same origin share the new connection
+		
+		return await shield(opening)
+	
+	async def __open_shared(self, baseurl):
+		"Open a multiplexed connection. It is idle until acquired, so it expires even if the requests waiting for it are cancelled."
+		
+		try:
+			connection = self.__shared[baseurl] = await self.__open(baseurl)
+			self.__expiry[connection] = self.loop.call_later(self.idle_timeout, self.__expire, connection)
+			return connection
+		finally:
+			del self.__opening[baseurl]
+	
+	async def __open(self, baseurl):
+		connection = self.connection_class(baseurl, self.resolver)
+		await connection.open()
+		self.created_connection_counter += 1
+		return connection
+	
+	def release(self, connection, reusable=True):
+		"""
+		Give back a connection acquired from the pool. Pass `reusable=False` if the response was not read completely.
+		Multiplexed connections are shared by many streams, so for them only the health of the connection is checked.
+		"""
+		
+		self.__users[connection] -= 1
+		users = self.__users[connection]
+		if not users:
+			del self.__users[connection]
+		
+		if connection.multiplexed:
+			if self.closed or not connection.is_healthy():
+				if self.__shared.get(connection.baseurl) is connection:
+					del self.__shared[connection.baseurl]
+				if not users:
+					self.__close(connection)
+			elif not users:
+				self.__expiry[connection] = self.loop.call_later(self.idle_timeout, self.__expire, connection)
+		else:
+			self.__limits[connection.baseurl].release()
+			if reusable and not self.closed and connection.is_healthy():
+				self.__idle[connection.baseurl].append(connection)
+				self.__expiry[connection] = self.loop.call_later(self.idle_timeout, self.__expire, connection)
+			else:
+				self.__close(connection)
+	
+	def __expire(self, connection):
+		del self.__expiry[connection]
+		self.expired_connection_counter += 1
+		if connection.multiplexed:
+			if self.__shared.get(connection.baseurl) is connection:
+				del self.__shared[connection.baseurl]
+		else:
+			self.__idle[connection.baseurl].remove(connection)
+		self.__close(connection)
+	
+	def __close(self, connection):
+		task = self.loop.create_task(self.__close_quietly(connection))
+		self.__closing.add(task)
+		task.add_done_callback(self.__closing.discard)
+	
+	@staticmethod
+	async def __close_quietly(connection):
+		try:
+			await connection.close()
+		except (ValueError, OSError): # connection already closed or broken
+			pass
+	
+	async def close(self):
+		"Close all idle connections. Connections still in use are closed when released."
+		
+		self.closed = True
+		
+		for timer in self.__expiry.values():
+			timer.cancel()
+		self.__expiry.clear()
+		
+		for connections in self.__idle.values():
+			for connection in connections:
+				self.__close(connection)
+		self.__idle.clear()
+		
+		for connection in self.__shared.values():
+			if connection not in self.__users:
+				self.__close(connection)
+		self.__shared.clear()
+		
+		while self.__closing:
+			await gather(*self.__closing)
+
+
 class Url:
 	def __init__(self, path, headers, client):
 		self.path = path
@@ -466,7 +1099,7 @@ class Url:
 		else:
 			return self.client.path + '/' + self.path
 	
-	def build_headers(self, headers, content_length=None):
+	def build_headers(self, headers, content_length=None, urgency=None):
 		h = dict()
 		h.update(self.client.headers)
 		h.update(self.headers)
@@ -474,10 +1107,12 @@ class Url:
 		h['host'] = self.client.host
 		if content_length is not None:
 			h['content-length'] = int(content_length)
+		if urgency is not None:
+			h['priority'] = f'u={urgency}'
 		return h
 	
-	def get(self, *, headers={}):
-		return Request(self.client, self.abspath, 'GET', False, None, self.build_headers(headers), False)
+	def get(self, *, headers={}, urgency=None):
+		return Request(self.client, self.abspath, 'GET', False, None, self.build_headers(headers, urgency=urgency), False, urgency)
 	
 	def head(self, *, headers={}):
 		return Request(self.client, self.abspath, 'HEAD', False, None, self.build_headers(headers), True)
@@ -525,8 +1160,9 @@ class Url:
 
 
 class Request:
-	def __init__(self, client, path, method, writable, body, headers, return_headers):
+	def __init__(self, client, path, method, writable, body, headers, return_headers, urgency=None):
 		self.client = client
+		self.urgency = urgency
 		self.path = path
 		self.method = method
 		self.closed = False
@@ -536,6 +1172,14 @@ class Request:
 		self.headers = headers
 		self.request_sent = False
 		self.return_headers = return_headers
+		self.decoder = None
+		self.__pieces = None
+		self.__buffer = bytearray()
+		self.wire_bytes = 0
+		self.decoded_bytes = 0
+		self.request_time = None # `perf_counter` when the request was sent
+		self.first_byte_time = None # ... when the response headers arrived
+		self.last_byte_time = None # ... when the body ended
 	
 	def __await__(self):
 		"Return the request result in one go."
@@ -578,10 +1222,18 @@ class Request:
 	async def response(self):
 		"Get status response and headers from the server on open connection. Marks end of writing, reading is possible afterwards."
 		if not self.request_sent:
-			await self.client.send_request(self.stream, self.method, self.path, self.headers)
+			self.request_time = perf_counter()
+			await self.client.send_request(self.stream, self.method, self.path, self.headers, self.urgency)
 		else:
 			raise ValueError
-		return await self.client.response(self.stream)
+		status, headers = await self.client.response(self.stream)
+		self.first_byte_time = perf_counter()
+		if not self.client.tls_session_saved: # TLS 1.3 session tickets arrive after the handshake, so by the first response
+			self.client.save_tls_session()
+			self.client.tls_session_saved = True
+		if self.method != 'HEAD' and headers.get('content-encoding'):
+			self.decoder = ContentDecoder(headers['content-encoding'], self.chunk_size)
+		return status, headers
 	
 	def raise_for_status(self, status):
 		if 100 <= status <= 399:
@@ -590,25 +1242,75 @@ class Request:
 			raise HTTPError(status, self.method, self.client.baseurl, self.path)
 	
 	async def read(self, bufsize=None):
-		"Read response data from server as bytes. Can only be used after calling response()."
-		if bufsize is not None:
-			return await self.client.read(self.stream, bufsize)
-		else:
+		"Read response data from server as bytes, decoding content encoding. Can only be used after calling response()."
+		if bufsize is None:
 			return bytes().join(await self.readchunks())
+		elif self.decoder is None and not self.__buffer:
+			chunk = await self.client.read(self.stream, bufsize)
+			if not chunk:
+				self.last_byte_time = perf_counter()
+			self.__count_wire(len(chunk))
+			self.__count_decoded(len(chunk))
+			return chunk
+		else:
+			if self.__pieces is None:
+				self.__pieces = self.__decoded_chunks()
+			while len(self.__buffer) < bufsize:
+				try:
+					self.__buffer += await anext(self.__pieces)
+				except StopAsyncIteration:
+					break
+			result = bytes(self.__buffer[:bufsize])
+			del self.__buffer[:bufsize]
+			return result
 	
-	async def readchunks(self):
-		"Read response data from server as list of bytes."
+	async def readchunks(self, callback=None):
+		"Read response data from server as list of bytes. If provided, `callback` is called with each chunk as it arrives."
 		result = []
 		async for chunk in self:
+			if callback is not None:
+				callback(chunk)
 			result.append(chunk)
 		return result
 	
 	async def __aiter__(self):
 		"Read response data from server iteratively, chunk by chunk."
+		if self.__buffer:
+			piece = bytes(self.__buffer)
+			self.__buffer.clear()
+			yield piece
+		if self.__pieces is None:
+			self.__pieces = self.__decoded_chunks()
+		async for piece in self.__pieces:
+			yield piece
+	
+	async def __decoded_chunks(self):
 		chunk = await self.client.read(self.stream, self.chunk_size)
 		while chunk:
-			yield chunk
+			self.__count_wire(len(chunk))
+			if self.decoder is None:
+				self.__count_decoded(len(chunk))
+				yield chunk
+			else:
+				for piece in self.decoder.decode(chunk):
+					self.__count_decoded(len(piece))
+					yield piece
 			chunk = await self.client.read(self.stream, self.chunk_size)
+		self.last_byte_time = perf_counter()
+		
+		if self.decoder is not None:
+			for piece in self.decoder.flush():
+				if piece:
+					self.__count_decoded(len(piece))
+					yield piece
+	
+	def __count_wire(self, length):
+		self.wire_bytes += length
+		self.client.wire_byte_counter += length
+	
+	def __count_decoded(self, length):
+		self.decoded_bytes += length
+		self.client.decoded_byte_counter += length
 	
 	async def write(self, data):
 		"Write request body to the server."
@@ -616,7 +1318,8 @@ class Request:
 			raise ValueError
 		
 		if not self.request_sent:
-			await self.client.send_request(self.stream, self.method, self.path, self.headers)
+			self.request_time = perf_counter()
+			await self.client.send_request(self.stream, self.method, self.path, self.headers, self.urgency)
 			self.request_sent = True
 		
 		await self.client.write(self.stream, data)
@@ -675,7 +1378,7 @@ if __debug__ and __name__ == '__main__':
 			
 			print(d4, "d4")
 			print()
-
+		
 		async with Connection2('http://purl.org/dc/elements/1.1/') as purl:
 			print(await purl.get(), "purl.org")
 	
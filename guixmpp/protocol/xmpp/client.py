@@ -24,6 +24,12 @@ from base64 import b64encode, b64decode
 from secrets import token_urlsafe
 from collections import Counter, deque
 from contextvars import ContextVar
+from socket import SOCK_STREAM
+
+if __name__ == '__main__':
+	from guixmpp.protocol.dns import AsyncResolver, srv_order
+else:
+	from ..dns import AsyncResolver, srv_order
 
 
 class XMPPError(Exception):
@@ -93,6 +99,8 @@ class XMPPClient:
 			'port': None,
 			'legacy_ssl': False,
 			'ssl_timeout': 7,
+			'resolver': None, # `AsyncResolver` for SRV lookups, a new one is opened for each connection if not provided
+			'connection_attempt_delay': 0.25, # delay before racing the next server address (RFC 8305)
 			'end_timeout': 3,
 			'initial_write_timeout': 10,
 			'initial_read_timeout': 4,
@@ -117,10 +125,12 @@ class XMPPClient:
 		return self.password
 	
 	async def connect(self):
-		"Open network connection to XMPP server."
+		"Open network connection to XMPP server. If no host is configured, the server of the JID domain is found by SRV records."
 		
 		host = self.config['host']
-		if not host: host = self.jid.split('@')[1].split('/')[0] # TODO: SRV record
+		if not host:
+			await self.connect_domain(self.jid.split('@')[1].split('/')[0])
+			return
 		
 		legacy_ssl = self.config['legacy_ssl']
 		
@@ -141,6 +151,160 @@ class XMPPClient:
 		
 		self.encrypted = bool(legacy_ssl)
 	
+	async def connect_domain(self, domain):
+		"Open network connection to the XMPP server of the domain, racing the addresses found by `find_server`."
+		
+		legacy_ssl = self.config['legacy_ssl']
+		
+		port = self.config['port']
+		if not port: port = 5223 if legacy_ssl else 5222
+		
+		timeout = self.config['ssl_timeout']
+		
+		candidates = await self.find_server(domain, port, legacy_ssl)
+		if not candidates:
+			raise ConnectionError(f"Could not resolve XMPP server of {domain}.")
+		
+		logger.info(f"Connecting to XMPP server of {domain}, {len(candidates)} addresses.")
+		
+		if timeout is None:
+			(self.reader, self.writer), direct_tls = await self.__race(domain, candidates)
+		else:
+			try:
+				(self.reader, self.writer), direct_tls = await wait_for(self.__race(domain, candidates), timeout)
+			except TimeoutError as error:
+				raise TimeoutError(f"Timeout opening connection to {domain}.") from error
+		
+		self.encrypted = direct_tls
+	
+	async def find_server(self, domain, port, legacy_ssl):
+		"""
+		Find addresses of the XMPP server of the domain. SRV records for STARTTLS (`_xmpp-client._tcp`, RFC 6120 section 3.2) and for direct TLS
+		(`_xmpps-client._tcp`, XEP-0368) are looked up in parallel with the addresses of the domain itself, used on `port` if there are no SRV records.
+		Addresses of the SRV targets are resolved in parallel, usually from the cache, filled from the additional section of the SRV replies.
+		Return a list of `(family, address, direct TLS)` in connection order.
+		"""
+		
+		resolver = self.config['resolver']
+		opened = resolver is None
+		if opened:
+			resolver = AsyncResolver()
+			try:
+				await resolver.open(get_running_loop())
+			except OSError:
+				resolver = None # no SRV lookup, the domain is resolved by the system resolver
+		
+		try:
+			if resolver is None:
+				return [(_family, _address, legacy_ssl) for (_family, _address) in await self.__getaddrinfo(None, domain, port)]
+			
+			direct, starttls, fallback = await gather(resolver.resolve(f'_xmpps-client._tcp.{domain}', 'SRV'), resolver.resolve(f'_xmpp-client._tcp.{domain}', 'SRV'), self.__getaddrinfo(resolver, domain, port), return_exceptions=True)
+			if isinstance(fallback, BaseException):
+				raise fallback
+			
+			records = []
+			unavailable = False
+			for srv, direct_tls in [(direct, True), (starttls, False)]:
+				if isinstance(srv, Exception): # no records, lookup failed or reply not understood, same as no SRV records
+					logger.debug(f"SRV lookup for {domain} failed: {type(srv).__name__}: {srv}")
+					continue
+				elif isinstance(srv, BaseException): # cancelled
+					raise srv
+				elif len(srv) == 1 and not srv[0][3]: # target `.`, service decidedly not available
+					unavailable = True
+				else:
+					records.extend((_priority, _weight, _port, _target, direct_tls) for (_priority, _weight, _port, _target) in srv)
+			
+			if not records:
+				if unavailable:
+					raise ConnectionError(f"XMPP service not available at {domain}.")
+				logger.debug(f"No SRV records for {domain}, connecting to the domain.")
+				return [(_family, _address, legacy_ssl) for (_family, _address) in fallback]
+			
+			records = srv_order(records)
+			targets = list(dict.fromkeys((_target, _port) for (_priority, _weight, _port, _target, _direct_tls) in records))
+			addresses = dict(zip(targets, await gather(*[self.__getaddrinfo(resolver, _target, _port) for (_target, _port) in targets])))
+			logger.debug(f"SRV targets for {domain}: {[(_target, _port, _direct_tls) for (_priority, _weight, _port, _target, _direct_tls) in records]}")
+			return [(_family, _address, _direct_tls) for (_priority, _weight, _port, _target, _direct_tls) in records for (_family, _address) in addresses.pop((_target, _port), [])]
+		
+		finally:
+			if opened and resolver is not None:
+				await resolver.close()
+	
+	@staticmethod
+	async def __getaddrinfo(resolver, host, port):
+		"Resolve the host to `(family, address)` pairs, IPv6 first. Fall back to the system resolver for names unknown to DNS (like `localhost`)."
+		
+		addresses = []
+		if resolver is not None:
+			try:
+				addresses = await resolver.getaddrinfo(host, port, type=SOCK_STREAM)
+			except CancelledError:
+				raise
+			except Exception as error: # lookup failed or reply not understood, same policy as the SRV lookups
+				logger.debug(f"Address lookup for {host} failed: {type(error).__name__}: {error}")
+		if not addresses:
+			try:
+				addresses = await get_running_loop().getaddrinfo(host, port, type=SOCK_STREAM)
+			except CancelledError:
+				raise
+			except Exception as error:
+				logger.debug(f"System address lookup for {host} failed: {type(error).__name__}: {error}")
+		return [(_family, _address) for (_family, _type, _proto, _canonname, _address) in addresses]
+	
+	async def __race(self, domain, candidates):
+		"Connect to the candidate addresses, starting the next attempt when the previous one failed or takes longer than `connection_attempt_delay`. Keep the first connection, close the others."
+		
+		delay = self.config['connection_attempt_delay']
+		errors = []
+		attempts = set()
+		winner = None
+		
+		def finished(done):
+			"Collect results of finished attempts. Return the winning attempt or None."
+			result = None
+			for attempt in done:
+				attempts.discard(attempt)
+				if attempt.exception() is not None:
+					errors.append(attempt.exception())
+				elif result is None and winner is None:
+					result = attempt.result()
+				else: # connected at the same time as the winner
+					(reader, writer), direct_tls = attempt.result()
+					writer.close()
+			return result
+		
+		try:
+			for candidate in candidates:
+				attempts.add(create_task(self.__attempt(domain, *candidate)))
+				done, _ = await wait(attempts, timeout=delay, return_when=FIRST_COMPLETED)
+				winner = finished(done)
+				if winner is not None:
+					break
+			
+			while winner is None and attempts:
+				done, _ = await wait(attempts, return_when=FIRST_COMPLETED)
+				winner = finished(done)
+		finally:
+			for attempt in attempts:
+				attempt.cancel()
+		
+		if winner is None:
+			raise ExceptionGroup(f"Could not connect to XMPP server of {domain}.", errors)
+		return winner
+	
+	async def __attempt(self, domain, family, address, direct_tls):
+		"Open connection to one address. With direct TLS the certificate is checked against the domain, not the SRV target (XEP-0368)."
+		
+		logger.debug(f"Connecting to {address}, direct_tls={direct_tls}.")
+		
+		if direct_tls:
+			ssl = self.ssl_context()
+			ssl.set_alpn_protocols(['xmpp-client'])
+			return await open_connection(address[0], address[1], family=family, ssl=ssl, server_hostname=domain), True
+		else:
+			return await open_connection(address[0], address[1], family=family), False
+	
 	async def disconnect(self):
 		"Close network connection to XMPP server."
 		
@@ -437,7 +601,7 @@ class XMPPClient:
 				raise ExceptionGroup("Error cancelling one of XMPP tasks.", errors) from error
 			else:
 				raise
-		
+	
 	def task(self, coro):
 		"Start a task that is able to receive stanzas in parallel with other tassk."
 		
@@ -650,7 +814,7 @@ class XMPPClient:
 				future.set_exception(error)
 			else:
 				raise
-		
+	
 	async def on_query(self, method, id_, from_, *body):
 		if self.config['ping'] and len(body) == 1 and hasattr(body[0], 'tag') and body[0].tag == '{urn:xmpp:ping}ping':
 			logger.info(f"Ping from <{from_}>.")
@@ -847,7 +1011,7 @@ class XMPPClient:
 			return self.__resource[cid]
 		else:
 			 raise NotImplementedError("BOB not implemented.")
- 
+
 
 if __name__ == '__main__':
 	from logging import DEBUG, StreamHandler
@@ -36,16 +36,47 @@ else:
 
 def once(old_method):
 	def new_method(self, *args):
-		if getattr(self, '__once_' + old_method.__name__, True):
-			setattr(self, '__once_' + old_method.__name__, False)
+		called = getattr(self, 'once_called', ())
+		if old_method.__name__ not in called:
+			self.once_called = called + (old_method.__name__,)
 			return old_method(self, *args)
 	new_method.__name__ = old_method.__name__
 	return new_method
 
 
-class Word:
+class Element:
+	"Geometry common to all layout elements. Elements are created per word on every render, so attributes live in slots instead of a per-instance dict."
+	
+	__slots__ = 'style', 'x', 'y', 'width', 'height', 'space_after', 'em_size', 'parent_em_size', 'content_width', 'content_height', 'width_request', 'height_request', 'once_called'
+	
+	def intersects(self, left, top, right, bottom):
+		"Check if the element box overlaps the provided rectangle, in parent coordinates."
+		return self.x < right and self.y < bottom and self.x + self.width > left and self.y + self.height > top
+
+
+def render_visible(ctx, elements):
+	"""
+	Render the elements that intersect the clip rectangle of `ctx`, skipping whole subtrees outside of it.
+	Returns the number of painted and culled elements, including descendants of painted ones.
+	"""
+	
+	left, top, right, bottom = ctx.clip_extents()
+	painted = culled = 0
+	for element in elements:
+		if element.intersects(left, top, right, bottom):
+			p, c = element.render(ctx)
+			painted += p
+			culled += c
+		else:
+			culled += 1
+	return painted, culled
+
+
+class Word(Element):
 	"A single word of HTML text."
 	
+	__slots__ = 'text', 'font_variant', 'font_weight', 'font_size', 'baseline_request', 'baseline'
+	
 	def __init__(self, text, style):
 		self.text = text
 		self.style = style
@@ -100,7 +131,7 @@ class Word:
 	def render(self, ctx):
 		color = self.style['color']
 		if color is None:
-			return
+			return 1, 0
 		elif len(color) == 3:
 			ctx.set_source_rgb(*color)
 		elif len(color) == 4:
@@ -112,6 +143,7 @@ class Word:
 		ctx.set_font_size(self.font_size)
 		ctx.text_path(self.text)
 		ctx.fill()
+		return 1, 0
 	
 	def check_valid(self):
 		pass
@@ -122,9 +154,11 @@ class Word:
 		return False
 
 
-class InlineBlockElement:
+class InlineBlockElement(Element):
 	"Inline block element, like <img/>."
 	
+	__slots__ = 'tag', 'elements'
+	
 	def __init__(self, tag, elements, style):
 		self.tag = tag
 		self.elements = elements
@@ -155,14 +189,17 @@ class InlineBlockElement:
 		ctx.text_path(self.tag)
 		ctx.fill()
 		ctx.restore()
+		return 1, 0
 	
 	def check_valid(self):
 		pass
 
 
-class InlineElement:
+class InlineElement(Element):
 	"Inline element, like <span/>. May contain `Word`s, `InlineBlockElement`s and other `InlineElement`s."
 	
+	__slots__ = 'tag', 'elements', 'word_spacing', 'baseline_request', 'baseline'
+	
 	def __init__(self, tag, elements, style):
 		for attr in ['word-spacing']:
 			if attr not in style:
@@ -237,9 +274,11 @@ class InlineElement:
 			child.check_valid()
 
 
-class Line:
+class Line(Element):
 	"A single line of text. Contains `Word`s and `InlineBlockElement`s extracted from `InlineElement`s."
 	
+	__slots__ = 'elements', 'word_spacing', 'baseline_request', 'baseline'
+	
 	def __init__(self, elements, style):
 		self.elements = elements
 		self.style = style
@@ -297,14 +336,14 @@ class Line:
 	def render(self, ctx):
 		ctx.save()
 		ctx.translate(self.x, self.y)
-		for element in self.elements:
-			element.render(ctx)
+		painted, culled = render_visible(ctx, self.elements)
 		
 		#ctx.rectangle(0, 0, self.width, self.height)
 		#ctx.set_source_rgb(0, 0, 1)
 		#ctx.stroke()
 		
 		ctx.restore()
+		return painted + 1, culled
 	
 	def check_valid(self):
 		for child in self.children:
@@ -312,9 +351,11 @@ class Line:
 			child.check_valid()
 
 
-class BlockLinesElement:
+class BlockLinesElement(Element):
 	"A block element that contains only `Line`s of text (or inline block elements)."
 	
+	__slots__ = 'tag', 'elements', 'line_height', 'inline', 'lines', 'broken_height', 'padding_left', 'padding_right', 'padding_top', 'padding_bottom'
+	
 	def __init__(self, tag, elements, style):
 		for attr in ['line-height']:
 			if attr not in style:
@@ -404,8 +445,7 @@ class BlockLinesElement:
 	def render(self, ctx):
 		ctx.save()
 		ctx.translate(self.x, self.y)
-		for line in self.lines:
-			line.render(ctx)
+		painted, culled = render_visible(ctx, self.lines)
 		
 		#ctx.rectangle(self.padding_left, self.padding_top, self.width - self.padding_left - self.padding_right, self.height - self.padding_top - self.padding_bottom)
 		#ctx.set_line_width(1)
@@ -413,6 +453,7 @@ class BlockLinesElement:
 		#ctx.stroke()
 		
 		ctx.restore()
+		return painted + 1, culled
 	
 	def check_valid(self):
 		for child in self.children:
@@ -420,9 +461,11 @@ class BlockLinesElement:
 			child.check_valid()
 
 
-class BlockElement:
+class BlockElement(Element):
 	"A block element that may contain `BlockLineElement`s and other `BlockElement`s."
 	
+	__slots__ = 'tag', 'elements', 'broken_height', 'padding_left', 'padding_right', 'padding_top', 'padding_bottom', 'margin_left', 'margin_right', 'margin_top', 'margin_bottom'
+	
 	def __init__(self, tag, elements, style):
 		self.tag = tag
 		self.elements = elements
@@ -475,14 +518,14 @@ class BlockElement:
 	def render(self, ctx):
 		ctx.save()
 		ctx.translate(self.x, self.y)
-		for element in self.elements:
-			element.render(ctx)
+		painted, culled = render_visible(ctx, self.elements)
 		
 		#ctx.rectangle(0, 0, self.width, self.height)
 		#ctx.set_source_rgb(0, 0, 1)
 		#ctx.stroke()
 		
 		ctx.restore()
+		return painted + 1, culled
 	
 	def check_valid(self):
 		for child in self.children:
@@ -490,7 +533,9 @@ class BlockElement:
 			child.check_valid()
 
 
-class HorizontalElement:
+class HorizontalElement(Element):
+	__slots__ = 'tag', 'elements', 'broken_height', 'padding_left', 'padding_right', 'padding_top', 'padding_bottom', 'margin_left', 'margin_right', 'margin_top', 'margin_bottom'
+	
 	def __init__(self, tag, elements, style):
 		self.tag = tag
 		self.elements = elements
@@ -546,14 +591,14 @@ class HorizontalElement:
 	def render(self, ctx):
 		ctx.save()
 		ctx.translate(self.x, self.y)
-		for element in self.elements:
-			element.render(ctx)
+		painted, culled = render_visible(ctx, self.elements)
 		
 		#ctx.rectangle(0, 0, self.width, self.height)
 		#ctx.set_source_rgb(0.75, 0.95, 0.95)
 		#ctx.stroke()
 		
 		ctx.restore()
+		return painted + 1, culled
 	
 	def check_valid(self):
 		for child in self.children:
@@ -577,6 +622,8 @@ class HTMLRender:
 	
 	def __init__(self, *args, **kwargs):
 		self.__css_matcher = WeakKeyDictionary()
+		self.html_painted_counter = 0
+		self.html_culled_counter = 0
 	
 	def create_document(self, data, mime_type):
 		if mime_type == 'application/xhtml' or mime_type == 'application/xhtml+xml' or mime_type == 'text/html':
@@ -769,14 +816,24 @@ class HTMLRender:
 		else:
 			tree = document.__tree
 		
-		tree.x, tree.y, tree.width, tree.height = box
-		tree.calculate_positions(ctx, view, self)
+		try:
+			positioned = document.__tree_box == box
+		except AttributeError:
+			positioned = False
+		
+		if not positioned: # reuse positions from the previous frame if the box did not change
+			tree.x, tree.y, tree.width, tree.height = box
+			tree.calculate_positions(ctx, view, self)
+			document.__tree_box = box
 		
 		ctx.save()
 		ctx.rectangle(*box)
 		ctx.clip()
-		tree.render(ctx)
+		painted, culled = tree.render(ctx)
 		ctx.restore()
+		
+		self.html_painted_counter += painted
+		self.html_culled_counter += culled
 	
 	def poke_image(self, view, document, ctx, box, px, py, callback):
 		if not self.is_html_document(document):
@@ -1313,6 +1370,10 @@ if __debug__ and __name__ == '__main__':
 			if self.print_out: print(f'{self.__name}.device_to_user({x}, {y})')
 			return x, y
 		
+		def clip_extents(self):
+			if self.print_out: print(self.__name + '.clip_extents()')
+			return -math.inf, -math.inf, math.inf, math.inf
+		
 		def set_font_size(self, size):
 			self.font_size = size
 		
@@ -1571,6 +1632,7 @@ src="http://pagead2.googlesyndication.com/pagead/show_ads.js">
 			
 			rnd.tree = document
 			rnd.draw_image(view, document, ctx, (0, 0, 1000, 800))
+			assert rnd.html_painted_counter and not rnd.html_culled_counter # pseudo context does not clip
 				
 			#profiler.done()
 
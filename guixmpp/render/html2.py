@@ -32,13 +32,15 @@ if __name__ == '__main__':
 	from guixmpp.format.text import TextFormat
 	from guixmpp.format.css import CSSFormat
 	from guixmpp.escape import Escape
-	from guixmpp.caching import cached
+	from guixmpp.caching import cached, uncache
+	from guixmpp.table import TableLayout
 else:
 	from ..format.xml import XMLFormat
 	from ..format.text import TextFormat
 	from ..format.css import CSSFormat
 	from ..escape import Escape
-	from ..caching import cached
+	from ..caching import cached, uncache
+	from ..table import TableLayout
 
 
 def parse_float(f): # TODO: move to utils
@@ -55,6 +57,8 @@ def clamp(minimum, x, maximum):
 
 
 class Block:
+	__slots__ = 'document', 'node', 'pseudoelement', 'children', 'left', 'top', 'width', 'height'
+	
 	def __init__(self, document, node, pseudoelement, children=None):
 		self.document = document
 		self.node = node
@@ -159,15 +163,50 @@ class Block:
 		
 		return self.height
 	
-	def render(self, model, view, ctx, box, callback):
+	def content_widths(self, model, view, ctx, callback):
+		"Return minimal and maximal width of the block content, for table layout."
+		
+		width_attr = model._HTMLRender__get_attribute(view, self.document, self.node, self.pseudoelement, 'width')
+		if width_attr != 'auto' and not width_attr.endswith('%'):
+			width = model.units(view, width_attr)
+			return width, width
+		
+		min_width = max_width = 0
+		for child in self.children or []:
+			if isinstance(child, Text):
+				child_min, child_max = model.image_content_widths(view, child.text, callback)
+				margins = 0
+			else:
+				child_min, child_max = child.content_widths(model, view, ctx, callback)
+				margin_left = model.units(view, model._HTMLRender__get_attribute(view, child.document, child.node, child.pseudoelement, 'margin-left'), percentage=0)
+				margin_right = model.units(view, model._HTMLRender__get_attribute(view, child.document, child.node, child.pseudoelement, 'margin-right'), percentage=0)
+				margins = margin_left + margin_right
+			min_width = max(min_width, child_min + margins)
+			max_width = max(max_width, child_max + margins)
+		return min_width, max_width
+	
+	def render(self, model, view, ctx, box, callback, clip):
+		"Render the block and its children that intersect the `clip` rectangle. Returns the number of painted and culled boxes."
+		
 		model._HTMLRender__block_enter(view, self.document, self.node, self.pseudoelement, ctx, box)
 		
+		painted = 1
+		culled = 0
 		if self.children is not None:
-			left, top, width, height = box		
+			left, top, width, height = box
+			clip_left, clip_top, clip_right, clip_bottom = clip
 			for child in self.children:
-				child.render(model, view, ctx, (left + child.left, top + child.top, child.width, child.height), callback)
+				child_left = left + child.left
+				child_top = top + child.top
+				if child_left < clip_right and child_top < clip_bottom and child_left + child.width > clip_left and child_top + child.height > clip_top:
+					p, c = child.render(model, view, ctx, (child_left, child_top, child.width, child.height), callback, clip)
+					painted += p
+					culled += c
+				else:
+					culled += 1
 		
 		model._HTMLRender__block_exit(view, self.document, self.node, self.pseudoelement, ctx, box)
+		return painted, culled
 	
 	def poke(self, model, view, ctx, box, callback, px, py):
 		model._HTMLRender__block_enter(view, self.document, self.node, self.pseudoelement, ctx, box)
@@ -183,7 +222,63 @@ class Block:
 		return hover_nodes
 
 
+class Table(Block):
+	"Table box. Children are the captions followed by cells, the cells are arranged by `TableLayout` that keeps their content widths between layouts."
+	
+	__slots__ = 'layout', 'captions'
+	
+	def __init__(self, document, node, pseudoelement, layout, captions):
+		super().__init__(document, node, pseudoelement, captions + [_cell.content for _cell in layout.cells()])
+		self.layout = layout
+		self.captions = captions
+	
+	def __bool__(self):
+		return True
+	
+	def reformat(self, model, view):
+		for child in self.children:
+			child.reformat(model, view)
+	
+	def content_widths(self, model, view, ctx, callback):
+		return self.layout.content_widths(lambda _cell: _cell.content_widths(model, view, ctx, callback))
+	
+	def measure(self, model, view, ctx, width, height, callback):
+		width_attr = model._HTMLRender__get_attribute(view, self.document, self.node, self.pseudoelement, 'width')
+		if width_attr == 'auto':
+			table_width = width
+			auto = True
+		else:
+			table_width = model.units(view, width_attr, percentage=width)
+			auto = False
+		
+		def content_widths(cell):
+			return cell.content_widths(model, view, ctx, callback)
+		
+		def content_height(cell, cell_width):
+			return cell.measure(model, view, ctx, cell_width, height, callback)
+		
+		table_width, table_height, boxes = self.layout.layout(table_width, auto, content_widths, content_height)
+		
+		offset = 0
+		for caption in self.captions:
+			caption.left = 0
+			caption.top = offset
+			offset += caption.measure(model, view, ctx, table_width, height, callback)
+		
+		for cell, left, top, cell_width, cell_height in boxes:
+			cell.content.left = left
+			cell.content.top = offset + top
+			cell.content.width = cell_width
+			cell.content.height = cell_height
+		
+		self.width = table_width
+		self.height = offset + table_height
+		return self.height
+
+
 class Text:
+	__slots__ = 'text', 'left', 'top', 'width', 'height'
+	
 	def __init__(self, text=""):
 		self.text = text
 	
@@ -208,8 +303,9 @@ class Text:
 		self.height = height
 		return height
 	
-	def render(self, model, view, ctx, box, callback):
+	def render(self, model, view, ctx, box, callback, clip):
 		model.draw_image(view, self.text, ctx, box, callback)
+		return 1, 0
 	
 	def poke(self, model, view, ctx, box, callback, px, py):
 		return model.poke_image(view, self.text, ctx, box, px, py, callback)
@@ -225,6 +321,8 @@ class HTMLRender:
 	def __init__(self, *args, **kwargs):
 		self.__css_matcher = {}
 		self.__cache = {}
+		self.html_painted_counter = 0
+		self.html_culled_counter = 0
 	
 	def create_document(self, data, mime):
 		if mime == 'application/xhtml' or mime == 'application/xhtml+xml':
@@ -270,6 +368,20 @@ class HTMLRender:
 		self.__cache.clear()
 		self.__css_matcher.clear()
 	
+	def invalidate_document(self, document):
+		"""
+		Forget the stylesheets found in the document, the selectors compiled from it, the styles computed for its nodes and its box tree,
+		after it or a document it uses was reloaded, or its DOM was modified. The box tree is produced again on the next layout.
+		"""
+		
+		try:
+			del document.__stylesheets
+		except AttributeError:
+			pass
+		self.__css_matcher.pop(document, None)
+		self.__cache.pop(document, None)
+		uncache(self, [document])
+	
 	"css_attribute: initial_value, is_inheritable, is_animatable, css_version"
 	__initial_attribute = {
 		'background': ('', False, True, 'CSS1 CSS3'),
@@ -768,12 +880,21 @@ class HTMLRender:
 	__block_level_elements = {
 		'html', 'body', 'address', 'article', 'aside', 'blockquote', 'canvas', 'dd', 'div', 'dl', 'dt', 'fieldset', 
 		'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'center',
-		'li', 'main', 'nav', 'noscript', 'ol', 'p', 'pre', 'section', 'table', 'tfoot', 'ul', 'video', 'noframes'
+		'li', 'main', 'nav', 'noscript', 'ol', 'p', 'pre', 'section', 'ul', 'video', 'noframes'
 	}
 	
 	for element in __block_level_elements:
 		__default_attribute[element]['display'] = 'block'
 	
+	__table_elements = {
+		'table': 'table', 'caption': 'table-caption', 'colgroup': 'table-column-group', 'col': 'table-column',
+		'thead': 'table-header-group', 'tbody': 'table-row-group', 'tfoot': 'table-footer-group', 'tr': 'table-row',
+		'td': 'table-cell', 'th': 'table-cell'
+	}
+	
+	for element in __table_elements:
+		__default_attribute[element]['display'] = __table_elements[element]
+	
 	__invisible_elements = {
 		'script', 'head', 'basefont', 'meta', 'frameset', 'frame', 'style'
 	}
@@ -923,7 +1044,8 @@ class HTMLRender:
 		if not self.is_html_document(document):
 			return NotImplemented
 		
-		return self.get_viewport_width(view), self.image_height_for_width(view, document, width, callback)
+		width = self.get_viewport_width(view)
+		return width, self.image_height_for_width(view, document, width, callback)
 	
 	def image_width_for_height(self, view, document, height, callback):
 		if not self.is_html_document(document):
@@ -940,23 +1062,32 @@ class HTMLRender:
 			node = document
 			document = document.getroottree()
 		
-		recreate = False
+		surface = cairo.RecordingSurface(cairo.Content.COLOR, None)
+		ctx = cairo.Context(surface)
+		tree = self.__box_tree(view, document, node, ctx, width, None, self.__make_inline_callback(view, document, callback))
+		surface.finish()
+		return tree.height
+	
+	def __box_tree(self, view, document, node, ctx, width, height, callback):
+		"""
+		Return the box tree of the document. The tree is produced once per document and reused across frames,
+		a change of size only measures it again. Changes of the DOM or of the stylesheets take effect after
+		`invalidate_document`. Height of None accepts the tree measured for any height.
+		"""
+		
 		try:
 			tree, w, h = self.__cache[document]
 		except KeyError:
-			recreate = True
-		else:
-			if box[2:] != (w, h):
-				recreate = True
-		
-		if recreate:
-			new_callback = self.__make_inline_callback(view, document, callback)
 			tree = self.__produce_tree(view, document, node, None)
-			#tree.reformat(self, view)
-			tree.measure(self, view, ctx, box[2], box[3], new_callback)
-			self.__cache[document] = tree, box[2], box[3]
+			w = h = None
 		
-		return tree.height
+		if w != width or (height is not None and h != height):
+			if height is None:
+				height = self.get_viewport_height(view)
+			tree.measure(self, view, ctx, width, height, callback)
+			self.__cache[document] = tree, width, height
+		
+		return tree
 	
 	def __remove_whitespace(self, text):
 		text = text.translate(str.maketrans({"\t":" ", "\r":" ", "\n":" "}))
@@ -972,6 +1103,10 @@ class HTMLRender:
 		display = self.__get_attribute(view, document, node, pseudoelement, 'display')
 		if display == 'none':
 			return None
+		elif display in ('table', 'inline-table'):
+			return self.__produce_table(view, document, node, pseudoelement)
+		elif display in ('table-column', 'table-column-group'): # columns outside of a table have no boxes
+			return None
 		
 		children = []
 		content = self.__get_attribute(view, document, node, pseudoelement, 'content')
@@ -1015,7 +1150,7 @@ class HTMLRender:
 			
 			return result
 		
-		elif display == 'block':
+		elif display in ('block', 'table-cell', 'table-caption', 'table-row', 'table-row-group', 'table-header-group', 'table-footer-group'): # table parts outside of a table are laid out as blocks
 			path = document.getpath(node) # TODO: pseudoelement
 			result = Block(document, node, pseudoelement, children)
 			result.reformat(self, view)
@@ -1025,6 +1160,80 @@ class HTMLRender:
 		else:
 			raise NotImplementedError
 	
+	def __produce_table(self, view, document, node, pseudoelement):
+		"Produce the table box. Rows, row groups, columns and cells are collected into `TableLayout`, whitespace between them is dropped."
+		
+		table_layout = self.__get_attribute(view, document, node, pseudoelement, 'table-layout')
+		border_spacing = self.units(view, self.__get_attribute(view, document, node, pseudoelement, 'border-spacing').split()[0])
+		layout = TableLayout(fixed=(table_layout == 'fixed'), border_spacing=border_spacing)
+		captions = []
+		columns = 0
+		anonymous_group = False
+		
+		def span(element, attr):
+			try:
+				return max(1, int(element.attrib.get(attr, 1)))
+			except ValueError:
+				return 1
+		
+		def add_column(element):
+			nonlocal columns
+			width_attr = self.__get_attribute(view, document, element, None, 'width')
+			for n in range(span(element, 'span')):
+				if width_attr != 'auto' and not width_attr.endswith('%'):
+					layout.set_column_width(columns, self.units(view, width_attr))
+				columns += 1
+		
+		def add_row(row):
+			layout.add_row()
+			for element in row:
+				if not isinstance(element.tag, str): continue
+				if self.__get_attribute(view, document, element, None, 'display') != 'table-cell': continue
+				cell = self.__produce_tree(view, document, element, None)
+				if cell is None: continue
+				width_attr = self.__get_attribute(view, document, element, None, 'width')
+				width = self.units(view, width_attr) if (width_attr != 'auto' and not width_attr.endswith('%')) else None
+				layout.add_cell(cell, colspan=span(element, 'colspan'), rowspan=span(element, 'rowspan'), width=width)
+		
+		for child in node:
+			if not isinstance(child.tag, str): continue
+			display = self.__get_attribute(view, document, child, None, 'display')
+			
+			if display == 'table-caption':
+				caption = self.__produce_tree(view, document, child, None)
+				if caption is not None:
+					captions.append(caption)
+			
+			elif display == 'table-column-group':
+				if len(child):
+					for column in child:
+						if isinstance(column.tag, str):
+							add_column(column)
+				else:
+					add_column(child)
+			
+			elif display == 'table-column':
+				add_column(child)
+			
+			elif display in ('table-header-group', 'table-row-group', 'table-footer-group'):
+				layout.add_row_group({'table-header-group':'header', 'table-row-group':'body', 'table-footer-group':'footer'}[display])
+				anonymous_group = False
+				for row in child:
+					if isinstance(row.tag, str) and self.__get_attribute(view, document, row, None, 'display') == 'table-row':
+						add_row(row)
+			
+			elif display == 'table-row':
+				if not anonymous_group:
+					layout.add_row_group('body')
+					anonymous_group = True
+				add_row(child)
+		
+		path = document.getpath(node) # TODO: pseudoelement
+		result = Table(document, node, pseudoelement, layout, captions)
+		result.reformat(self, view)
+		result.wrap(f"\x1bX+{path}\x1b\\", f"\x1bX-{path}\x1b\\")
+		return result
+	
 	def draw_image(self, view, document, ctx, box, callback):
 		"Perform HTML rendering."
 		
@@ -1037,22 +1246,11 @@ class HTMLRender:
 			node = document
 			document = document.getroottree()
 		
-		recreate = False
-		try:
-			tree, w, h = self.__cache[document]
-		except KeyError:
-			recreate = True
-		else:
-			if box[2:] != (w, h):
-				recreate = True
-		
-		if recreate:
-			new_callback = self.__make_inline_callback(view, document, callback)
-			tree = self.__produce_tree(view, document, node, None)
-			tree.measure(self, view, ctx, box[2], box[3], new_callback)
-			self.__cache[document] = tree, box[2], box[3]
-		
-		tree.render(self, view, ctx, box, new_callback)
+		new_callback = self.__make_inline_callback(view, document, callback)
+		tree = self.__box_tree(view, document, node, ctx, box[2], box[3], new_callback)
+		painted, culled = tree.render(self, view, ctx, box, new_callback, ctx.clip_extents())
+		self.html_painted_counter += painted
+		self.html_culled_counter += culled
 	
 	def poke_image(self, view, document, ctx, box, px, py, callback):
 		if not self.is_html_document(document):
@@ -1064,21 +1262,8 @@ class HTMLRender:
 			node = document
 			document = document.getroottree()
 		
-		recreate = False
-		try:
-			tree, w, h = self.__cache[document]
-		except KeyError:
-			recreate = True
-		else:
-			if box[2:] != (w, h):
-				recreate = True
-		
-		if recreate:
-			new_callback = self.__make_inline_callback(view, document, callback)
-			tree = self.__produce_tree(view, document, node, None)
-			tree.measure(self, view, ctx, box[2], box[3], new_callback)
-			self.__cache[document] = tree, box[2], box[3]
-		
+		new_callback = self.__make_inline_callback(view, document, callback)
+		tree = self.__box_tree(view, document, node, ctx, box[2], box[3], new_callback)
 		hover = tree.poke(self, view, ctx, box, new_callback, px, py)
 		assert hover is not None
 		return hover
@@ -1502,6 +1687,10 @@ if __debug__ and __name__ == '__main__' and test_type == 0:
 			if self.print_out: print(f'{self.__name}.device_to_user({x}, {y})')
 			return x, y
 		
+		def clip_extents(self):
+			if self.print_out: print(self.__name + '.clip_extents()')
+			return -math.inf, -math.inf, math.inf, math.inf
+		
 		def set_font_size(self, size):
 			self.font_size = size
 		
@@ -1621,6 +1810,31 @@ if __debug__ and __name__ == '__main__' and test_type == 0:
 			rnd.draw_image(view, document, ctx, (0, 0, 1000, 800))
 			
 			#profiler.done()
+	
+	print("html table")
+	rnd = HTMLRenderModel()
+	view = PseudoView()
+	document = rnd.create_document(b'<html><body><table><caption>c</caption><thead><tr><th>h1</th><th>h2</th></tr></thead><tr><td>a</td><td colspan="2">b</td></tr></table></body></html>', 'text/html')
+	table = document.find('.//html:table', {'html':rnd.xmlns_html})
+	for element, display in [('table', 'table'), ('caption', 'table-caption'), ('thead', 'table-header-group'), ('tr', 'table-row'), ('th', 'table-cell'), ('td', 'table-cell')]:
+		assert rnd._HTMLRender__get_attribute(view, document, document.find(f'.//html:{element}', {'html':rnd.xmlns_html}), None, 'display') == display, element
+	box = rnd._HTMLRender__produce_tree(view, document, table, None)
+	assert isinstance(box, Table)
+	assert len(box.captions) == 1
+	assert len(list(box.layout.cells())) == 4
+	
+	print("html dom change")
+	rnd = HTMLRenderModel()
+	view = PseudoView()
+	document = rnd.create_document(b'<html><body><hr/></body></html>', 'text/html')
+	callback = lambda _reason, _params: True
+	height = rnd.image_height_for_width(view, document, 1000, callback)
+	assert rnd.image_height_for_width(view, document, 500, callback) == height # measured again, same tree
+	hr = document.find('.//html:hr', {'html':rnd.xmlns_html})
+	hr.addnext(hr.makeelement(hr.tag, {}))
+	assert rnd.image_height_for_width(view, document, 500, callback) == height # cached until invalidated
+	rnd.invalidate_document(document)
+	assert rnd.image_height_for_width(view, document, 500, callback) > height # tree produced again with the new element
 
 
 if __debug__ and __name__ == '__main__' and test_type != 0:
@@ -1692,6 +1906,12 @@ if __debug__ and __name__ == '__main__' and test_type != 0:
 			else:
 				return NotImplemented
 		
+		def image_content_widths(self, view, document, callback):
+			if self.is_text_document(document):
+				return TextFormat.image_content_widths(self, view, document, callback)
+			else:
+				return NotImplemented
+		
 		def draw_image(self, view, document, ctx, box, callback):
 			if self.is_text_document(document):
 				return TextFormat.draw_image(self, view, document, ctx, box, callback)
@@ -14,6 +14,7 @@ if __name__ == '__main__':
 
 
 import cairo
+import mmap
 from imagecodecs import imread
 from io import BytesIO
 from numpy import full, concatenate, flip
@@ -36,10 +37,19 @@ class ImageDocument:
 class ImageRender:
 	"Decodes some formats (JPEG in particular) using imagecodecs library."
 	
+	"Types of data taken as a memoryview in `create_document`."
+	buffer_mime_types = frozenset({'image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff', 'image/webp', 'image/avif', 'image/jxl', 'image/jp2'})
+	
 	def create_document(self, data, mime_type):
 		if data is not None and mime_type.startswith('image/'):
+			if isinstance(data, memoryview) and isinstance(data.obj, mmap.mmap) and data.nbytes == len(data.obj): # mapped file, decoded in place
+				data.obj.seek(0)
+				source = data.obj
+			else:
+				source = BytesIO(data)
+			
 			try:
-				pixels = imread(BytesIO(data)) # do the decoding
+				pixels = imread(source) # do the decoding
 			except ValueError:
 				pass
 			else:
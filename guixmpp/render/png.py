@@ -6,6 +6,7 @@ __all__ = 'PNGRender',
 
 
 import cairo
+import mmap
 from io import BytesIO
 from collections import defaultdict
 
@@ -26,9 +27,16 @@ class PNGImage:
 class PNGRender:
 	"Supports creating and rendering PNG images, using Cairo only."
 	
+	"Types of data taken as a memoryview in `create_document`."
+	buffer_mime_types = frozenset({'image/png'})
+	
 	def create_document(self, data, mime_type):
 		if mime_type == 'image/png':
-			s = cairo.ImageSurface.create_from_png(BytesIO(data))
+			if isinstance(data, memoryview) and isinstance(data.obj, mmap.mmap) and data.nbytes == len(data.obj): # mapped file, read in place
+				data.obj.seek(0)
+				s = cairo.ImageSurface.create_from_png(data.obj)
+			else:
+				s = cairo.ImageSurface.create_from_png(BytesIO(data))
 			return PNGImage(s, s.get_width(), s.get_height())
 		else:
 			return NotImplemented
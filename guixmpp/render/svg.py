@@ -170,6 +170,15 @@ class SVGRender:
 		self.__css_matcher.clear()
 		self.__instantiated_symbols.clear()
 	
+	def invalidate_document(self, document):
+		"Forget the stylesheets found in the document and the selectors compiled from it, after it or a stylesheet it uses was reloaded."
+		
+		try:
+			del document.__stylesheets
+		except AttributeError:
+			pass
+		self.__css_matcher.pop(document, None)
+	
 	def __stylesheets(self, document):
 		myurl = self.get_document_url(document)
 		for link in chain(document.scan_stylesheets(), self.__data_internal_links(self.__style_tags(document))):
@@ -29,6 +29,9 @@ class WEBPImage:
 
 
 class WEBPRender:
+	"Types of data taken as a memoryview in `create_document`."
+	buffer_mime_types = frozenset({'image/webp'})
+	
 	def create_document(self, data, mime_type):
 		if mime_type == 'image/webp':
 			webp_data = webp.WebPData.from_buffer(data)
@@ -157,6 +157,7 @@ class Renderer:
 				self.main_url = None
 				await self.model.close_document(self)
 				self.set_image(None)
+			await self.model.close_connections()
 	
 	def set_image(self, image):
 		"Directly set image to display (document returned by `model.create_document`). None to unset."
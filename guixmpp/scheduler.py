@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+#-*- coding:utf-8 -*-
+
+
+__all__ = 'DownloadScheduler', 'download_priority', 'link_kind'
+
+
+from asyncio import get_running_loop, CancelledError
+from collections import defaultdict
+from heapq import heappush, heappop
+from itertools import count
+from mimetypes import guess_type
+from urllib.parse import urlparse
+
+
+"Download priority per resource kind, lower is sooner. Stylesheets and fonts block the first render, images do not. `idle` is for deprioritized downloads."
+download_priority = {
+	'document': 0,
+	'stylesheet': 1,
+	'font': 2,
+	'script': 3,
+	'other': 4,
+	'image': 5,
+	'idle': 7
+}
+
+
+def link_kind(url):
+	"Guess the resource kind of a link from its url: `document`, `stylesheet`, `font`, `script`, `image` or `other`."
+	
+	mime_type = guess_type(url.split('?')[0].split('#')[0])[0]
+	if mime_type is None:
+		return 'other'
+	elif mime_type == 'text/css':
+		return 'stylesheet'
+	elif mime_type.startswith('font/') or mime_type in {'application/font-woff', 'application/vnd.ms-fontobject', 'application/x-font-ttf'}:
+		return 'font'
+	elif 'javascript' in mime_type or 'ecmascript' in mime_type:
+		return 'script'
+	elif mime_type.startswith('image/'):
+		return 'image'
+	elif mime_type in {'text/html', 'application/xhtml+xml', 'application/xml', 'text/xml'}:
+		return 'document'
+	else:
+		return 'other'
+
+
+class DownloadScheduler:
+	"""
+	Queue of downloads started in priority order, with limits on downloads running at the same time, in total and per host.
+	A download waits in `acquire` until it may start and must be given back with `release`. Queued downloads may be
+	moved to another priority with `reprioritize` or dropped with `cancel`, which raises `CancelledError` in the waiter.
+	The same url may be acquired many times, every waiter gets its own slot and must release it.
+	"""
+	
+	max_downloads = 16
+	max_downloads_per_host = 6
+	
+	def __init__(self, max_downloads=None, max_downloads_per_host=None):
+		if max_downloads is not None:
+			self.max_downloads = max_downloads
+		if max_downloads_per_host is not None:
+			self.max_downloads_per_host = max_downloads_per_host
+		
+		self.__queue = [] # heap of [priority, order, url, host, future], future is None for entries moved to another priority
+		self.__host_queue = defaultdict(list) # host -> heap of entries waiting only for the host limit
+		self.__queued = {} # url -> list of waiting entries, in order of arrival
+		self.__running = defaultdict(int) # host -> number of downloads
+		self.__order = count()
+		
+		self.scheduled_counter = 0
+		self.cancelled_counter = 0
+		self.reprioritized_counter = 0
+		self.max_queue_depth = 0
+	
+	@staticmethod
+	def host(url):
+		return urlparse(url).netloc
+	
+	@property
+	def running(self):
+		"Number of downloads running now."
+		return sum(self.__running.values())
+	
+	@property
+	def queued(self):
+		"Number of downloads waiting to start."
+		return sum(len(_entries) for _entries in self.__queued.values())
+	
+	def queue_depth(self):
+		"Number of waiting downloads per priority."
+		
+		depth = defaultdict(int)
+		for entries in self.__queued.values():
+			for entry in entries:
+				depth[entry[0]] += 1
+		return dict(depth)
+	
+	def running_per_host(self):
+		return {_host: _number for (_host, _number) in self.__running.items() if _number}
+	
+	async def acquire(self, url, priority):
+		"Wait until the download of `url` may start. Downloads of lower `priority` start first, in order of arrival within a priority."
+		
+		host = self.host(url)
+		self.scheduled_counter += 1
+		if not self.__queued and self.running < self.max_downloads and self.__running[host] < self.max_downloads_per_host:
+			self.__running[host] += 1
+			return
+		
+		future = get_running_loop().create_future()
+		entry = [priority, next(self.__order), url, host, future]
+		self.__queued.setdefault(url, []).append(entry)
+		heappush(self.__queue, entry)
+		self.max_queue_depth = max(self.max_queue_depth, self.queued)
+		self.__dispatch()
+		
+		try:
+			await future
+		except CancelledError:
+			queued = [_entry for _entry in self.__queued.get(url, ()) if _entry[4] is future]
+			if queued: # still waiting, possibly moved to another priority
+				self.__unqueue(queued[0])
+				queued[0][4] = None
+			elif future.done() and not future.cancelled(): # started just before cancellation
+				self.release(url)
+			raise
+	
+	def release(self, url):
+		"Give back the slot of a finished download and start the next ones."
+		
+		host = self.host(url)
+		self.__running[host] -= 1
+		if not self.__running[host]:
+			del self.__running[host]
+		
+		host_queue = self.__host_queue.get(host)
+		while host_queue:
+			entry = heappop(host_queue)
+			if entry[4] is not None and not entry[4].done():
+				heappush(self.__queue, entry)
+				break
+		if host_queue is not None and not host_queue:
+			del self.__host_queue[host]
+		
+		self.__dispatch()
+	
+	def reprioritize(self, url, priority):
+		"Move a waiting download to another priority. Return False if the download is not waiting."
+		
+		try:
+			entries = self.__queued[url]
+		except KeyError:
+			return False
+		
+		for n, entry in enumerate(entries):
+			if entry[0] == priority:
+				continue
+			new_entry = entries[n] = [priority, next(self.__order), url, entry[3], entry[4]]
+			entry[4] = None # the old entry is skipped when popped
+			heappush(self.__queue, new_entry)
+			self.reprioritized_counter += 1
+		self.__dispatch()
+		return True
+	
+	def cancel(self, url):
+		"Drop all waiting downloads of `url`. The waiters get `CancelledError`. Return False if no download of `url` is waiting."
+		
+		try:
+			entries = self.__queued.pop(url)
+		except KeyError:
+			return False
+		for entry in entries:
+			entry[4].cancel()
+			entry[4] = None
+			self.cancelled_counter += 1
+		return True
+	
+	def __unqueue(self, entry):
+		entries = self.__queued[entry[2]]
+		entries.remove(entry)
+		if not entries:
+			del self.__queued[entry[2]]
+	
+	def __dispatch(self):
+		"Start waiting downloads while the limits allow. Entries of hosts at their limit are set aside until the host releases a slot."
+		
+		while self.__queue and self.running < self.max_downloads:
+			entry = heappop(self.__queue)
+			priority, order, url, host, future = entry
+			if future is None or future.done(): # moved, cancelled or dropped
+				continue
+			
+			if self.__running[host] >= self.max_downloads_per_host:
+				heappush(self.__host_queue[host], entry)
+				continue
+			
+			self.__unqueue(entry)
+			self.__running[host] += 1
+			future.set_result(None)
+
+
+if __debug__ and __name__ == '__main__':
+	from asyncio import run, sleep, gather, create_task
+	
+	assert link_kind('http://example.com/style.css?v=2') == 'stylesheet'
+	assert link_kind('http://example.com/font.woff2') == 'font'
+	assert link_kind('http://example.com/image.png#frag') == 'image'
+	assert link_kind('http://example.com/') == 'other'
+	
+	async def test_main():
+		scheduler = DownloadScheduler(max_downloads=2, max_downloads_per_host=1)
+		started = []
+		
+		async def download(url, priority):
+			await scheduler.acquire(url, priority)
+			started.append(url)
+			try:
+				await sleep(0.01)
+			finally:
+				scheduler.release(url)
+		
+		tasks = [create_task(download(f'http://a.example/image{_n}.png', download_priority['image'])) for _n in range(3)]
+		tasks.append(create_task(download('http://b.example/image.png', download_priority['image'])))
+		tasks.append(create_task(download('http://a.example/style.css', download_priority['stylesheet'])))
+		tasks.append(create_task(download('http://b.example/font.woff2', download_priority['font'])))
+		tasks.append(create_task(download('http://a.example/unused.png', download_priority['image'])))
+		await sleep(0)
+		
+		assert scheduler.running == 2 and scheduler.running_per_host() == {'a.example': 1, 'b.example': 1}
+		assert scheduler.queued == 5 and scheduler.queue_depth() == {5: 3, 1: 1, 2: 1}
+		assert scheduler.reprioritize('http://a.example/image2.png', download_priority['idle'])
+		assert scheduler.cancel('http://a.example/unused.png')
+		assert not scheduler.cancel('http://a.example/image0.png') # already running
+		
+		await gather(*tasks, return_exceptions=True)
+		assert tasks[-1].cancelled()
+		assert started == ['http://a.example/image0.png', 'http://b.example/image.png', 'http://a.example/style.css', 'http://b.example/font.woff2', 'http://a.example/image1.png', 'http://a.example/image2.png'], started
+		assert scheduler.running == 0 and scheduler.queued == 0
+		assert scheduler.cancelled_counter == 1 and scheduler.reprioritized_counter == 1 and scheduler.max_queue_depth == 5
+	
+	async def test_duplicates(): # the same url acquired at once, for instance by a preload and a hover prefetch
+		scheduler = DownloadScheduler(max_downloads=1)
+		started = []
+		
+		async def download(url, name):
+			await scheduler.acquire(url, download_priority['image'])
+			started.append(name)
+			try:
+				await sleep(0.01)
+			finally:
+				scheduler.release(url)
+		
+		tasks = [create_task(download('http://a.example/first.png', 'first'))]
+		tasks += [create_task(download('http://a.example/image.png', _name)) for _name in ('preload', 'prefetch')]
+		await sleep(0)
+		assert scheduler.queued == 2 and scheduler.queue_depth() == {5: 2}
+		assert scheduler.reprioritize('http://a.example/image.png', download_priority['stylesheet'])
+		await gather(*tasks)
+		assert started == ['first', 'preload', 'prefetch'], started
+		assert scheduler.running == 0 and scheduler.queued == 0
+		
+		tasks = [create_task(download('http://a.example/first.png', 'first'))]
+		tasks += [create_task(download('http://a.example/image.png', _name)) for _name in ('preload', 'prefetch', 'hover')]
+		await sleep(0)
+		tasks[2].cancel()
+		await sleep(0)
+		assert scheduler.queued == 2
+		assert scheduler.cancel('http://a.example/image.png')
+		results = await gather(*tasks, return_exceptions=True)
+		assert results[0] is None and all(isinstance(_result, CancelledError) for _result in results[1:]), results
+		assert scheduler.running == 0 and scheduler.queued == 0 and scheduler.cancelled_counter == 2
+	
+	run(test_main())
+	run(test_duplicates())
@@ -0,0 +1,371 @@
+#!/usr/bin/python3
+#-*- coding:utf-8 -*-
+
+
+__all__ = 'TableLayout', 'TableCell'
+
+
+"Kinds of row groups, in the order they are displayed."
+row_group_order = 'header', 'body', 'footer'
+
+
+class TableCell:
+	"A cell of the table, holding opaque content. Content widths are measured once and reused on every layout."
+	
+	__slots__ = 'content', 'row', 'column', 'rowspan', 'colspan', 'width', 'min_width', 'max_width'
+	
+	def __init__(self, content, colspan=1, rowspan=1, width=None):
+		if colspan < 1 or rowspan < 1:
+			raise ValueError("Cell span must be positive.")
+		self.content = content
+		self.colspan = colspan
+		self.rowspan = rowspan
+		self.width = width
+		self.row = self.column = None
+		self.min_width = self.max_width = None
+
+
+class TableLayout:
+	"""
+	Table layout following CSS 2.1 section 17.5, with automatic and fixed algorithms, column and row spans and row groups.
+	Cells are added row by row. Content widths of each cell are requested only once, so when the table is resized
+	only the column widths are distributed and the rows are measured again. Cost is linear in the number of cells.
+	"""
+	
+	def __init__(self, fixed=False, border_spacing=0):
+		self.fixed = fixed
+		self.border_spacing = border_spacing
+		self.groups = []
+		self.column_specified_widths = {}
+		self.__grid = None
+		self.__column_limits = None
+		self.__column_widths = None
+	
+	def add_row_group(self, kind='body'):
+		"Start a new row group: 'header', 'body' or 'footer'. Header groups are displayed first and footer groups last."
+		if kind not in row_group_order:
+			raise ValueError(f"Unsupported row group: {kind}")
+		self.groups.append((kind, []))
+		self.__grid = None
+	
+	def add_row(self):
+		"Start a new row in the current row group. Rows outside of a group go to an anonymous body group."
+		if not self.groups:
+			self.add_row_group()
+		self.groups[-1][1].append([])
+		self.__grid = None
+	
+	def add_cell(self, content, colspan=1, rowspan=1, width=None):
+		"Add a cell to the current row. `width` is the specified width of the cell in pixels, or None for auto."
+		if not self.groups or not self.groups[-1][1]:
+			self.add_row()
+		cell = TableCell(content, colspan, rowspan, width)
+		self.groups[-1][1][-1].append(cell)
+		self.__grid = None
+		return cell
+	
+	def set_column_width(self, column, width):
+		"Set the specified width of a column, like from a <col/> element."
+		self.column_specified_widths[column] = width
+		self.__column_limits = None
+		self.__column_widths = None
+	
+	def invalidate(self):
+		"Forget measured cell content widths, after the content has changed."
+		for cell in self.cells():
+			cell.min_width = cell.max_width = None
+		self.__column_limits = None
+		self.__column_widths = None
+	
+	def cells(self):
+		"Yield all cells in display order."
+		for row in self.__arrange()[0]:
+			yield from row
+	
+	@property
+	def row_count(self):
+		return len(self.__arrange()[0])
+	
+	@property
+	def column_count(self):
+		return self.__arrange()[1]
+	
+	def __arrange(self):
+		"Place cells into the grid, skipping slots covered by row spans from above. Row spans do not cross row groups."
+		
+		if self.__grid is not None:
+			return self.__grid
+		
+		rows = []
+		column_count = 0
+		for kind in row_group_order:
+			for group_kind, group_rows in self.groups:
+				if group_kind != kind: continue
+				
+				covered = [] # number of rows still covered by a row span, per column
+				for n, row in enumerate(group_rows):
+					column = 0
+					for cell in row:
+						while column < len(covered) and covered[column]:
+							column += 1
+						cell.row = len(rows)
+						cell.column = column
+						cell.rowspan = min(cell.rowspan, len(group_rows) - n)
+						if len(covered) < column + cell.colspan:
+							covered.extend([0] * (column + cell.colspan - len(covered)))
+						for c in range(column, column + cell.colspan):
+							covered[c] = cell.rowspan
+						column += cell.colspan
+					
+					column_count = max(column_count, len(covered))
+					rows.append(row)
+					covered = [max(_n - 1, 0) for _n in covered]
+		
+		self.__grid = rows, column_count
+		self.__column_limits = None
+		self.__column_widths = None
+		return self.__grid
+	
+	def __measure(self, content_widths):
+		"Return minimal and maximal widths of all columns. Cells not measured yet are measured with `content_widths(content) -> (min, max)`."
+		
+		if self.__column_limits is not None:
+			return self.__column_limits
+		
+		rows, column_count = self.__arrange()
+		spacing = self.border_spacing
+		minimums = [0] * column_count
+		maximums = [0] * column_count
+		spanning = []
+		
+		for row in rows:
+			for cell in row:
+				if cell.min_width is None:
+					cell.min_width, cell.max_width = content_widths(cell.content)
+					if cell.width is not None:
+						cell.max_width = cell.min_width = max(cell.min_width, cell.width)
+				
+				if cell.colspan == 1:
+					c = cell.column
+					minimums[c] = max(minimums[c], cell.min_width)
+					maximums[c] = max(maximums[c], cell.max_width)
+				else:
+					spanning.append(cell)
+		
+		for c, width in self.column_specified_widths.items():
+			if c < column_count:
+				minimums[c] = max(minimums[c], width)
+				maximums[c] = max(minimums[c], width)
+		
+		for c in range(column_count):
+			maximums[c] = max(maximums[c], minimums[c])
+		
+		spanning.sort(key=lambda _cell: _cell.colspan) # narrower spans first, so wider ones see their widths
+		for cell in spanning:
+			columns = range(cell.column, cell.column + cell.colspan)
+			gaps = (cell.colspan - 1) * spacing
+			for widths, needed in ((minimums, cell.min_width), (maximums, cell.max_width)):
+				current = sum(widths[_c] for _c in columns)
+				missing = needed - gaps - current
+				if missing <= 0: continue
+				weights = sum(maximums[_c] for _c in columns)
+				for c in columns:
+					widths[c] += missing * (maximums[c] / weights if weights > 0 else 1 / cell.colspan)
+			for c in columns:
+				maximums[c] = max(maximums[c], minimums[c])
+		
+		self.__column_limits = minimums, maximums
+		self.__column_widths = None
+		return self.__column_limits
+	
+	def content_widths(self, content_widths):
+		"Return minimal and maximal width of the whole table, including border spacing."
+		
+		column_count = self.column_count
+		outer = (column_count + 1) * self.border_spacing if column_count else 0
+		if self.fixed:
+			specified = sum(self.column_specified_widths.get(_c, 0) for _c in range(column_count))
+			return specified + outer, specified + outer
+		minimums, maximums = self.__measure(content_widths)
+		return sum(minimums) + outer, sum(maximums) + outer
+	
+	def column_widths(self, width, auto, content_widths):
+		"""
+		Return the used table width and the list of column widths. With `auto` the table shrinks to fit its content,
+		up to `width`; otherwise `width` is the specified table width. The result is cached for the last width.
+		"""
+		
+		key = width, auto
+		if self.__column_widths is not None and self.__column_widths[0] == key:
+			return self.__column_widths[1]
+		
+		column_count = self.column_count
+		outer = (column_count + 1) * self.border_spacing if column_count else 0
+		
+		if self.fixed:
+			result = self.__fixed_widths(width, outer)
+		else:
+			result = self.__auto_widths(width, auto, outer, content_widths)
+		
+		self.__column_widths = key, result
+		return result
+	
+	def __fixed_widths(self, width, outer):
+		"Fixed algorithm: column widths come from columns or cells in the first row, the rest of the width is split evenly. Content is not measured."
+		
+		rows, column_count = self.__arrange()
+		specified = dict(self.column_specified_widths)
+		if rows:
+			for cell in rows[0]:
+				if cell.width is None: continue
+				columns = range(cell.column, cell.column + cell.colspan)
+				if any(_c in specified for _c in columns): continue
+				for c in columns:
+					specified[c] = (cell.width - (cell.colspan - 1) * self.border_spacing) / cell.colspan
+		
+		fixed_width = sum(specified.get(_c, 0) for _c in range(column_count))
+		table_width = max(width, fixed_width + outer)
+		free = table_width - outer - fixed_width
+		unspecified = [_c for _c in range(column_count) if _c not in specified]
+		
+		widths = [specified.get(_c, 0) for _c in range(column_count)]
+		if unspecified:
+			for c in unspecified:
+				widths[c] = free / len(unspecified)
+		elif column_count:
+			for c in range(column_count):
+				widths[c] += free / column_count
+		
+		return table_width, widths
+	
+	def __auto_widths(self, width, auto, outer, content_widths):
+		"Automatic algorithm: distribute the width between minimal and maximal content widths of columns."
+		
+		minimums, maximums = self.__measure(content_widths)
+		min_sum = sum(minimums)
+		max_sum = sum(maximums)
+		
+		if auto:
+			table_width = max(min_sum + outer, min(width, max_sum + outer))
+		else:
+			table_width = max(min_sum + outer, width)
+		inner = table_width - outer
+		
+		if inner <= min_sum:
+			widths = list(minimums)
+		elif inner <= max_sum:
+			t = (inner - min_sum) / (max_sum - min_sum)
+			widths = [_min + (_max - _min) * t for (_min, _max) in zip(minimums, maximums)]
+		elif max_sum > 0:
+			widths = [_max * inner / max_sum for _max in maximums]
+		else:
+			widths = [inner / len(maximums) for _max in maximums]
+		
+		return table_width, widths
+	
+	def layout(self, width, auto, content_widths, content_height):
+		"""
+		Lay out the table within the provided width. `content_widths(content) -> (min, max)` is called once per cell,
+		`content_height(content, width) -> height` on every layout. Returns table width, table height and a list of
+		`(cell, x, y, width, height)` boxes relative to the table.
+		"""
+		
+		table_width, widths = self.column_widths(width, auto, content_widths)
+		rows, column_count = self.__arrange()
+		spacing = self.border_spacing
+		
+		xs = []
+		x = spacing
+		for w in widths:
+			xs.append(x)
+			x += w + spacing
+		
+		heights = [0] * len(rows)
+		cell_widths = []
+		spanning = []
+		for row in rows:
+			for cell in row:
+				cell_width = xs[cell.column + cell.colspan - 1] + widths[cell.column + cell.colspan - 1] - xs[cell.column]
+				cell_height = content_height(cell.content, cell_width)
+				cell_widths.append((cell, cell_width, cell_height))
+				if cell.rowspan == 1:
+					heights[cell.row] = max(heights[cell.row], cell_height)
+				else:
+					spanning.append((cell, cell_height))
+		
+		for cell, cell_height in spanning: # rows spanned by a taller cell grow evenly
+			spanned = range(cell.row, cell.row + cell.rowspan)
+			missing = cell_height - (cell.rowspan - 1) * spacing - sum(heights[_r] for _r in spanned)
+			if missing > 0:
+				for r in spanned:
+					heights[r] += missing / cell.rowspan
+		
+		ys = []
+		y = spacing if rows else 0
+		for h in heights:
+			ys.append(y)
+			y += h + spacing
+		table_height = y if rows else 0
+		
+		boxes = []
+		for cell, cell_width, cell_height in cell_widths:
+			last = cell.row + cell.rowspan - 1
+			boxes.append((cell, xs[cell.column], ys[cell.row], cell_width, ys[last] + heights[last] - ys[cell.row]))
+		
+		return table_width, table_height, boxes
+
+
+if __debug__ and __name__ == '__main__':
+	def content_widths(content):
+		return len(content) * 2, len(content) * 10
+	
+	def content_height(content, width):
+		return -(-len(content) * 10 // max(width, 1)) * 10
+	
+	table = TableLayout(border_spacing=2)
+	table.add_row_group('footer')
+	table.add_row()
+	table.add_cell("foot", colspan=2)
+	table.add_row_group('header')
+	table.add_row()
+	table.add_cell("a")
+	table.add_cell("b")
+	table.add_row_group('body')
+	table.add_row()
+	table.add_cell("tall", rowspan=2)
+	table.add_cell("c")
+	table.add_row()
+	table.add_cell("d")
+	
+	assert table.row_count == 4
+	assert table.column_count == 2
+	assert [_cell.content for _cell in table.cells()] == ["a", "b", "tall", "c", "d", "foot"]
+	assert [(_cell.row, _cell.column) for _cell in table.cells()] == [(0, 0), (0, 1), (1, 0), (1, 1), (2, 1), (3, 0)]
+	
+	width, height, boxes = table.layout(1000, True, content_widths, content_height)
+	assert width == 40 + 10 + 3 * 2 # shrink to fit maximal widths
+	assert [_box[1:3] for _box in boxes][:2] == [(2, 2), (44, 2)]
+	assert boxes[-1][3] == width - 4 # footer spans both columns
+	
+	calls = []
+	def counting_widths(content):
+		calls.append(content)
+		return content_widths(content)
+	
+	table.invalidate()
+	for w in [20, 30, 45, 1000, 30]:
+		width, height, boxes = table.layout(w, True, counting_widths, content_height)
+		assert width >= w or w > 56
+		assert all(_box[3] >= 0 for _box in boxes)
+	assert len(calls) == 6 # content widths measured once per cell
+	
+	width, widths = table.column_widths(200, False, counting_widths)
+	assert width == 200 and abs(sum(widths) + 3 * 2 - 200) < 1e-9
+	
+	fixed = TableLayout(fixed=True)
+	fixed.add_cell("x", width=50)
+	fixed.add_cell("y")
+	fixed.add_cell("z")
+	assert fixed.column_widths(250, False, None) == (250, [50, 100, 100])
+	
+	print("table layout ok")
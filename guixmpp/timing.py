@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+#-*- coding:utf-8 -*-
+
+
+__all__ = 'ResourceTiming', 'chrome_trace'
+
+
+import json
+
+
+class ResourceTiming:
+	"""
+	Phases of loading one resource, each a `(start, end)` pair of `perf_counter` times. Network phases are `dns`, `connect`, `tls`
+	(only for new connections), `request` (until the first byte of response) and `response` (until the last byte). `create_document`
+	is the time of creating the document including waiting for a worker thread, `parse` the time the worker actually spent on it.
+	"""
+	
+	__slots__ = 'url', 'phases'
+	
+	def __init__(self, url):
+		self.url = url
+		self.phases = {}
+	
+	def record(self, phase, start, end):
+		self.phases[phase] = (start, end)
+	
+	@property
+	def start(self):
+		return min((_start for (_start, _end) in self.phases.values()), default=None)
+	
+	@property
+	def end(self):
+		return max((_end for (_start, _end) in self.phases.values()), default=None)
+	
+	def duration(self, phase=None):
+		"Duration of one phase, or of the whole load if `phase` is None."
+		if phase is None:
+			return self.end - self.start if self.phases else None
+		start, end = self.phases[phase]
+		return end - start
+	
+	def __repr__(self):
+		return f'<{self.__class__.__name__} {self.url} ' + ' '.join(f'{_phase}={(_end - _start) * 1000:.1f}ms' for (_phase, (_start, _end)) in self.phases.items()) + '>'
+
+
+def chrome_trace(timeline, fileobj=None):
+	"""
+	Convert a list of `ResourceTiming`s to Chrome trace-event format (loadable in `chrome://tracing` or Perfetto).
+	Each resource is one row. Return the trace as dict, and also write it as JSON to `fileobj` if provided.
+	"""
+	
+	origin = min((_timing.start for _timing in timeline if _timing.phases), default=0)
+	events = []
+	for tid, timing in enumerate(timeline, 1):
+		events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': timing.url}})
+		for phase, (start, end) in sorted(timing.phases.items(), key=lambda _item: _item[1]):
+			events.append({'name': phase, 'cat': 'resource', 'ph': 'X', 'pid': 1, 'tid': tid, 'ts': (start - origin) * 1e6, 'dur': (end - start) * 1e6, 'args': {'url': timing.url}})
+	
+	trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+	if fileobj is not None:
+		json.dump(trace, fileobj)
+	return trace
+
+
+if __debug__ and __name__ == '__main__':
+	timing = ResourceTiming('http://example.com/style.css')
+	timing.record('dns', 10.0, 10.01)
+	timing.record('connect', 10.01, 10.05)
+	timing.record('response', 10.1, 10.2)
+	assert abs(timing.duration() - 0.2) < 1e-9
+	assert abs(timing.duration('connect') - 0.04) < 1e-9
+	
+	trace = chrome_trace([timing, ResourceTiming('data:,')])
+	assert [_event['name'] for _event in trace['traceEvents'] if _event['ph'] == 'X'] == ['dns', 'connect', 'response']
+	assert trace['traceEvents'][1]['ts'] == 0
+	json.dumps(trace)
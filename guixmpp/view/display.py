@@ -17,6 +17,12 @@ class DisplayView:
 		widget.__image = image
 		GLib.idle_add(self.update, widget)
 	
+	def update_image(self, widget, old_image, new_image):
+		if self.get_image(widget) is not old_image:
+			return
+		widget.__image = new_image
+		GLib.idle_add(self.update, widget)
+	
 	def get_image(self, widget):
 		try:
 			return widget.__image
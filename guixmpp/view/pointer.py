@@ -22,6 +22,7 @@ else:
 class PointerView:
 	def set_image(self, widget, image):
 		widget.__pointed = []
+		widget.__link = None
 	
 	def get_pointed(self, widget):
 		try:
@@ -35,6 +36,20 @@ class PointerView:
 		except AttributeError:
 			return frozenset()
 	
+	def __hyperlink(self, widget, node):
+		"Absolute url of the hyperlink (`a` element) containing the node, or None. Relative links are resolved against the location of the view."
+		
+		try:
+			while node is not None:
+				if isinstance(node.tag, str) and node.tag.split('}')[-1] == 'a':
+					href = node.attrib.get('{http://www.w3.org/1999/xlink}href', node.attrib.get('href'))
+					if href and not href.startswith('#') and not href.startswith('javascript:'):
+						return self.resolve_url(href, self.current_location(widget))
+				node = node.getparent()
+		except AttributeError: # not an element
+			pass
+		return None
+	
 	def handle_event(self, widget, event, evtype, name):
 		if name != 'motion' and name != 'button': return NotImplemented
 		
@@ -87,6 +102,11 @@ class PointerView:
 						dom_event = MouseEvent('mouseenter', **pointer_position(event, qx, qy), **modifier_keys(self.get_modifier_keys(widget)), **pressed_mouse_buttons_mask(self.get_buttons(widget)))
 						widget.emit('dom_event', dom_event, new_pointed)
 					
+					link = self.__hyperlink(widget, new_pointed)
+					if link != widget.__link:
+						widget.__link = link
+						self.hover_link(widget, link)
+					
 					self.update(widget)
 			
 			dom_event = MouseEvent('mousemove', **pointer_position(event, qx, qy), **modifier_keys(self.get_modifier_keys(widget)), **pressed_mouse_buttons_mask(self.get_buttons(widget)))
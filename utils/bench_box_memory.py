@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+
+"""
+Memory benchmark of layout boxes. Reports bytes per box for the slotted classes ("after")
+and for dict-backed objects holding the same attributes ("before").
+
+Run from the repository root: `PYTHONPATH=. utils/bench_box_memory.py [count]`
+"""
+
+
+from os import environ
+environ.setdefault('GUIXMPP_USE_PANGO', '0')
+
+import sys
+import tracemalloc
+
+from guixmpp.boxes import Gravity, Word, Whitespace, Row
+from guixmpp.render import html, html2
+
+
+class DictBacked:
+	"Plain object with a per-instance dict, the way boxes were stored before."
+
+
+def unslotted(obj):
+	"Copy all slot attributes of `obj` into a dict-backed object."
+
+	copy = DictBacked()
+	for cls in type(obj).__mro__:
+		for name in getattr(cls, '__slots__', ()):
+			try:
+				setattr(copy, name, getattr(obj, name))
+			except AttributeError:
+				pass
+	return copy
+
+
+def bytes_per_box(factory, count):
+	"Allocate `count` boxes and return the traced memory per box."
+
+	tracemalloc.start()
+	try:
+		base, _ = tracemalloc.get_traced_memory()
+		boxes = [factory(_n) for _n in range(count)]
+		used, _ = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+
+	return (used - base - sys.getsizeof(boxes)) / count
+
+
+words = [f"word{_n}" for _n in range(1000)] # shared values, so only the boxes themselves are measured
+style = {'font-family': 'serif', 'font-variant': 'normal', 'font-weight': 'normal', 'color': (0, 0, 0)}
+
+
+def box_word(n):
+	return Word(words[n % len(words)], 0, 12, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, width=30.0, height=15.0)
+
+
+def box_whitespace(n):
+	return Whitespace(node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, min_width=4.0, max_width=4.0, height=15.0)
+
+
+row_children = [box_word(_n) for _n in range(8)]
+
+def box_row(n):
+	return Row(row_children, n, node=None, pseudoelement=None, inline=True, gravity=Gravity.BOTTOM_LEFT, height=15.0, max_width=float('inf'))
+
+
+def html_word(n):
+	word = html.Word(words[n % len(words)], style)
+	word.em_size = word.parent_em_size = word.font_size = 15.0
+	word.font_variant = word.font_weight = 0
+	word.content_width = word.width_request = word.width = 30.0
+	word.content_height = word.height_request = word.height = 15.0
+	word.baseline_request = word.baseline = 12.0
+	word.x = word.y = word.space_after = 0.0
+	return word
+
+
+def html2_text(n):
+	text = html2.Text(words[n % len(words)])
+	text.left = text.top = 0.0
+	text.width = 300.0
+	text.height = 15.0
+	return text
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+	print(f"{'box':<24}{'before':>10}{'after':>10}{'saved':>8}")
+	for name, factory in [('boxes.Word', box_word), ('boxes.Whitespace', box_whitespace), ('boxes.Row', box_row), ('html.Word', html_word), ('html2.Text', html2_text)]:
+		after = bytes_per_box(factory, count)
+		before = bytes_per_box(lambda _n: unslotted(factory(_n)), count) # the slotted temporary is freed, only the copy stays
+		print(f"{name:<24}{before:>10.1f}{after:>10.1f}{(1 - after / before) * 100:>7.0f}%")
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+
+"""
+Benchmark of `AsyncResolver` against local stand-in DNS servers. Two servers answer over UDP and TCP after a configured delay,
+one slower than the other, so the choice of the faster server is visible. Names starting with `nx` do not exist (NXDOMAIN with SOA),
+names starting with `big` have too many records for UDP and get a truncated reply, every other name has one A and one AAAA record.
+Reports queries per second and p50 / p99 latency of cold lookups, cached lookups, identical concurrent lookups, negative lookups
+and lookups falling back to TCP, with the resolver counters and the queries received by each server.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_dns.py [--names N] [--fast-delay S] [--slow-delay S] [--json]`
+"""
+
+
+import json
+from argparse import ArgumentParser
+from asyncio import run, gather, get_running_loop, start_server, sleep, DatagramProtocol
+from struct import pack, unpack, unpack_from
+from time import perf_counter
+
+from guixmpp.protocol.dns.client import AsyncResolver
+
+
+def encode_name(name):
+	return b''.join(bytes([len(_label)]) + _label.encode('ascii') for _label in name.split('.')) + b'\0'
+
+
+def question_of(query):
+	"Return the name, type and the question section of a query."
+
+	labels = []
+	offset = 12
+	while query[offset]:
+		labels.append(query[offset + 1:offset + 1 + query[offset]].decode('ascii'))
+		offset += 1 + query[offset]
+	qtype, = unpack_from('>H', query, offset + 1)
+	return '.'.join(labels), qtype, query[12:offset + 5]
+
+
+def record(qtype, ttl, rdata):
+	"Resource record named by a pointer to the question name."
+	return pack('>HHHIH', 0xc00c, qtype, 1, ttl, len(rdata)) + rdata
+
+
+def answer(query, tcp):
+	"Build the reply to a query, as the stand-in server does."
+
+	serial, = unpack_from('>H', query)
+	name, qtype, question = question_of(query)
+	answers = []
+	authority = []
+	rcode = 0
+	truncated = False
+
+	if name.startswith('nx'):
+		rcode = 3
+		soa = encode_name('ns.example') + encode_name('admin.example') + pack('>IIIII', 1, 3600, 600, 86400, 300)
+		authority.append(record(6, 300, soa))
+	elif name.startswith('big') and not tcp:
+		truncated = True
+	elif qtype == 1:
+		count = 64 if name.startswith('big') else 1
+		answers.extend(record(1, 300, bytes([10, 0, _n // 256, _n % 256])) for _n in range(count))
+	elif qtype == 28:
+		answers.append(record(28, 300, bytes(15) + b'\1'))
+
+	header = pack('>HHHHHH', serial, 0x8180 | (0x0200 if truncated else 0) | rcode, 1, len(answers), len(authority), 0)
+	return header + question + b''.join(answers) + b''.join(authority)
+
+
+class StandInServer(DatagramProtocol):
+	"UDP DNS server answering after `delay` seconds."
+
+	def __init__(self, delay):
+		self.delay = delay
+		self.query_counter = 0
+		self.tcp_query_counter = 0
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def datagram_received(self, query, addr):
+		self.query_counter += 1
+		get_running_loop().call_later(self.delay, self.transport.sendto, answer(query, False), addr)
+
+	async def tcp_connection(self, reader, writer):
+		try:
+			while True:
+				length, = unpack('>H', await reader.readexactly(2))
+				query = await reader.readexactly(length)
+				self.tcp_query_counter += 1
+				await sleep(self.delay)
+				reply = answer(query, True)
+				writer.write(pack('>H', len(reply)) + reply)
+		except EOFError:
+			pass
+		finally:
+			writer.close()
+
+
+async def start_stand_in(delay):
+	"Start the server on UDP and TCP on the same port. Return the server and its address."
+
+	loop = get_running_loop()
+	transport, server = await loop.create_datagram_endpoint((lambda: StandInServer(delay)), local_addr=('127.0.0.1', 0))
+	address = transport.get_extra_info('sockname')
+	tcp_server = await start_server(server.tcp_connection, address[0], address[1])
+	return server, address, (transport, tcp_server)
+
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def measure(resolver, lookups):
+	"Run the lookups concurrently. Return the number of lookups, seconds and latencies."
+
+	latencies = []
+
+	async def lookup(name, type_):
+		start = perf_counter()
+		await resolver.resolve(name, type_)
+		latencies.append(perf_counter() - start)
+
+	start = perf_counter()
+	await gather(*[lookup(_name, _type) for (_name, _type) in lookups])
+	return perf_counter() - start, latencies
+
+
+async def main(args):
+	slow, slow_address, slow_endpoints = await start_stand_in(args.slow_delay)
+	fast, fast_address, fast_endpoints = await start_stand_in(args.fast_delay)
+
+	AsyncResolver.cache.clear()
+	AsyncResolver.negative_cache.clear()
+	resolver = AsyncResolver(server=[slow_address, fast_address])
+	await resolver.open(get_running_loop())
+
+	names = [f'host{_n}.example' for _n in range(args.names)]
+
+	await resolver.resolve('warmup.example', 'A') # both servers get measured before the benchmark
+	await resolver.resolve('warmup.example', 'AAAA')
+
+	phases = [
+		('cold', [(_name, _type) for _name in names for _type in ['A', 'AAAA']]),
+		('cached', [(_name, _type) for _name in names for _type in ['A', 'AAAA']]),
+		('identical', [('same.example', 'A')] * args.names),
+		('nxdomain', [(f'nx{_n}.example', 'A') for _n in range(args.names)]),
+		('negative', [(f'nx{_n}.example', _type) for _n in range(args.names) for _type in ['A', 'AAAA']]),
+		('tcp', [(f'big{_n}.example', 'A') for _n in range(args.names // 10 or 1)])
+	]
+
+	results = []
+	for phase, lookups in phases:
+		queries = slow.query_counter + fast.query_counter + slow.tcp_query_counter + fast.tcp_query_counter
+		elapsed, latencies = await measure(resolver, lookups)
+		queries = slow.query_counter + fast.query_counter + slow.tcp_query_counter + fast.tcp_query_counter - queries
+		results.append({'phase': phase, 'lookups': len(lookups), 'queries': queries, 'lookups_per_second': len(lookups) / elapsed, 'p50_ms': percentile(latencies, 50) * 1000, 'p99_ms': percentile(latencies, 99) * 1000})
+
+	counters = {_name: getattr(resolver, _name) for _name in ['cache_hit_counter', 'cache_miss_counter', 'negative_hit_counter', 'coalesced_counter', 'tcp_fallback_counter', 'retry_counter', 'evicted_counter']}
+	servers = {'slow': {'udp': slow.query_counter, 'tcp': slow.tcp_query_counter}, 'fast': {'udp': fast.query_counter, 'tcp': fast.tcp_query_counter}}
+
+	await resolver.close()
+	for transport, tcp_server in [slow_endpoints, fast_endpoints]:
+		transport.close()
+		tcp_server.close()
+		await tcp_server.wait_closed()
+
+	if args.json:
+		for result in results:
+			print(json.dumps(dict(result, names=args.names, fast_delay=args.fast_delay, slow_delay=args.slow_delay)))
+		print(json.dumps(dict(counters=counters, servers=servers)))
+	else:
+		print(f"{'phase':<11}{'lookups':>9}{'queries':>9}{'lookups/s':>12}{'p50 ms':>9}{'p99 ms':>9}")
+		for result in results:
+			print(f"{result['phase']:<11}{result['lookups']:>9}{result['queries']:>9}{result['lookups_per_second']:>12.0f}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}")
+		print()
+		print(' '.join(f"{_name.replace('_counter', '')}={_value}" for (_name, _value) in counters.items()))
+		print(' '.join(f"{_server}: udp={_queries['udp']} tcp={_queries['tcp']}" for (_server, _queries) in servers.items()))
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description="Benchmark of the DNS resolver against local servers.")
+	parser.add_argument('--names', type=int, default=1000, help="distinct names looked up in each phase")
+	parser.add_argument('--fast-delay', type=float, default=0.002, help="reply delay of the fast server in seconds")
+	parser.add_argument('--slow-delay', type=float, default=0.02, help="reply delay of the slow server in seconds")
+	parser.add_argument('--json', action='store_true', help="print JSON objects instead of the table")
+	run(main(parser.parse_args()))
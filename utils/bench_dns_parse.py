@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+
+"""
+Micro-benchmark of `parse_dns_reply` on typical replies: a single A record, a CNAME chain, an MX set with addresses
+of the exchangers in the additional section, a large A set and an NXDOMAIN with SOA. All names are compressed the way
+servers do, pointing back to the question name. Reports microseconds per reply, replies per second and the memory
+allocated while parsing one reply (peak, as traced by `tracemalloc`).
+
+Run from the repository root: `PYTHONPATH=. utils/bench_dns_parse.py [repeat]`
+"""
+
+
+import sys
+import tracemalloc
+from struct import pack
+from time import perf_counter
+
+from guixmpp.protocol.dns.reply import parse_dns_reply
+
+
+class Message:
+	"Builder of DNS replies with name compression."
+
+	def __init__(self, serial, rcode=0):
+		self.serial = serial
+		self.rcode = rcode
+		self.data = bytearray(12)
+		self.names = {} # name suffix -> offset
+		self.counts = [0, 0, 0, 0]
+
+	def name(self, name):
+		"Encode the name at the end of the message, with a pointer to the longest suffix written before."
+
+		labels = name.split('.')
+		encoded = bytearray()
+		for n in range(len(labels)):
+			suffix = '.'.join(labels[n:])
+			if suffix in self.names:
+				return encoded + pack('>H', 0xc000 | self.names[suffix])
+			self.names[suffix] = len(self.data) + len(encoded)
+			encoded += bytes([len(labels[n])]) + labels[n].encode('ascii')
+		return encoded + b'\0'
+
+	def question(self, name, qtype):
+		self.data += self.name(name) + pack('>HH', qtype, 1)
+		self.counts[0] += 1
+
+	def record(self, section, name, qtype, rdata_parts):
+		"Append a record. `rdata_parts` are bytes or names, names are compressed."
+
+		self.data += self.name(name)
+		header = len(self.data)
+		self.data += bytes(10)
+		for part in rdata_parts:
+			self.data += self.name(part) if isinstance(part, str) else part
+		self.data[header:header + 10] = pack('>HHIH', qtype, 1, 300, len(self.data) - header - 10)
+		self.counts[section] += 1
+
+	def __bytes__(self):
+		self.data[:12] = pack('>HHHHHH', self.serial, 0x8180 | self.rcode, *self.counts)
+		return bytes(self.data)
+
+
+def replies():
+	"Return a dict of reply name -> message."
+
+	single = Message(1)
+	single.question('www.example.com', 1)
+	single.record(1, 'www.example.com', 1, [bytes([93, 184, 216, 34])])
+
+	chain = Message(2)
+	chain.question('www.example.com', 28)
+	chain.record(1, 'www.example.com', 5, ['www.cdn.example.net'])
+	chain.record(1, 'www.cdn.example.net', 5, ['edge7.eu.cdn.example.net'])
+	for n in range(4):
+		chain.record(1, 'edge7.eu.cdn.example.net', 28, [bytes(14) + pack('>H', n + 1)])
+
+	mx = Message(3)
+	mx.question('example.com', 15)
+	for n in range(10):
+		mx.record(1, 'example.com', 15, [pack('>H', n * 10), f'mx{n}.mail.example.com'])
+	for n in range(10):
+		mx.record(3, f'mx{n}.mail.example.com', 1, [bytes([10, 0, 0, n])])
+		mx.record(3, f'mx{n}.mail.example.com', 28, [bytes(15) + bytes([n])])
+
+	large = Message(4)
+	large.question('pool.example.org', 1)
+	for n in range(30):
+		large.record(1, 'pool.example.org', 1, [bytes([10, 1, n // 256, n % 256])])
+
+	nxdomain = Message(5, rcode=3)
+	nxdomain.question('missing.example.com', 1)
+	nxdomain.record(2, 'example.com', 6, ['ns1.example.com', 'hostmaster.example.com', pack('>IIIII', 2024010101, 7200, 3600, 1209600, 300)])
+
+	return {'single A': bytes(single), 'CNAME chain': bytes(chain), 'MX + glue': bytes(mx), '30 A': bytes(large), 'NXDOMAIN': bytes(nxdomain)}
+
+
+def main(repeat):
+	print(f"{'reply':<14}{'bytes':>7}{'records':>9}{'us/reply':>10}{'replies/s':>12}{'alloc B':>9}")
+	for name, message in replies().items():
+		reply, length = parse_dns_reply(message)
+		assert length == len(message)
+
+		tracemalloc.start()
+		parse_dns_reply(message)
+		allocated = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+		start = perf_counter()
+		for n in range(repeat):
+			parse_dns_reply(message)
+		elapsed = perf_counter() - start
+
+		print(f"{name:<14}{len(message):>7}{len(reply.answer):>9}{elapsed / repeat * 1e6:>10.2f}{repeat / elapsed:>12.0f}{allocated:>9}")
+
+
+if __name__ == '__main__':
+	main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+
+"""
+Benchmark of flex space distribution in rows and columns. Compares the scalar solver with the NumPy solver
+on rows with many siblings and reports the largest difference between the results.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_flex.py [repeat]`
+"""
+
+
+from os import environ
+environ.setdefault('GUIXMPP_USE_PANGO', '0')
+
+import sys
+from random import Random
+from timeit import timeit
+
+from guixmpp import boxes
+from guixmpp.boxes import distribute_space_scalar, distribute_space_numpy, inf
+
+
+def random_row(count, seed=0):
+	"Return `(available, minimums, grows, maximums)` for a row of `count` random siblings."
+
+	random = Random(seed)
+	minimums = [random.uniform(0, 20) for _n in range(count)]
+	grows = [random.choice([0, 1, 1, 2, 5]) for _n in range(count)]
+	maximums = [_min + random.choice([0, random.uniform(0, 50), random.uniform(0, 500), inf]) for _min in minimums]
+	available = sum(minimums) * 3
+	return available, minimums, grows, maximums
+
+
+if __name__ == '__main__':
+	repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+	if boxes.numpy is None:
+		print("NumPy not installed, benchmarking scalar solver only")
+
+	print(f"{'children':>10}{'scalar ms':>12}{'numpy ms':>12}{'speedup':>10}{'max diff':>12}")
+	for count in [10, 100, 1000, 5000, 10000]:
+		row = random_row(count)
+		scalar_time = timeit(lambda: distribute_space_scalar(*row), number=repeat) / repeat * 1000
+		if boxes.numpy is not None:
+			numpy_time = timeit(lambda: distribute_space_numpy(*row), number=repeat) / repeat * 1000
+			difference = max(abs(_a - _b) for (_a, _b) in zip(distribute_space_scalar(*row), distribute_space_numpy(*row)))
+			print(f"{count:>10}{scalar_time:>12.3f}{numpy_time:>12.3f}{scalar_time / numpy_time:>9.1f}x{difference:>12.2e}")
+		else:
+			print(f"{count:>10}{scalar_time:>12.3f}{'-':>12}{'-':>10}{'-':>12}")
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+
+
+"""
+Benchmark of HTTP/2 request priorities against a local stand-in server. The server sends response data over
+a bandwidth-limited link, always serving the most urgent stream first (RFC 9218), or round-robin when all
+requests have the same urgency. A page requests large images before its stylesheet and font; time to first
+render is the time until the stylesheet and the font are complete.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_h2_priority.py [images] [bandwidth MB/s]`
+"""
+
+
+import sys
+from asyncio import run, sleep, gather, get_running_loop, Event, Protocol
+from time import perf_counter
+
+import h2.config
+import h2.connection
+import h2.events
+
+from guixmpp.protocol.http.client import Connection2, resource_urgency
+
+
+default_urgency = 3
+
+
+class StandInServer(Protocol):
+	"HTTP/2 cleartext server sending resources over a link of limited bandwidth, most urgent stream first."
+	
+	def __init__(self, resources, bandwidth):
+		self.resources = resources
+		self.bandwidth = bandwidth
+		self.pending = {} # stream -> [urgency, turn, body, offset]
+		self.turn = 0
+		self.wakeup = Event()
+	
+	def connection_made(self, transport):
+		self.transport = transport
+		self.http = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+		self.http.initiate_connection()
+		self.transport.write(self.http.data_to_send())
+		self.pump_task = get_running_loop().create_task(self.pump())
+	
+	def connection_lost(self, exc):
+		self.pump_task.cancel()
+	
+	def data_received(self, data):
+		for event in self.http.receive_data(data):
+			if isinstance(event, h2.events.RequestReceived):
+				headers = dict(event.headers)
+				body = self.resources[headers[':path']]
+				urgency = default_urgency
+				for param in headers.get('priority', '').split(','):
+					if param.strip().startswith('u='):
+						urgency = int(param.strip()[2:])
+				self.http.send_headers(event.stream_id, [(':status', '200'), ('content-length', str(len(body)))])
+				self.pending[event.stream_id] = [urgency, self.turn, body, 0]
+				self.turn += 1
+			elif isinstance(event, h2.events.StreamReset):
+				self.pending.pop(event.stream_id, None)
+		self.transport.write(self.http.data_to_send())
+		self.wakeup.set()
+	
+	async def pump(self):
+		while True:
+			ready = [(_urgency, _turn, _stream) for (_stream, (_urgency, _turn, _body, _offset)) in self.pending.items() if self.http.local_flow_control_window(_stream) > 0]
+			if not ready:
+				self.wakeup.clear()
+				await self.wakeup.wait()
+				continue
+			
+			urgency, turn, stream = min(ready)
+			entry = self.pending[stream]
+			body, offset = entry[2], entry[3]
+			size = min(16384, self.http.max_outbound_frame_size, self.http.local_flow_control_window(stream), len(body) - offset)
+			end = offset + size == len(body)
+			self.http.send_data(stream, body[offset:offset + size], end_stream=end)
+			self.transport.write(self.http.data_to_send())
+			
+			if end:
+				del self.pending[stream]
+			else:
+				entry[3] += size
+				entry[1] = self.turn # round-robin between streams of the same urgency
+				self.turn += 1
+			
+			await sleep(size / self.bandwidth)
+
+
+async def load_page(port, images, prioritize):
+	"Request the images first and the render-blocking resources last. Return time to first render and total time."
+	
+	async with Connection2(f'http://127.0.0.1:{port}') as connection:
+		start = perf_counter()
+		
+		async def fetch(path, kind):
+			await connection.Url(path).get(urgency=resource_urgency[kind] if prioritize else None)
+			return perf_counter() - start
+		
+		times = await gather(*[fetch(f'/image{_n}.png', 'image') for _n in range(images)], fetch('/style.css', 'stylesheet'), fetch('/font.woff2', 'font'))
+		return max(times[-2:]), max(times)
+
+
+async def main(images, bandwidth):
+	resources = {f'/image{_n}.png': bytes(1024 * 1024) for _n in range(images)}
+	resources['/style.css'] = b"p { color: red }\n" * 1200
+	resources['/font.woff2'] = bytes(100 * 1024)
+	
+	server = await get_running_loop().create_server((lambda: StandInServer(resources, bandwidth)), '127.0.0.1', 0)
+	port = server.sockets[0].getsockname()[1]
+	
+	print(f"{'mode':<14}{'first render s':>16}{'total s':>10}")
+	async with server:
+		for mode, prioritize in [('arrival order', False), ('prioritized', True)]:
+			first_render, total = await load_page(port, images, prioritize)
+			print(f"{mode:<14}{first_render:>16.3f}{total:>10.3f}")
+
+
+if __name__ == '__main__':
+	images = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	bandwidth = float(sys.argv[2]) * 1024 * 1024 if len(sys.argv) > 2 else 8 * 1024 * 1024
+	run(main(images, bandwidth))
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+
+"""
+Benchmark of the HTTP backends selected by `GUIXMPP_HTTP` (1, 2, aiohttp, httpx) against a local stand-in server.
+The server speaks HTTP/1.1 (h11) or HTTP/2 (h2) over TLS, as negotiated by ALPN, and serves synthetic pages
+linking a number of subresources. Each backend runs in its own process (the backend is chosen on import),
+loads the pages with their subresources through `HTTPDownload.download_document` and reports requests per second,
+p50 / p99 request latency, bytes per second and CPU time of the client process. With `--json` one JSON object
+per backend is printed instead of the table, for regression tracking.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_http.py [--pages N] [--fanout N] [--page-size B] [--resource-size B] [--concurrency N] [--json] [backend ...]`
+"""
+
+
+import sys
+import os
+import ssl
+import json
+import subprocess
+from argparse import ArgumentParser
+from asyncio import run, gather, get_running_loop, create_subprocess_exec, Event, Protocol, Semaphore
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+
+import h11
+import h2.config
+import h2.connection
+import h2.events
+
+
+backends = ['1', '2', 'aiohttp', 'httpx']
+
+
+def synthetic_site(pages, fanout, page_size, resource_size):
+	"Return a dict of path -> (content type, body). Every page links `fanout` resources of its own, so nothing is shared between pages."
+	
+	resources = {}
+	for p in range(pages):
+		links = ''.join(f'<img src="/r{p}-{_r}.png"/>' for _r in range(fanout))
+		body = f'<html><body>{links}<p>'.encode('utf-8')
+		body += b'x' * max(0, page_size - len(body) - len(b'</p></body></html>')) + b'</p></body></html>'
+		resources[f'/page{p}.html'] = 'text/html', body
+		for r in range(fanout):
+			resources[f'/r{p}-{r}.png'] = 'image/png', bytes(resource_size)
+	return resources
+
+
+class StandInServer(Protocol):
+	"HTTP server answering from a dict of resources. Speaks HTTP/2 if negotiated by ALPN, else HTTP/1.1."
+	
+	def __init__(self, resources):
+		self.resources = resources
+	
+	def connection_made(self, transport):
+		self.transport = transport
+		ssl_object = transport.get_extra_info('ssl_object')
+		self.http2 = ssl_object is not None and ssl_object.selected_alpn_protocol() == 'h2'
+		if self.http2:
+			self.http = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+			self.http.initiate_connection()
+			self.pending = {} # stream -> remaining body
+			self.transport.write(self.http.data_to_send())
+		else:
+			self.http = h11.Connection(h11.SERVER)
+			self.path = None
+	
+	def response(self, path):
+		try:
+			content_type, body = self.resources[path]
+			return 200, content_type, body
+		except KeyError:
+			return 404, 'text/plain', b"not found"
+	
+	def data_received(self, data):
+		if self.http2:
+			self.h2_received(data)
+		else:
+			self.h11_received(data)
+	
+	def h11_received(self, data):
+		self.http.receive_data(data)
+		while True:
+			try:
+				event = self.http.next_event()
+			except h11.RemoteProtocolError:
+				self.transport.close()
+				return
+			
+			if event is h11.NEED_DATA or event is h11.PAUSED:
+				break
+			elif isinstance(event, h11.Request):
+				self.path = event.target.decode('utf-8')
+			elif isinstance(event, h11.EndOfMessage):
+				status, content_type, body = self.response(self.path)
+				self.transport.write(self.http.send(h11.Response(status_code=status, headers=[('content-type', content_type), ('content-length', str(len(body)))])))
+				self.transport.write(self.http.send(h11.Data(data=body)))
+				self.transport.write(self.http.send(h11.EndOfMessage()))
+				self.http.start_next_cycle()
+			elif isinstance(event, h11.ConnectionClosed):
+				self.transport.close()
+				return
+	
+	def h2_received(self, data):
+		for event in self.http.receive_data(data):
+			if isinstance(event, h2.events.RequestReceived):
+				status, content_type, body = self.response(dict(event.headers)[':path'])
+				self.http.send_headers(event.stream_id, [(':status', str(status)), ('content-type', content_type), ('content-length', str(len(body)))])
+				self.pending[event.stream_id] = body
+			elif isinstance(event, h2.events.StreamReset):
+				self.pending.pop(event.stream_id, None)
+		self.h2_send()
+	
+	def h2_send(self):
+		"Send response bodies as far as flow control windows allow. The rest is sent when the client updates the windows."
+		
+		for stream, body in list(self.pending.items()):
+			while body:
+				size = min(self.http.local_flow_control_window(stream), self.http.max_outbound_frame_size, len(body))
+				if size <= 0:
+					break
+				self.http.send_data(stream, body[:size])
+				body = body[size:]
+			if body:
+				self.pending[stream] = body
+			else:
+				self.http.end_stream(stream)
+				del self.pending[stream]
+		self.transport.write(self.http.data_to_send())
+
+
+def generate_certificate(directory):
+	cert = Path(directory) / 'cert.pem'
+	key = Path(directory) / 'key.pem'
+	subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', str(key), '-out', str(cert), '-days', '1', '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'], check=True, capture_output=True)
+	return cert, key
+
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def client_main(port, pages, concurrency):
+	"Run in the backend process: load all pages with their subresources and return the measurements."
+	
+	from guixmpp.download.http import HTTPDownload
+	from guixmpp.preload import PreloadScanner
+	
+	model = HTTPDownload()
+	await model.begin_downloads()
+	
+	latencies = []
+	transferred = 0
+	
+	async def fetch(url):
+		nonlocal transferred
+		start = perf_counter()
+		data, content_type = await model.download_document(url)
+		latencies.append(perf_counter() - start)
+		transferred += len(data)
+		return data
+	
+	slots = Semaphore(concurrency)
+	
+	async def load_page(p):
+		async with slots:
+			page = await fetch(f'https://127.0.0.1:{port}/page{p}.html')
+			await gather(*[fetch(f'https://127.0.0.1:{port}{_link}') for _link in PreloadScanner().feed(page)])
+	
+	await fetch(f'https://127.0.0.1:{port}/page0.html') # warm up: connection setup is not measured
+	latencies.clear()
+	transferred = 0
+	
+	cpu = process_time()
+	start = perf_counter()
+	await gather(*[load_page(_p) for _p in range(pages)])
+	elapsed = perf_counter() - start
+	cpu = process_time() - cpu
+	
+	await model.end_downloads()
+	if hasattr(model, 'close_connections'):
+		await model.close_connections()
+	
+	return {
+		'requests': len(latencies),
+		'seconds': elapsed,
+		'requests_per_second': len(latencies) / elapsed,
+		'p50_ms': percentile(latencies, 50) * 1000,
+		'p99_ms': percentile(latencies, 99) * 1000,
+		'bytes_per_second': transferred / elapsed,
+		'cpu_seconds': cpu,
+		'cpu_per_request_ms': cpu / len(latencies) * 1000
+	}
+
+
+async def run_backend(backend, port, cert, args):
+	"Run the client in a new process with `GUIXMPP_HTTP` set. Return the result dict, with an `error` key if the backend could not run."
+	
+	environment = dict(os.environ, GUIXMPP_HTTP=backend, SSL_CERT_FILE=str(cert))
+	process = await create_subprocess_exec(sys.executable, __file__, '--client', str(port), '--pages', str(args.pages), '--concurrency', str(args.concurrency), env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	stdout, stderr = await process.communicate()
+	if process.returncode:
+		return {'error': (stderr.decode('utf-8').strip().split('\n') or [""])[-1]}
+	return json.loads(stdout)
+
+
+async def main(args):
+	with TemporaryDirectory() as directory:
+		cert, key = generate_certificate(directory)
+		server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+		server_context.load_cert_chain(cert, key)
+		server_context.set_alpn_protocols(['h2', 'http/1.1'])
+		
+		resources = synthetic_site(args.pages, args.fanout, args.page_size, args.resource_size)
+		server = await get_running_loop().create_server((lambda: StandInServer(resources)), '127.0.0.1', 0, ssl=server_context)
+		port = server.sockets[0].getsockname()[1]
+		
+		if not args.json:
+			print(f"{'backend':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'MB/s':>9}{'cpu s':>8}{'cpu/req ms':>12}")
+		
+		async with server:
+			for backend in args.backends:
+				result = await run_backend(backend, port, cert, args)
+				if args.json:
+					print(json.dumps(dict(backend=backend, pages=args.pages, fanout=args.fanout, page_size=args.page_size, resource_size=args.resource_size, concurrency=args.concurrency, **result)))
+				elif 'error' in result:
+					print(f"{backend:<10}skipped: {result['error']}")
+				else:
+					print(f"{backend:<10}{result['requests']:>10}{result['requests_per_second']:>10.1f}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['bytes_per_second'] / 1024**2:>9.2f}{result['cpu_seconds']:>8.2f}{result['cpu_per_request_ms']:>12.3f}")
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description="Benchmark of HTTP backends against a local server.")
+	parser.add_argument('backends', nargs='*', default=backends, help="backends to compare (default: all)")
+	parser.add_argument('--pages', type=int, default=50, help="pages to load")
+	parser.add_argument('--fanout', type=int, default=20, help="subresources linked from each page")
+	parser.add_argument('--page-size', type=int, default=32 * 1024, help="page size in bytes")
+	parser.add_argument('--resource-size', type=int, default=16 * 1024, help="subresource size in bytes")
+	parser.add_argument('--concurrency', type=int, default=4, help="pages loaded at the same time")
+	parser.add_argument('--json', action='store_true', help="print one JSON object per backend")
+	parser.add_argument('--client', type=int, metavar='PORT', help="run the client against the server on PORT (internal)")
+	args = parser.parse_args()
+	
+	if args.client is not None:
+		print(json.dumps(run(client_main(args.client, args.pages, args.concurrency))))
+	else:
+		run(main(args))
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+
+"""
+Throughput benchmark of reading a file through `gtkaiopath`: whole file (`read_bytes`), chunks of several sizes (`read_chunks`)
+and `readinto` a reused buffer, against reads in a thread (`pathlib` whole file, and `readinto` in chunks) and `aiofiles`
+if installed. Also copies the file with `copy_to` (GLib splice). Reports MB/s (best of the repeats) and the peak memory
+allocated by Python during one read, as traced by `tracemalloc`, which shows whether the whole file was buffered.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_path_read.py [--size MB] [--repeat N] [--json]`
+"""
+
+
+import json
+import os
+import pathlib
+import tracemalloc
+from argparse import ArgumentParser
+from asyncio import run, to_thread
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from guixmpp.mainloop import loop_init
+from guixmpp.gtkaiopath import Path
+
+try:
+	import aiofiles
+except ImportError:
+	aiofiles = None
+
+
+async def gtk_read_bytes(path, chunk_size):
+	return len(await path.read_bytes())
+
+
+async def gtk_read_chunks(path, chunk_size):
+	size = 0
+	async for chunk in path.read_chunks(chunk_size):
+		size += len(chunk)
+	return size
+
+
+async def gtk_readinto(path, chunk_size):
+	buffer = bytearray(chunk_size)
+	size = 0
+	async with path.open('rb') as file:
+		while n := await file.readinto(buffer):
+			size += n
+	return size
+
+
+async def gtk_copy_to(path, chunk_size):
+	target = path.with_suffix('.copy')
+	size = await path.copy_to(target)
+	os.unlink(target)
+	return size
+
+
+async def thread_read_bytes(path, chunk_size):
+	return len(await to_thread(pathlib.Path(path).read_bytes))
+
+
+async def thread_readinto(path, chunk_size):
+	buffer = bytearray(chunk_size)
+	size = 0
+	with open(path, 'rb', buffering=0) as file:
+		while n := await to_thread(file.readinto, buffer):
+			size += n
+	return size
+
+
+async def aiofiles_read(path, chunk_size):
+	size = 0
+	async with aiofiles.open(path, 'rb') as file:
+		while chunk := await file.read(chunk_size):
+			size += len(chunk)
+	return size
+
+
+def methods():
+	"Return a list of (name, function, chunk size)."
+
+	result = [('gtk read_bytes', gtk_read_bytes, None)]
+	for chunk_size in [16 * 1024, 64 * 1024, 1024 * 1024]:
+		result.append((f'gtk read_chunks {chunk_size // 1024}k', gtk_read_chunks, chunk_size))
+	result.append(('gtk readinto 1024k', gtk_readinto, 1024 * 1024))
+	result.append(('gtk copy_to', gtk_copy_to, None))
+	result.append(('thread read_bytes', thread_read_bytes, None))
+	for chunk_size in [64 * 1024, 1024 * 1024]:
+		result.append((f'thread readinto {chunk_size // 1024}k', thread_readinto, chunk_size))
+	if aiofiles is not None:
+		for chunk_size in [64 * 1024, 1024 * 1024]:
+			result.append((f'aiofiles {chunk_size // 1024}k', aiofiles_read, chunk_size))
+	return result
+
+
+async def main(args):
+	with TemporaryDirectory() as directory:
+		path = Path(directory) / 'data.bin'
+		size = args.size * 1024 * 1024
+		with open(path, 'wb') as file:
+			for n in range(args.size):
+				file.write(os.urandom(1024 * 1024))
+
+		results = []
+		for name, method, chunk_size in methods():
+			assert await method(path, chunk_size) == size, name # warm up the page cache
+
+			best = None
+			for n in range(args.repeat):
+				start = perf_counter()
+				await method(path, chunk_size)
+				elapsed = perf_counter() - start
+				best = elapsed if best is None else min(best, elapsed)
+
+			tracemalloc.start()
+			await method(path, chunk_size)
+			allocated = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+			results.append({'method': name, 'mb_per_second': args.size / best, 'peak_kib': allocated / 1024})
+
+	if args.json:
+		for result in results:
+			print(json.dumps(dict(result, size_mb=args.size)))
+	else:
+		print(f"{'method':<24}{'MB/s':>10}{'peak KiB':>12}")
+		for result in results:
+			print(f"{result['method']:<24}{result['mb_per_second']:>10.0f}{result['peak_kib']:>12.0f}")
+		if aiofiles is None:
+			print("(aiofiles not installed, skipped)")
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description="Benchmark of file reads through gtkaiopath against reads in threads.")
+	parser.add_argument('--size', type=int, default=64, help="file size in MB")
+	parser.add_argument('--repeat', type=int, default=5, help="timed reads per method, the best is reported")
+	parser.add_argument('--json', action='store_true', help="print JSON objects instead of the table")
+	loop_init()
+	run(main(parser.parse_args()))
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+
+"""
+Benchmark of table layout on generated tables. Reports time per cell of the first layout (that measures cell content)
+and of a resize (that only distributes column widths and measures row heights), to show both scale linearly.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_table.py [columns]`
+"""
+
+
+import sys
+from random import Random
+from time import perf_counter
+
+from guixmpp.table import TableLayout
+
+
+def generate_table(rows, columns, seed=0):
+	"Return a table with a header row, random cell texts and occasional column and row spans."
+	
+	random = Random(seed)
+	table = TableLayout(border_spacing=2)
+	table.add_row_group('header')
+	table.add_row()
+	for c in range(columns):
+		table.add_cell(f"column {c}")
+	
+	table.add_row_group('body')
+	for r in range(rows - 1):
+		table.add_row()
+		c = 0
+		while c < columns:
+			colspan = 2 if (random.random() < 0.05 and c + 1 < columns) else 1
+			rowspan = 2 if random.random() < 0.02 else 1
+			table.add_cell(" ".join("word" * random.randint(1, 3) for _n in range(random.randint(1, 8))), colspan=colspan, rowspan=rowspan)
+			c += colspan
+	
+	return table
+
+
+shaped = 0
+
+def content_widths(text):
+	"Stand-in for text shaping: 7 pixels per character."
+	global shaped
+	shaped += 1
+	return max(len(_word) for _word in text.split()) * 7, len(text) * 7
+
+
+def content_height(text, width):
+	return max(1, -(-len(text) * 7 // max(int(width), 1))) * 15
+
+
+if __name__ == '__main__':
+	columns = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	
+	print(f"{'cells':>8}{'layout ms':>12}{'us/cell':>10}{'resize ms':>12}{'us/cell':>10}{'shaped':>9}")
+	for cells in [1000, 10000, 40000]:
+		table = generate_table(cells // columns, columns)
+		count = sum(1 for _cell in table.cells())
+		
+		shaped = 0
+		start = perf_counter()
+		table.layout(800, True, content_widths, content_height)
+		layout_time = perf_counter() - start
+		
+		start = perf_counter()
+		for width in range(600, 1000, 40):
+			table.layout(width, True, content_widths, content_height)
+		resize_time = (perf_counter() - start) / 10
+		
+		print(f"{count:>8}{layout_time * 1000:>12.2f}{layout_time / count * 1e6:>10.2f}{resize_time * 1000:>12.2f}{resize_time / count * 1e6:>10.2f}{shaped:>9}")
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+
+"""
+Benchmark of TLS session resumption against a local stand-in server. Opens connections to the same host one after another
+and reports the handshake times of the first (full) handshake and of the following (resumed) ones, for HTTP/1.1 and HTTP/2
+contexts. The certificate is generated with the `openssl` command unless provided.
+
+Run from the repository root: `PYTHONPATH=. utils/bench_tls_resumption.py [connections] [cert.pem key.pem]`
+"""
+
+
+import sys
+import ssl
+import subprocess
+from asyncio import run, get_running_loop, Protocol
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+
+from guixmpp.protocol.http.client import Connection1, Connection2, shared_ssl_context
+
+
+class StandInServer(Protocol):
+	"Server that only completes the TLS handshake and closes the connection when the client does."
+	
+	def connection_made(self, transport):
+		self.transport = transport
+	
+	def data_received(self, data):
+		pass
+
+
+def generate_certificate(directory):
+	cert = Path(directory) / 'cert.pem'
+	key = Path(directory) / 'key.pem'
+	subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', str(key), '-out', str(cert), '-days', '1', '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost'], check=True, capture_output=True)
+	return cert, key
+
+
+async def connect(connection_class, port, count):
+	"Open `count` connections one after another and return the TLS handshake times."
+	
+	times = []
+	for n in range(count):
+		connection = connection_class(f'https://localhost:{port}')
+		await connection.open()
+		start, end = connection.open_timing.get('tls', connection.open_timing['connect'])
+		times.append(end - start)
+		connection.save_tls_session()
+		await connection.close()
+	return times
+
+
+async def main(count, cert, key):
+	server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+	server_context.load_cert_chain(cert, key)
+	server_context.set_alpn_protocols(['h2', 'http/1.1'])
+	
+	server = await get_running_loop().create_server(StandInServer, '127.0.0.1', 0, ssl=server_context)
+	port = server.sockets[0].getsockname()[1]
+	
+	print(f"{'protocol':<10}{'full ms':>10}{'resumed ms':>12}{'full':>6}{'resumed':>9}")
+	async with server:
+		for name, connection_class, alpn in [('http/1.1', Connection1, ('http/1.1',)), ('h2', Connection2, ('h2',))]:
+			context = shared_ssl_context(alpn)
+			context.load_verify_locations(cert)
+			if connection_class is Connection2:
+				connection_class = type('HandshakeOnly', (Connection1,), {'create_ssl_context': lambda self: shared_ssl_context(('h2',))}) # the stand-in server does not speak HTTP/2 framing
+			times = await connect(connection_class, port, count)
+			print(f"{name:<10}{times[0] * 1000:>10.2f}{median(times[1:]) * 1000:>12.2f}{context.full_handshake_counter:>6}{context.resumed_handshake_counter:>9}")
+
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+	if len(sys.argv) > 3:
+		run(main(count, sys.argv[2], sys.argv[3]))
+	else:
+		with TemporaryDirectory() as directory:
+			run(main(count, *generate_certificate(directory)))